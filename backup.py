@@ -0,0 +1,131 @@
+import os
+import glob
+import time
+import shutil
+import sqlite3
+import threading
+import subprocess
+import traceback
+import db
+
+# ==========================================
+# 💾 ONLINE BACKUPS
+# ==========================================
+# SQLite: online backup API, thode thode pages per step with a sleep in
+# between, from its own connection (WAL: readers never block the writer),
+# so game settlement keeps committing. Copy goes to a .tmp file and is
+# renamed only after a quick_check, so a torn backup never looks valid.
+# Postgres: pg_dump (custom format) in a subprocess, if it is installed.
+
+BACKUP_DIR = os.environ.get("DB_BACKUP_DIR", "backups")
+BACKUP_HOURS = float(os.environ.get("DB_BACKUP_HOURS", "6"))   # 0 = scheduler off
+BACKUP_KEEP = int(os.environ.get("DB_BACKUP_KEEP", "7"))
+PAGES_PER_STEP = int(os.environ.get("DB_BACKUP_PAGES", "256"))
+STEP_SLEEP = 0.01       # Yield between steps
+MAX_RESTARTS = 5        # Source keeps changing -> finish in one (still non-blocking in WAL) pass
+
+class BackupTask:
+    def __init__(self, folder=BACKUP_DIR, hours=BACKUP_HOURS, keep=BACKUP_KEEP):
+        self.folder = folder
+        self.interval = hours * 3600
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.running = False
+        self.status = {"state": "idle", "progress": 0.0, "last_file": None, "last_size": 0,
+                       "last_seconds": 0.0, "last_at": None, "restarts": 0, "error": None}
+
+    def start(self):
+        if self.running or self.interval <= 0: return
+        self.running = True
+        threading.Thread(target=self.loop, daemon=True).start()
+        print(f"[Backup] Every {self.interval / 3600:g}h -> {self.folder}/ (keep {self.keep})")
+
+    def loop(self):
+        time.sleep(60) # Let startup settle
+        while self.running:
+            last = self.latest()
+            due = (last is None) or (time.time() - os.path.getmtime(last) >= self.interval)
+            if due: self.run()
+            time.sleep(min(self.interval, 600))
+
+    def latest(self):
+        files = self.files()
+        return files[-1] if files else None
+
+    def files(self):
+        return sorted(glob.glob(os.path.join(self.folder, "bot-*.db")) + glob.glob(os.path.join(self.folder, "bot-*.dump")))
+
+    def run(self):
+        """One backup now (blocking the caller only). Returns the file path or None"""
+        if not self.lock.acquire(blocking=False): return None # Already running
+        start = time.time()
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            stamp = time.strftime("%Y%m%d-%H%M%S")
+            self.status.update(state="running", progress=0.0, restarts=0, error=None)
+            path = self._pg_dump(stamp) if db.IS_POSTGRES else self._sqlite_backup(stamp)
+            if path:
+                self.status.update(last_file=path, last_size=os.path.getsize(path), last_at=int(time.time()))
+                self.prune()
+            return path
+        except Exception as e:
+            traceback.print_exc()
+            self.status["error"] = str(e)
+            return None
+        finally:
+            self.status.update(state="idle", last_seconds=round(time.time() - start, 2))
+            print(f"[Backup] {self.status['last_file'] if not self.status['error'] else 'FAILED'} in {self.status['last_seconds']}s")
+            self.lock.release()
+
+    def _sqlite_backup(self, stamp):
+        final = os.path.join(self.folder, f"bot-{stamp}.db")
+        tmp = final + ".tmp"
+        seen = {"remaining": None}
+
+        def progress(status, remaining, total):
+            if seen["remaining"] is not None and remaining >= seen["remaining"]:
+                self.status["restarts"] += 1 # Source changed under us, step restarted
+                if self.status["restarts"] > MAX_RESTARTS: raise _Restart()
+            seen["remaining"] = remaining
+            self.status["progress"] = round(100.0 * (total - remaining) / total, 1) if total else 100.0
+            time.sleep(STEP_SLEEP)
+
+        src = sqlite3.connect(db.SQLITE_PATH, timeout=20)
+        dst = sqlite3.connect(tmp)
+        try:
+            try: src.backup(dst, pages=PAGES_PER_STEP, progress=progress)
+            except _Restart:
+                src.backup(dst, pages=-1) # One pass: a WAL read snapshot, writers unaffected
+            if dst.execute("PRAGMA quick_check").fetchone()[0] != "ok": raise RuntimeError("backup failed quick_check")
+        finally:
+            dst.close(); src.close()
+        os.replace(tmp, final)
+        self.status["progress"] = 100.0
+        return final
+
+    def _pg_dump(self, stamp):
+        exe = shutil.which("pg_dump")
+        if not exe:
+            self.status["error"] = "pg_dump not installed"
+            return None
+        final = os.path.join(self.folder, f"bot-{stamp}.dump")
+        tmp = final + ".tmp"
+        # Postgres MVCC snapshot: settlement is not paused; nice = lower CPU priority
+        cmd = ([shutil.which("nice")] if shutil.which("nice") else []) + [exe, "--format=custom", f"--file={tmp}", db.DATABASE_URL]
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=6 * 3600)
+        os.replace(tmp, final)
+        self.status["progress"] = 100.0
+        return final
+
+    def prune(self):
+        for old in self.files()[:-self.keep] if self.keep > 0 else []:
+            try: os.remove(old)
+            except OSError: pass
+
+class _Restart(Exception):
+    pass
+
+task = BackupTask()
+
+if __name__ == "__main__":
+    print(task.run())
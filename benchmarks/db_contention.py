@@ -0,0 +1,64 @@
+"""
+Settlement contention benchmark.
+
+Runs N concurrent "settlers" against a scratch SQLite DB (or DATABASE_URL if
+it points at Postgres). Each settlement is the same sequence a game uses:
+check_and_deduct_chips (bet) + add_game_result (payout).
+
+Usage: python benchmarks/db_contention.py [--users 1000] [--per-thread 200]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+
+if not os.environ.get("DATABASE_URL", "").startswith("postgres"):
+    _tmp = tempfile.mkdtemp(prefix="bench_db_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp, 'bench.db')}"
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import db
+
+SETTLER_COUNTS = [1, 10, 100]
+
+def settle(uid):
+    if db.check_and_deduct_chips(uid, uid, 10):
+        db.add_game_result(uid, uid, "bench", random.choice([-10, 10]), is_win=True, points_reward=1)
+
+def run(settlers, users, per_thread):
+    total = max(per_thread, 1000 // settlers)
+    barrier = threading.Barrier(settlers + 1)
+
+    def worker():
+        barrier.wait()
+        for _ in range(total):
+            settle(random.choice(users))
+
+    threads = [threading.Thread(target=worker) for _ in range(settlers)]
+    for t in threads: t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - start
+    ops = settlers * total
+    return {"settlers": settlers, "settlements": ops, "seconds": round(elapsed, 3), "per_sec": round(ops / elapsed, 1)}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=1000)
+    ap.add_argument("--per-thread", type=int, default=20)
+    opts = ap.parse_args()
+
+    db.init_db()
+    users = [f"bench_{i}" for i in range(opts.users)]
+    for uid in users: db.get_user_data(uid, uid)
+
+    results = [run(n, users, opts.per_thread) for n in SETTLER_COUNTS]
+    print(json.dumps({"backend": "postgres" if db.IS_POSTGRES else "sqlite", "results": results}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Economy DB benchmark suite.
+
+Runs the real db.py / leaderboard / economy functions against a synthetic
+user population and reports ops/sec + latency percentiles per operation
+and thread count, as JSON. Run it before and after every DB change.
+
+SQLite (scratch file) by default. Pass --postgres DSN to run against a
+local Postgres instead; bench rows use the "bench_" id prefix and are
+deleted at the end, but still point it at a scratch database.
+
+Usage:
+    python benchmarks/db_suite.py [--users 10000] [--threads 1,4,16] [--ops 2000]
+                                  [--only get_user_data,gls] [--postgres DSN] [--out result.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+GAMES = ["mines", "tictactoe", "coinflip", "penalty", "cookies"]
+SEED_CHUNK = 10000
+
+class _Bot:
+    """get_target_info only needs room_details; empty = always the DB path"""
+    room_details = {}
+
+def percentile(sorted_vals, p):
+    if not sorted_vals: return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(len(sorted_vals) * p / 100.0))]
+
+def seed(db, n):
+    """Bulk-inserts n bench users (+ game_stats for ~1/3 of them)"""
+    ph = db.get_ph()
+    user_q = f"INSERT INTO users (user_id, username, points, chips, wins) VALUES ({ph}, {ph}, {ph}, {ph}, {ph}) ON CONFLICT(user_id) DO NOTHING"
+    stats_q = f"INSERT INTO game_stats (user_id, game_name, wins, earnings) VALUES ({ph}, {ph}, {ph}, {ph}) ON CONFLICT(user_id, game_name) DO NOTHING"
+    rnd = random.Random(42)
+    start = time.perf_counter()
+    for lo in range(0, n, SEED_CHUNK):
+        ids = range(lo, min(n, lo + SEED_CHUNK))
+        with db.write_scope(), db.transaction() as cur:
+            cur.executemany(user_q, [(f"bench_{i}", f"Player{i}", rnd.randrange(5000), rnd.randrange(1000, 500000), rnd.randrange(300)) for i in ids])
+            cur.executemany(stats_q, [(f"bench_{i}", rnd.choice(GAMES), rnd.randrange(50), rnd.randrange(-5000, 50000)) for i in ids if i % 3 == 0])
+    return round(time.perf_counter() - start, 2)
+
+def cleanup(db):
+    with db.write_cursor() as cur:
+        cur.execute("DELETE FROM game_stats WHERE user_id LIKE 'bench_%'")
+        cur.execute("DELETE FROM users WHERE user_id LIKE 'bench_%'")
+        if db.LEDGER: cur.execute("DELETE FROM ledger WHERE user_id LIKE 'bench_%'")
+
+def build_ops(db, leaderboard, economy, n):
+    """{name: fn(rnd)} - each call is one logical operation"""
+    uid = lambda rnd: f"bench_{rnd.randrange(n)}"
+    ops = {
+        "get_user_data": lambda rnd: db.get_user_data(uid(rnd), "x"),
+        "check_and_deduct_chips": lambda rnd: db.check_and_deduct_chips(uid(rnd), "x", 10),
+        "add_game_result": lambda rnd: db.add_game_result(uid(rnd), "x", rnd.choice(GAMES), rnd.choice([-10, 10, 25]), rnd.random() < 0.5, 1),
+        "gls": lambda rnd: leaderboard.boards.top("points", 10),
+        "nx_deep": lambda rnd: leaderboard.boards.after("chips", (rnd.randrange(1000, 500000), "bench_0"), 10),
+        "rank": lambda rnd: leaderboard.boards.rank("chips", uid(rnd)),
+        "rank_page_sql": lambda rnd: db.get_rank_page("chips", (rnd.randrange(1000, 500000), "bench_0"), 10),
+    }
+    if economy:
+        ops["get_target_info"] = lambda rnd: economy.get_target_info(_Bot, None, f"player{rnd.randrange(n)}")
+    return ops
+
+def run_op(fn, threads, total_ops):
+    per_thread = max(1, total_ops // threads)
+    barrier = threading.Barrier(threads + 1)
+    lat = [[] for _ in range(threads)]
+
+    def worker(i):
+        rnd, out = random.Random(i), lat[i]
+        barrier.wait()
+        for _ in range(per_thread):
+            t0 = time.perf_counter()
+            fn(rnd)
+            out.append(time.perf_counter() - t0)
+
+    ts = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in ts: t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in ts: t.join()
+    elapsed = time.perf_counter() - start
+    all_lat = sorted(x for l in lat for x in l)
+    ms = lambda v: round(v * 1000, 3)
+    return {"threads": threads, "ops": len(all_lat), "ops_per_sec": round(len(all_lat) / elapsed, 1),
+            "p50_ms": ms(percentile(all_lat, 50)), "p95_ms": ms(percentile(all_lat, 95)),
+            "p99_ms": ms(percentile(all_lat, 99)), "max_ms": ms(all_lat[-1] if all_lat else 0)}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=10000, help="synthetic population (10k..1M)")
+    ap.add_argument("--threads", default="1,4,16")
+    ap.add_argument("--ops", type=int, default=2000, help="operations per (op, thread count)")
+    ap.add_argument("--only", default="", help="comma separated op names")
+    ap.add_argument("--postgres", default="", help="scratch Postgres DSN (default: temp SQLite file)")
+    ap.add_argument("--out", default="")
+    opts = ap.parse_args()
+
+    # db.py reads its config at import time
+    if opts.postgres:
+        os.environ["DATABASE_URL"] = opts.postgres
+    elif not os.environ.get("DATABASE_URL", "").startswith("postgres"):
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='bench_db_'), 'bench.db')}"
+    import db
+    import leaderboard
+    try: from plugins import economy
+    except Exception as e:
+        economy = None
+        print(f"[Bench] get_target_info skipped: {e}", file=sys.stderr)
+
+    db.init_db()
+    report = {"backend": "postgres" if db.IS_POSTGRES else "sqlite", "users": opts.users,
+              "write_behind": db.WRITE_BEHIND, "ledger": db.LEDGER, "seed_seconds": seed(db, opts.users)}
+    t0 = time.perf_counter()
+    leaderboard.boards.reload()
+    report["leaderboard_seed_seconds"] = round(time.perf_counter() - t0, 3)
+
+    ops = build_ops(db, leaderboard, economy, opts.users)
+    wanted = [o for o in opts.only.split(",") if o] or list(ops)
+    report["results"] = {}
+    try:
+        for name in wanted:
+            if name not in ops: continue
+            report["results"][name] = [run_op(ops[name], int(t), opts.ops) for t in opts.threads.split(",")]
+            print(f"[Bench] {name} done", file=sys.stderr)
+        report["cache"] = db.cache.stats()
+    finally:
+        if db.journal.running: db.journal.flush()
+        if db.IS_POSTGRES: cleanup(db)
+
+    out = json.dumps(report, indent=2)
+    if opts.out:
+        with open(opts.out, "w") as f: f.write(out)
+    print(out)
+
+if __name__ == "__main__":
+    main()
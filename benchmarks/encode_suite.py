@@ -0,0 +1,110 @@
+"""
+Image encoder benchmark.
+
+Renders every card renderer in the repo once with sample data, then encodes
+each card with every utils.ENCODER_PROFILES entry and reports encode ms
+(median of --repeat runs) and payload bytes per (renderer, profile), as JSON.
+WebP profiles are measured as WebP even if IMG_WEBP is off.
+
+No network needed: avatar/emoji fetches fail fast into each renderer's
+fallback art (a temp ASSET_CACHE_DIR is used, so the real cache is untouched).
+
+Usage:
+    python benchmarks/encode_suite.py [--repeat 5] [--only tictactoe_board,mines_board]
+                                      [--profiles png,png_fast] [--out result.json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+def _mines_game(mines):
+    g = mines.MinesGame("bench", "1", "alice", None)
+    g.p2_id, g.p2_name = "2", "bob"
+    g.board_p1 = [1, 0, 0, 1, 0, 0, 1, 0, 0, 1, 0, 0]
+    g.revealed_p1 = [i % 3 == 0 for i in range(12)]
+    return g
+
+def _cookie_game(cookies):
+    g = cookies.CookieGame("bench", "1", "alice")
+    g.add_player("2", "bob"); g.add_player("3", "carol")
+    g.start_game()
+    for i in range(0, 36, 4): g.opened[i], g.opened_by[i] = True, "alice"
+    return g
+
+def renderers():
+    """{name: fn() -> PIL image}; plugins that fail to import are skipped"""
+    from plugins import tictactoe, coinflip, penalty, mines, cookies_blast, help, designer, slap, welcome
+    board = ["X", "O", "3", "4", "X", "6", "O", "8", "9"]
+    return {
+        "tictactoe_board": lambda: tictactoe.draw_premium_board(board),
+        "tictactoe_victory": lambda: tictactoe.draw_victory_card("alice", 500, 10, "1", None),
+        "coinflip_result": lambda: coinflip.draw_result_card("alice", "1", None, "heads", True, 100, 200),
+        "penalty_card": lambda: penalty.draw_penalty_card("alice", "1", None, "GOAL", 1, 2, 200),
+        "mines_board": lambda: mines.draw_grid_board(_mines_game(mines)),
+        "mines_setup": mines.draw_setup_instructions,
+        "mines_blast": lambda: mines.draw_blast_card("alice", None),
+        "mines_winner": lambda: mines.draw_winner_card("alice", 500, 10, None),
+        "cookies_board": lambda: cookies_blast.render_board(_cookie_game(cookies_blast)),
+        "cookies_blast": lambda: cookies_blast.render_blast("alice"),
+        "cookies_winner": lambda: cookies_blast.render_winner("alice", 7),
+        "help_list": lambda: help.draw_list_card(["mines", "tictactoe", "coinflip", "penalty", "cookies"]),
+        "help_card": lambda: help.draw_help_card("mines", "Set 4 bombs, then take turns opening boxes. " * 4),
+        "designer_square": lambda: designer.create_square_design("alice", "Sample quote for the encoder bench"),
+        "designer_sticker": lambda: designer.create_sticker_design("alice", "Hello there"),
+        "slap_card": lambda: slap.draw_slap_card("alice", "bob", "m"),
+        "welcome_card": lambda: welcome.render_card("alice", "Lobby", None),
+    }
+
+def bench_encode(utils, img, profile, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        data, ext = utils.encode(img, profile, webp=True)
+        times.append(time.perf_counter() - t0)
+    return {"ext": ext, "bytes": len(data), "encode_ms": round(statistics.median(times) * 1000, 2)}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--only", default="", help="comma separated renderer names")
+    ap.add_argument("--profiles", default="", help="comma separated profile names (default: all)")
+    ap.add_argument("--out", default="")
+    opts = ap.parse_args()
+
+    os.environ.setdefault("ASSET_CACHE_DIR", tempfile.mkdtemp(prefix="bench_assets_"))
+    if not os.environ.get("DATABASE_URL", "").startswith("postgres"):
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='bench_db_'), 'bench.db')}"
+    import utils
+
+    cards = renderers()
+    wanted = [n for n in opts.only.split(",") if n] or list(cards)
+    profiles = [p for p in opts.profiles.split(",") if p] or list(utils.ENCODER_PROFILES)
+    report = {"repeat": opts.repeat, "default_profile": utils.ENCODE_PROFILE, "results": {}}
+    for name in wanted:
+        if name not in cards: continue
+        try:
+            t0 = time.perf_counter()
+            img = cards[name]()
+            render_ms = round((time.perf_counter() - t0) * 1000, 1)
+        except Exception as e:
+            print(f"[Bench] {name} skipped: {e}", file=sys.stderr)
+            continue
+        row = {"size": list(img.size), "mode": img.mode, "render_ms": render_ms, "profiles": {}}
+        for p in profiles:
+            row["profiles"][p] = bench_encode(utils, img, p, opts.repeat)
+        report["results"][name] = row
+        print(f"[Bench] {name} done", file=sys.stderr)
+
+    out = json.dumps(report, indent=2)
+    if opts.out:
+        with open(opts.out, "w") as f: f.write(out)
+    print(out)
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,7 @@ import requests
 import traceback
 from plugin_loader import PluginManager
 from db import init_db
+import backup
 
 API_URL = "https://api.howdies.app/api/login"
 WS_URL = "wss://app.howdies.app/howdies?token={}"
@@ -23,6 +24,7 @@ class HowdiesBot:
         
         self.lock = threading.Lock() 
         init_db()
+        backup.task.start() # Scheduled online backups (DB_BACKUP_HOURS=0 turns it off)
         self.plugins = PluginManager(self)
         
         # --- BOSS SETTINGS ---
@@ -170,22 +172,9 @@ class HowdiesBot:
     def send_message(self, room_id, text):
         self.send_json({"handler": "chatroommessage", "id": uuid.uuid4().hex, "type": "text", "roomid": room_id, "text": text})
 
-    def upload_to_server(self, image_bytes, file_type='png'):
-        import io
-        try:
-            if not isinstance(image_bytes, (bytes, bytearray)):
-                img_byte_arr = io.BytesIO()
-                image_bytes.save(img_byte_arr, format=file_type.upper())
-                image_bytes = img_byte_arr.getvalue()
-            url = "https://api.howdies.app/api/upload"
-            mime = 'image/gif' if file_type.lower() == 'gif' else 'image/png'
-            files = {'file': (f'upload.{file_type}', image_bytes, mime)}
-            data = {'token': self.token, 'uploadType': 'image', 'UserID': self.user_id if self.user_id else 0}
-            r = requests.post(url, files=files, data=data, timeout=15)
-            if r.status_code == 200:
-                res = r.json()
-                return res.get('url') or res.get('data', {}).get('url')
-            return None
+    def upload_to_server(self, image_bytes, file_type='png', key=None, profile=None):
+        import utils # Shared session + content-hash dedup / persistent URL cache
+        try: return utils.upload(self, image_bytes, file_type, key, profile)
         except: return None
 
     def send_dm(self, username, text):
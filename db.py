@@ -1,131 +1,948 @@
 import os
+import json
+import uuid
+import atexit
 import sqlite3
 import psycopg2
 import threading
+import time
 import traceback
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
 from urllib.parse import urlparse
 
 # CONFIG
 DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///bot.db")
-db_lock = threading.Lock()
+IS_POSTGRES = DATABASE_URL.startswith("postgres")
+SQLITE_PATH = None if IS_POSTGRES else (DATABASE_URL.split("sqlite:///", 1)[-1] or "bot.db")
+LOCK_STRIPES = 64 # Per-user lock buckets (SQLite read-modify-write)
+
+# Write-behind (optional): game results are journaled and group-committed
+WRITE_BEHIND = os.environ.get("DB_WRITE_BEHIND", "0") == "1"
+FLUSH_INTERVAL_MS = int(os.environ.get("DB_FLUSH_MS", "500"))
+FLUSH_MAX_ENTRIES = int(os.environ.get("DB_FLUSH_MAX", "200"))
+JOURNAL_PATH = os.environ.get("DB_JOURNAL_PATH", "db_journal.log")
+
+# Ledger (optional): game results are appended as signed ledger rows and
+# folded into users by the compactor, instead of hot-row UPDATEs
+LEDGER = os.environ.get("DB_LEDGER", "0") == "1"
+COMPACT_INTERVAL_S = float(os.environ.get("DB_COMPACT_S", "5"))
+LEDGER_KEEP_DAYS = int(os.environ.get("DB_LEDGER_KEEP_DAYS", "30")) # Compacted rows kept for audit, 0 = forever
+
+# User cache: bounded LRU of users rows + game_stats, TTL as safety net
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "5000"))
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", "60"))
+
+# CONCURRENCY
+# Postgres apni locking khud karta hai, so no process-wide lock there.
+# SQLite allows one writer at a time: we keep ONE shared writer connection
+# behind write_lock, and every thread gets its own WAL reader connection.
+# Lock order (never reversed): write_lock/gate -> journal.lock -> listener locks.
+# (journal.flush_lock -> compactor.lock are only ever taken before write_lock.)
+write_lock = threading.RLock()
+_user_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+_local = threading.local()
+_writer_conn = None
+
+def _open_sqlite():
+    conn = sqlite3.connect(SQLITE_PATH, check_same_thread=False, timeout=20)
+    conn.isolation_level = None # Autocommit mode
+    return conn
 
 def get_connection():
-    if DATABASE_URL.startswith("postgres"):
+    if IS_POSTGRES:
         conn = psycopg2.connect(DATABASE_URL, sslmode='require')
         conn.autocommit = True
         return conn
     else:
-        conn = sqlite3.connect("bot.db", check_same_thread=False, timeout=20)
-        conn.isolation_level = None # Autocommit mode
-        return conn
+        return _open_sqlite()
 
 def get_ph():
-    return "%s" if DATABASE_URL.startswith("postgres") else "?"
+    return "%s" if IS_POSTGRES else "?"
 
-def init_db():
-    with db_lock:
+def user_lock(user_id):
+    """Striped lock for read-modify-write sequences on one user (SQLite only)"""
+    if IS_POSTGRES: return nullcontext()
+    return _user_locks[hash(str(user_id)) % LOCK_STRIPES]
+
+class _Gate:
+    """
+    Postgres writers share it across commit + cache update + _notify, and
+    snapshot_scope() takes it alone: no write is then half way between its
+    commit and its listeners. Re-entrant for shared holders.
+    """
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.shared = 0
+        self.exclusive = False
+        self.local = threading.local()
+
+    @contextmanager
+    def share(self):
+        depth = getattr(self.local, "depth", 0)
+        if not depth:
+            with self.cond:
+                while self.exclusive: self.cond.wait()
+                self.shared += 1
+        self.local.depth = depth + 1
+        try: yield
+        finally:
+            self.local.depth = depth
+            if not depth:
+                with self.cond:
+                    self.shared -= 1
+                    if not self.shared: self.cond.notify_all()
+
+    @contextmanager
+    def alone(self):
+        with self.cond:
+            while self.exclusive: self.cond.wait()
+            self.exclusive = True # New writers wait from here
+            while self.shared: self.cond.wait()
+        try: yield
+        finally:
+            with self.cond:
+                self.exclusive = False
+                self.cond.notify_all()
+
+_gate = _Gate()
+
+def write_scope():
+    """Keeps the SQLite writer across a write + its cache update (shared gate on Postgres)"""
+    return _gate.share() if IS_POSTGRES else write_lock
+
+def snapshot_scope():
+    """No write in flight while held: every delta is either committed + notified, or not started"""
+    return _gate.alone() if IS_POSTGRES else write_lock
+
+@contextmanager
+def read_cursor():
+    """Read-only cursor: fresh conn on Postgres, per-thread WAL reader on SQLite"""
+    if IS_POSTGRES:
         conn = get_connection()
-        try:
-            cur = conn.cursor()
-            if not DATABASE_URL.startswith("postgres"):
-                cur.execute("PRAGMA journal_mode=WAL")
-            cur.execute("CREATE TABLE IF NOT EXISTS users (user_id TEXT PRIMARY KEY, username TEXT, points BIGINT DEFAULT 0, chips BIGINT DEFAULT 10000, wins INTEGER DEFAULT 0)")
-            cur.execute("CREATE TABLE IF NOT EXISTS game_stats (user_id TEXT, game_name TEXT, wins INTEGER DEFAULT 0, earnings BIGINT DEFAULT 0, PRIMARY KEY (user_id, game_name))")
-            cur.execute("CREATE TABLE IF NOT EXISTS bot_admins (user_id TEXT PRIMARY KEY)")
-            print("[DB] Final Foundation Initialized.")
-        except: traceback.print_exc()
+        try: yield conn.cursor()
         finally: conn.close()
+        return
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = _open_sqlite()
+    yield conn.cursor()
 
-# ECONOMY CORE
-def get_user_data(user_id, username="Unknown"):
-    ph, uid = get_ph(), str(user_id)
-    with db_lock:
+@contextmanager
+def write_cursor():
+    """Write cursor: fresh conn on Postgres, the single shared writer on SQLite"""
+    global _writer_conn
+    if IS_POSTGRES:
         conn = get_connection()
+        try: yield conn.cursor()
+        finally: conn.close()
+        return
+    with write_lock:
+        if _writer_conn is None: _writer_conn = _open_sqlite()
+        yield _writer_conn.cursor()
+
+@contextmanager
+def transaction():
+    """BEGIN ... COMMIT on the write connection (ROLLBACK on error)"""
+    with write_cursor() as cur:
+        cur.execute("BEGIN" if IS_POSTGRES else "BEGIN IMMEDIATE")
         try:
-            cur = conn.cursor()
-            cur.execute(f"SELECT points, chips FROM users WHERE user_id = {ph}", (uid,))
-            row = cur.fetchone()
-            if row: return {"points": row[0], "chips": row[1]}
-            cur.execute(f"INSERT INTO users (user_id, username) VALUES ({ph}, {ph})", (uid, str(username)))
-            return {"points": 0, "chips": 10000}
+            yield cur
+            cur.execute("COMMIT")
         except:
-            traceback.print_exc()
-            return {"points": 0, "chips": 10000}
-        finally: conn.close()
+            cur.execute("ROLLBACK")
+            raise
+
+def init_db():
+    try:
+        if not IS_POSTGRES:
+            with write_cursor() as cur: cur.execute("PRAGMA journal_mode=WAL").fetchone()
+        import migrations # Tables + indexes live there now (versioned)
+        migrations.migrate()
+        print("[DB] Final Foundation Initialized.")
+    except: traceback.print_exc()
+    if LEDGER: compactor.start()
+    if WRITE_BEHIND: journal.start()
+
+# ECONOMY CORE
+STARTING_CHIPS = 10000
+_listeners = []
+
+def on_balance_change(fn):
+    """fn(uid, username, chips, points, wins, game) gets every committed/journaled delta"""
+    if fn not in _listeners: _listeners.append(fn)
+
+def _notify(uid, username, chips=0, points=0, wins=0, game=None):
+    for fn in _listeners:
+        try: fn(str(uid), str(username), chips, points, wins, game)
+        except: traceback.print_exc()
 
-def update_balance(user_id, username, chips_change=0, points_change=0):
+_reset_listeners = []
+
+def on_stats_reset(fn):
+    """fn(uid) after !resets zeroed a user's points/wins/game_stats (called inside the write scope)"""
+    if fn not in _reset_listeners: _reset_listeners.append(fn)
+_ph = get_ph()
+# Unix seconds, evaluated by the DB (every users/game_stats write stamps updated_at)
+NOW_SQL = "CAST(EXTRACT(EPOCH FROM NOW()) AS BIGINT)" if IS_POSTGRES else "CAST(strftime('%s', 'now') AS INTEGER)"
+STATS_UPSERT_Q = (f"INSERT INTO game_stats (user_id, game_name, wins, earnings, updated_at) VALUES ({_ph}, {_ph}, {_ph}, {_ph}, {NOW_SQL}) "
+                  f"ON CONFLICT(user_id, game_name) DO UPDATE SET wins = game_stats.wins + EXCLUDED.wins, earnings = game_stats.earnings + EXCLUDED.earnings, updated_at = EXCLUDED.updated_at")
+RESULT_UPSERT_Q = (f"INSERT INTO users (user_id, username, points, chips, wins, updated_at) VALUES ({_ph}, {_ph}, {_ph}, {_ph}, {_ph}, {NOW_SQL}) "
+                   f"ON CONFLICT(user_id) DO UPDATE SET points = users.points + EXCLUDED.points, chips = users.chips + {_ph}, wins = users.wins + EXCLUDED.wins, updated_at = EXCLUDED.updated_at")
+ENSURE_USER_Q = f"INSERT INTO users (user_id, username, updated_at) VALUES ({_ph}, {_ph}, {NOW_SQL}) ON CONFLICT(user_id) DO NOTHING"
+LEDGER_INSERT_Q = (f"INSERT INTO ledger (user_id, username, game, chips, points, wins, reason, idem_key, created_at) "
+                   f"VALUES ({_ph}, {_ph}, {_ph}, {_ph}, {_ph}, {_ph}, {_ph}, {_ph}, {_ph}) ON CONFLICT(idem_key) DO NOTHING")
+
+def _live(col):
+    """users.<col> as readers must see it: snapshot + the not-yet-compacted ledger tail"""
+    if not LEDGER: return f"users.{col}"
+    return f"(users.{col} + (SELECT COALESCE(SUM(ledger.{col}), 0) FROM ledger WHERE ledger.user_id = users.user_id AND ledger.compacted = 0))"
+LIVE_ROW = ", ".join(f"{_live(col)} AS {col}" for col in ("points", "chips", "wins"))
+LIVE_CHIPS = _live("chips")
+# Ledger debit: the row is only appended if the live balance covers it (users row locked first on Postgres)
+LEDGER_DEBIT_Q = (f"INSERT INTO ledger (user_id, username, chips, reason, created_at) SELECT {_ph}, {_ph}, {_ph}, {_ph}, {_ph} "
+                  f"FROM users WHERE user_id = {_ph} AND {_live('chips')} >= {_ph} RETURNING id")
+LOCK_USER_Q = f"SELECT user_id FROM users WHERE user_id = {_ph} FOR UPDATE"
+
+def _ledger_debit_steps(uid, username, amt, floor, reason):
+    """(query, params) steps for a balance-checked ledger debit; the last one returns a row only if it applied"""
+    steps = [(ENSURE_USER_Q, (uid, username))]
+    if IS_POSTGRES: steps.append((LOCK_USER_Q, (uid,))) # Concurrent debits of this user queue here
+    steps.append((LEDGER_DEBIT_Q, (uid, username, -amt, reason, int(time.time()), uid, floor)))
+    return steps
+
+def _atomic(steps):
+    """(query, params) steps ek transaction me; returns the last statement's row"""
+    if IS_POSTGRES:
+        # Multi-statement string = one round trip, one implicit transaction
+        with write_cursor() as cur:
+            cur.execute("; ".join(q for q, _ in steps), tuple(p for _, params in steps for p in params))
+            return cur.fetchone()
+    with transaction() as cur:
+        for q, params in steps: cur.execute(q, params)
+        return cur.fetchone()
+
+def _read_user_row(uid):
+    row = cache.get_user(uid)
+    if row is not None: return row
+    stamp = cache.stamp(uid)
+    with read_cursor() as cur:
+        cur.execute(f"SELECT {LIVE_ROW} FROM users WHERE user_id = {get_ph()}", (uid,))
+        row = cur.fetchone()
+    if row: cache.fill_user(uid, row, stamp)
+    return row
+
+def get_user_data(user_id, username="Unknown"):
+    uid = str(user_id)
+    c_pend = p_pend = w_pend = 0
+    try:
+        if journal.running:
+            # Committed row + results still waiting in the journal
+            row, (c_pend, p_pend, w_pend) = journal.consistent_read(uid, _read_user_row)
+        else:
+            row = _read_user_row(uid)
+        if row: return {"points": row[0] + p_pend, "chips": row[1] + c_pend, "wins": row[2] + w_pend}
+        with write_scope(), write_cursor() as cur:
+            cur.execute(ENSURE_USER_Q, (uid, str(username)))
+            if cur.rowcount > 0: _notify(uid, username)
+        return {"points": p_pend, "chips": STARTING_CHIPS + c_pend, "wins": w_pend}
+    except:
+        traceback.print_exc()
+        return {"points": 0, "chips": STARTING_CHIPS, "wins": 0}
+
+def update_balance(user_id, username, chips_change=0, points_change=0, reason="adjust"):
     if not user_id or str(user_id) == "BOT": return False
     ph = get_ph()
     uid, uname = str(user_id), str(username)
     c_delta, p_delta = int(chips_change), int(points_change)
-    get_user_data(uid, uname) # Ensure user exists
-    with db_lock:
-        conn = get_connection()
+    if LEDGER:
         try:
-            cur = conn.cursor()
-            cur.execute(f"UPDATE users SET points = points + {ph}, chips = chips + {ph} WHERE user_id = {ph}", (p_delta, c_delta, uid))
+            with write_scope():
+                _atomic([(ENSURE_USER_Q, (uid, uname)),
+                         (LEDGER_INSERT_Q + " RETURNING id", (uid, uname, None, c_delta, p_delta, 0, reason, None, int(time.time())))])
+                cache.invalidate(uid, games=False)
+                _notify(uid, uname, c_delta, p_delta)
             return True
         except:
             traceback.print_exc()
             return False
-        finally: conn.close()
+    try:
+        # Upsert-and-increment: user create + update in one statement
+        with write_scope(), write_cursor() as cur:
+            cur.execute(f"INSERT INTO users (user_id, username, points, chips, updated_at) VALUES ({ph}, {ph}, {ph}, {ph}, {NOW_SQL}) "
+                        f"ON CONFLICT(user_id) DO UPDATE SET points = users.points + {ph}, chips = users.chips + {ph}, updated_at = EXCLUDED.updated_at RETURNING {LIVE_ROW}",
+                        (uid, uname, p_delta, STARTING_CHIPS + c_delta, p_delta, c_delta))
+            cache.write(uid, cur.fetchone())
+            _notify(uid, uname, c_delta, p_delta)
+        return True
+    except:
+        traceback.print_exc()
+        return False
 
 def check_and_deduct_chips(user_id, username, amount):
     amt = int(amount)
     if amt < 0: return False
     ph, uid = get_ph(), str(user_id)
-    
-    current_data = get_user_data(uid, username)
-    if current_data and current_data['chips'] >= amt:
-        with db_lock:
-            conn = get_connection()
+    floor = amt - journal.pending(uid)[0] # Unflushed results count towards the balance
+    # Existing user: balance check + deduction in ONE conditional statement
+    debit_q = f"UPDATE users SET chips = chips - {ph}, updated_at = {NOW_SQL} WHERE user_id = {ph} AND {_live('chips')} >= {ph} RETURNING {LIVE_ROW}"
+    # No row yet: create it with STARTING_CHIPS - amt, only if STARTING_CHIPS covers the bet
+    new_q = (f"INSERT INTO users (user_id, username, chips, updated_at) SELECT {ph}, {ph}, {ph}, {NOW_SQL} WHERE {ph} >= {ph} "
+             f"ON CONFLICT(user_id) DO NOTHING RETURNING {LIVE_ROW}")
+    if LEDGER:
+        try:
+            with write_scope():
+                row = _atomic(_ledger_debit_steps(uid, str(username), amt, floor, "bet"))
+                if row:
+                    cache.invalidate(uid, games=False)
+                    _notify(uid, username, chips=-amt)
+            return row is not None
+        except:
+            traceback.print_exc()
+            return False
+    try:
+        with write_scope(), write_cursor() as cur:
+            cur.execute(debit_q, (amt, uid, floor))
+            row = cur.fetchone()
+            if row is None:
+                cur.execute(new_q, (uid, str(username), STARTING_CHIPS - amt, STARTING_CHIPS, floor))
+                row = cur.fetchone()
+            if row:
+                cache.write(uid, row)
+                _notify(uid, username, chips=-amt)
+            return row is not None
+    except:
+        traceback.print_exc()
+        return False
+
+SETTLED_KEYS = 10000 # Recent settlement keys remembered in-process
+_settled = OrderedDict()
+_settled_lock = threading.Lock()
+
+def settlement_key(game, room_id, match_id, user_id):
+    """idem_key for one payout: a match settles each user once, however often the settlement fires"""
+    return f"{game}:{room_id}:{match_id}:{user_id}"
+
+def add_game_result(user_id, username, game_name, chips_won, is_win=False, points_reward=0, idem_key=None):
+    """
+    idem_key: a retried / double-fired settlement with the same key is applied once.
+    Recent keys are checked in-process (every mode); in ledger mode the UNIQUE
+    ledger.idem_key also holds across restarts.
+    """
+    if idem_key:
+        with _settled_lock:
+            if idem_key in _settled: return True
+            _settled[idem_key] = True
+            while len(_settled) > SETTLED_KEYS: _settled.popitem(last=False)
+    ok = _settle(user_id, username, game_name, chips_won, is_win, points_reward, idem_key)
+    if idem_key and not ok:
+        with _settled_lock: _settled.pop(idem_key, None) # Not applied: a retry may still pay it
+    return ok
+
+def _settle(user_id, username, game_name, chips_won, is_win, points_reward, idem_key):
+    if not user_id or str(user_id) == "BOT": return False
+    uid, g_name = str(user_id), str(game_name).lower()
+    win_val, c_won, p_won = 1 if is_win else 0, int(chips_won), int(points_reward)
+    if journal.running and not (LEDGER and idem_key):
+        journal.append(uid, str(username), g_name, c_won, p_won, win_val)
+        return True
+
+    if LEDGER:
+        # Append-only: no hot-row UPDATE on users, the compactor folds it in later
+        try:
+            with write_scope():
+                row = _atomic([(ENSURE_USER_Q, (uid, str(username))),
+                               (LEDGER_INSERT_Q + " RETURNING id", (uid, str(username), g_name, c_won, p_won, win_val, "game", idem_key, int(time.time())))])
+                if row is None: return True # Same idem_key already settled
+                cache.invalidate(uid)
+                _notify(uid, username, c_won, p_won, win_val, g_name)
+            return True
+        except:
+            traceback.print_exc()
+            return False
+
+    # Balance + wins + game_stats in one transaction (one round trip on Postgres)
+    try:
+        with write_scope():
+            row = _atomic([(STATS_UPSERT_Q, (uid, g_name, win_val, c_won)),
+                           (RESULT_UPSERT_Q + f" RETURNING {LIVE_ROW}", (uid, str(username), p_won, STARTING_CHIPS + c_won, win_val, c_won))])
+            cache.write(uid, row, games_changed=True)
+            _notify(uid, username, c_won, p_won, win_val, g_name)
+        return True
+    except:
+        traceback.print_exc()
+        return False
+
+def _with_pending(uid, chips):
+    """Committed chips + unflushed journal results, like get_user_data reports them"""
+    return chips + journal.pending(uid)[0]
+
+def transfer_chips(from_id, from_name, to_id, to_name, amount, min_balance=0):
+    """Atomic two-party transfer. Returns (sender_chips, receiver_chips) or None"""
+    amt = int(amount)
+    if amt <= 0 or str(from_id) == str(to_id): return None
+    ph, need = get_ph(), max(amt, int(min_balance)) - journal.pending(from_id)[0]
+    debit_q = f"UPDATE users SET chips = chips - {ph}, updated_at = {NOW_SQL} WHERE user_id = {ph} AND {_live('chips')} >= {ph} RETURNING {LIVE_ROW}"
+    credit_q = (f"INSERT INTO users (user_id, username, chips, updated_at) VALUES ({ph}, {ph}, {ph}, {NOW_SQL}) "
+                f"ON CONFLICT(user_id) DO UPDATE SET chips = users.chips + {ph}, updated_at = EXCLUDED.updated_at RETURNING {LIVE_ROW}")
+    try:
+        if LEDGER:
+            # Debit + credit rows in one transaction; nothing is credited unless the debit applied
+            with write_scope():
+                with transaction() as cur:
+                    for q, params in _ledger_debit_steps(str(from_id), str(from_name), amt, need, "transfer"):
+                        cur.execute(q, params)
+                    if not cur.fetchone(): return None
+                    cur.execute(ENSURE_USER_Q, (str(to_id), str(to_name)))
+                    cur.execute(LEDGER_INSERT_Q, (str(to_id), str(to_name), None, amt, 0, 0, "transfer", None, int(time.time())))
+                    cur.execute(f"SELECT {_live('chips')} FROM users WHERE user_id = {ph}", (str(from_id),)); sender = cur.fetchone()[0]
+                    cur.execute(f"SELECT {_live('chips')} FROM users WHERE user_id = {ph}", (str(to_id),)); receiver = cur.fetchone()[0]
+                cache.invalidate(from_id, games=False); cache.invalidate(to_id, games=False)
+                _notify(from_id, from_name, chips=-amt); _notify(to_id, to_name, chips=amt)
+            return _with_pending(from_id, sender), _with_pending(to_id, receiver)
+        if IS_POSTGRES:
+            # Debit CTE feeds the credit: nothing is credited unless the debit matched
+            with write_scope(), write_cursor() as cur:
+                cur.execute(f"WITH debit AS ({debit_q}) INSERT INTO users (user_id, username, chips, updated_at) SELECT {ph}, {ph}, {ph}, {NOW_SQL} FROM debit "
+                            f"ON CONFLICT(user_id) DO UPDATE SET chips = users.chips + {ph}, updated_at = EXCLUDED.updated_at RETURNING (SELECT chips FROM debit), {_live('chips')}",
+                            (amt, str(from_id), need, str(to_id), str(to_name), STARTING_CHIPS + amt, amt))
+                res = cur.fetchone()
+                cache.invalidate(from_id, games=False); cache.invalidate(to_id, games=False)
+                if res: _notify(from_id, from_name, chips=-amt); _notify(to_id, to_name, chips=amt)
+            return (_with_pending(from_id, res[0]), _with_pending(to_id, res[1])) if res else None
+        with write_scope():
+            with transaction() as cur:
+                cur.execute(debit_q, (amt, str(from_id), need))
+                debit = cur.fetchone()
+                if not debit: return None # Nothing changed, commit is a no-op
+                cur.execute(credit_q, (str(to_id), str(to_name), STARTING_CHIPS + amt, amt))
+                credit = cur.fetchone()
+            cache.write(from_id, debit); cache.write(to_id, credit)
+            _notify(from_id, from_name, chips=-amt); _notify(to_id, to_name, chips=amt)
+            return _with_pending(from_id, debit[1]), _with_pending(to_id, credit[1])
+    except:
+        traceback.print_exc()
+        return None
+
+def set_balance(user_id, username, col, value):
+    """Admin set (!setc/!sets/!resetc): old value read + write in one locked transaction, so a bet can't land in between"""
+    if col not in ("points", "chips"): return False
+    ph, uid, uname = get_ph(), str(user_id), str(username)
+    try:
+        with write_scope():
+            with transaction() as cur:
+                cur.execute(ENSURE_USER_Q, (uid, uname))
+                cur.execute(f"SELECT {_live(col)} FROM users WHERE user_id = {ph}" + (" FOR UPDATE" if IS_POSTGRES else ""), (uid,))
+                # Target is the balance the user sees, unflushed journal results included
+                delta = int(value) - cur.fetchone()[0] - journal.pending(uid)[0 if col == "chips" else 1]
+                if LEDGER:
+                    cur.execute(LEDGER_INSERT_Q, (uid, uname, None, delta if col == "chips" else 0, delta if col == "points" else 0, 0, "admin", None, int(time.time())))
+                    row = None # Cache entry is dropped below
+                else:
+                    cur.execute(f"UPDATE users SET {col} = {col} + {ph}, updated_at = {NOW_SQL} WHERE user_id = {ph} RETURNING {LIVE_ROW}", (delta, uid))
+                    row = cur.fetchone()
+            cache.write(uid, row)
+            if delta: _notify(uid, uname, **{col: delta})
+        return True
+    except:
+        traceback.print_exc()
+        return False
+
+def reset_stats(user_id):
+    """!resets: points, wins and game_stats of one user back to zero; chips are kept"""
+    ph, uid = get_ph(), str(user_id)
+    try:
+        # Unflushed journal results go in first, so the next flush can't bring them back
+        with journal.flush_lock, compactor.lock, write_scope():
+            if not journal._flush(): raise RuntimeError("journal flush failed, reset skipped")
+            with transaction() as cur:
+                folded = 0
+                if LEDGER:
+                    # Claim the tail like a compaction: its chips stay, its points/wins/games are wiped with the rest
+                    cur.execute(f"UPDATE ledger SET compacted = 1 WHERE user_id = {ph} AND compacted = 0 RETURNING chips", (uid,))
+                    folded = sum(r[0] for r in cur.fetchall())
+                cur.execute(f"UPDATE users SET points = 0, wins = 0, chips = chips + {ph}, updated_at = {NOW_SQL} WHERE user_id = {ph}", (folded, uid))
+                cur.execute(f"DELETE FROM game_stats WHERE user_id = {ph}", (uid,))
+            cache.invalidate(uid)
+            for fn in _reset_listeners:
+                try: fn(uid)
+                except: traceback.print_exc()
+        return True
+    except:
+        traceback.print_exc()
+        return False
+
+def wipe_economy():
+    """!wipedb: every user back to STARTING_CHIPS, no points/wins/game_stats"""
+    try:
+        with journal.flush_lock, compactor.lock, write_scope():
+            if not journal._flush(): raise RuntimeError("journal flush failed, wipe skipped")
+            with transaction() as cur:
+                # The uncompacted tail would be added back by _live(); wiped with the rest (rows stay for audit)
+                if LEDGER: cur.execute("UPDATE ledger SET compacted = 1 WHERE compacted = 0")
+                cur.execute(f"UPDATE users SET points = 0, chips = {STARTING_CHIPS}, wins = 0, updated_at = {NOW_SQL}")
+                cur.execute("DELETE FROM game_stats")
+            cache.clear()
+        return True
+    except:
+        traceback.print_exc()
+        return False
+
+# ==========================================
+# USER CACHE (read-through, write-through)
+# ==========================================
+class UserCache:
+    """
+    Bounded LRU of users rows (points, chips, wins) and per-user game_stats.
+    Balance functions write the committed RETURNING row straight in, so
+    !mc / !ms answer from memory. TTL covers out-of-band SQL (!wipedb etc).
+    """
+    def __init__(self, size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.size, self.ttl = size, ttl
+        self.lock = threading.Lock()
+        self.users = OrderedDict()   # {uid: (expires, (points, chips, wins))}
+        self.games = OrderedDict()   # {uid: (expires, [(game, wins, earnings)])}
+        self.stamps = [0] * LOCK_STRIPES # Bumped on every write; stale fills are dropped
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    def _slot(self, uid): return hash(uid) % LOCK_STRIPES
+
+    def _get(self, store, uid):
+        with self.lock:
+            item = store.get(uid)
+            if item and item[0] > time.time():
+                store.move_to_end(uid)
+                self.counters["hits"] += 1
+                return item[1]
+            if item:
+                del store[uid]; self.counters["expired"] += 1
+            self.counters["misses"] += 1
+            return None
+
+    def _put(self, store, uid, value):
+        store[uid] = (time.time() + self.ttl, value)
+        store.move_to_end(uid)
+        while len(store) > self.size:
+            store.popitem(last=False); self.counters["evictions"] += 1
+
+    def _fill(self, store, uid, value, stamp):
+        with self.lock:
+            if self.stamps[self._slot(uid)] == stamp: self._put(store, uid, value)
+
+    def stamp(self, uid):
+        with self.lock: return self.stamps[self._slot(uid)]
+
+    def get_user(self, uid): return self._get(self.users, uid)
+    def get_games(self, uid): return self._get(self.games, uid)
+    def fill_user(self, uid, row, stamp): self._fill(self.users, uid, tuple(row), stamp)
+    def fill_games(self, uid, rows, stamp): self._fill(self.games, uid, list(rows), stamp)
+
+    def write(self, uid, row, games_changed=False):
+        """Committed (points, chips, wins). Postgres writers race each other, so there we just drop"""
+        uid = str(uid)
+        with self.lock:
+            self.stamps[self._slot(uid)] += 1
+            if games_changed: self.games.pop(uid, None)
+            if IS_POSTGRES or not row: self.users.pop(uid, None)
+            else: self._put(self.users, uid, tuple(row))
+
+    def invalidate(self, uid, games=True):
+        uid = str(uid)
+        with self.lock:
+            self.stamps[self._slot(uid)] += 1
+            self.users.pop(uid, None)
+            if games: self.games.pop(uid, None)
+
+    def clear(self):
+        with self.lock:
+            self.stamps = [s + 1 for s in self.stamps]
+            self.users.clear(); self.games.clear()
+
+    def stats(self):
+        with self.lock:
+            c = dict(self.counters)
+            total = c["hits"] + c["misses"]
+            c.update(size=len(self.users), game_entries=len(self.games), hit_rate=round(c["hits"] / total, 3) if total else 0.0)
+            return c
+
+cache = UserCache()
+
+def get_game_stats(user_id):
+    """[(game_name, wins, earnings)] for one user: committed (cached) + unflushed journal results"""
+    uid = str(user_id)
+    try:
+        if not journal.running: return _read_game_rows(uid)
+        rows, pending = journal.consistent_read(uid, _read_game_rows, games=True)
+        if not pending: return rows
+        merged = {game: [w, e] for game, w, e in rows}
+        for game, (w, e) in pending.items():
+            g = merged.setdefault(game, [0, 0])
+            g[0] += w; g[1] += e
+        return [(game, w, e) for game, (w, e) in merged.items()]
+    except:
+        traceback.print_exc()
+        return []
+
+def _read_game_rows(uid):
+    rows = cache.get_games(uid)
+    if rows is not None: return rows
+    stamp = cache.stamp(uid)
+    ph = get_ph()
+    with read_cursor() as cur:
+        if LEDGER:
+            # One statement = one snapshot, so a compaction can't be counted twice
+            cur.execute(f"SELECT game_name, wins, earnings FROM game_stats WHERE user_id = {ph} UNION ALL "
+                        f"SELECT game, wins, chips FROM ledger WHERE user_id = {ph} AND compacted = 0 AND game IS NOT NULL", (uid, uid))
+            merged = {}
+            for game, wins, earnings in cur.fetchall():
+                g = merged.setdefault(game, [0, 0])
+                g[0] += wins; g[1] += earnings
+            rows = [(game, w, e) for game, (w, e) in merged.items()]
+        else:
+            cur.execute(f"SELECT game_name, wins, earnings FROM game_stats WHERE user_id = {ph}", (uid,))
+            rows = cur.fetchall()
+    cache.fill_games(uid, rows, stamp)
+    return rows
+
+RANK_COLUMNS = ("points", "chips")
+
+def get_rank_page(col, after=None, limit=10):
+    """
+    [(user_id, username, value)] ordered by value DESC, user_id ASC.
+    after=(value, user_id) of the last row seen -> seek, not OFFSET, so page 50 costs the same as page 1.
+    """
+    if col not in RANK_COLUMNS: return []
+    ph, val = get_ph(), _live(col) # Ledger mode: snapshot + tail (no index there, this is only the fallback)
+    try:
+        with read_cursor() as cur:
+            if after is None:
+                cur.execute(f"SELECT user_id, username, {val} FROM users ORDER BY {val} DESC, user_id LIMIT {ph}", (limit,))
+            else:
+                # "<=" bound first so the planner can SEARCH the index instead of scanning from the top
+                cur.execute(f"SELECT user_id, username, {val} FROM users WHERE {val} <= {ph} AND ({val} < {ph} OR user_id > {ph}) "
+                            f"ORDER BY {val} DESC, user_id LIMIT {ph}", (after[0], after[0], str(after[1]), limit))
+            return cur.fetchall()
+    except:
+        traceback.print_exc()
+        return []
+
+# ==========================================
+# WRITE-BEHIND JOURNAL (DB_WRITE_BEHIND=1)
+# ==========================================
+class WriteBehindJournal:
+    """
+    Game results memory me coalesce hote hain per (user, game) and get
+    flushed in ONE transaction every FLUSH_INTERVAL_MS or FLUSH_MAX_ENTRIES.
+    Each entry is fsync'd to a local journal first; leftover journal files
+    are replayed on start. Batch ids are recorded in the same transaction,
+    so a replay never applies a batch twice.
+    """
+    def __init__(self, path=JOURNAL_PATH, interval_ms=FLUSH_INTERVAL_MS, max_entries=FLUSH_MAX_ENTRIES):
+        self.path = path
+        self.interval = interval_ms / 1000.0
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.queue = {}     # {(uid, game): [username, chips, points, wins]}
+        self.deltas = {}    # {uid: [chips, points, wins]} not yet committed (incl. in-flight)
+        self.retry = []     # [(batch_id, batch, batch_path)] rotated but not committed yet
+        self.entries = 0
+        self.version = 0    # Bumped around each commit (seqlock for readers)
+        self.committing = False
+        self.file = None
+        self.running = False
+        self.stats = {"appended": 0, "flushes": 0, "rows": 0}
+
+    def start(self):
+        if self.running: return
+        self.replay()
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.running = True
+        threading.Thread(target=self.flush_loop, daemon=True).start()
+        atexit.register(self.flush)
+        print(f"[DB] Write-behind ON ({int(self.interval*1000)}ms / {self.max_entries} entries)")
+
+    def append(self, uid, username, game, chips, points, wins):
+        line = json.dumps({"u": uid, "n": username, "g": game, "c": chips, "p": points, "w": wins})
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self._merge(self.queue, uid, username, game, chips, points, wins)
+            d = self.deltas.setdefault(uid, [0, 0, 0])
+            d[0] += chips; d[1] += points; d[2] += wins
+            self.entries += 1
+            self.stats["appended"] += 1
+            _notify(uid, username, chips, points, wins, game)
+            full = self.entries >= self.max_entries
+        if full: self.wake.set()
+
+    @staticmethod
+    def _merge(batch, uid, username, game, chips, points, wins):
+        row = batch.setdefault((uid, game), [username, 0, 0, 0])
+        row[0] = username; row[1] += chips; row[2] += points; row[3] += wins
+
+    def pending(self, uid):
+        """(chips, points, wins) waiting to be committed for this user"""
+        if not self.running: return (0, 0, 0)
+        with self.lock: return tuple(self.deltas.get(str(uid), (0, 0, 0)))
+
+    def _pending_games(self, uid):
+        """{game: [wins, chips]} waiting to be committed for this user. Caller holds self.lock"""
+        games = {}
+        for batch in [b for _, b, _ in self.retry] + [self.queue]:
+            for (u, game), (_, chips, _, wins) in batch.items():
+                if u != uid: continue
+                g = games.setdefault(game, [0, 0])
+                g[0] += wins; g[1] += chips
+        return games
+
+    def uncommitted(self):
+        """{(uid, game): [username, chips, points, wins]} not in the DB yet. Caller holds self.lock"""
+        merged = {}
+        for batch in [b for _, b, _ in self.retry] + [self.queue]:
+            for (uid, game), (uname, chips, points, wins) in batch.items():
+                self._merge(merged, uid, uname, game, chips, points, wins)
+        return merged
+
+    def consistent_read(self, uid, read_fn, games=False):
+        """DB row + pending deltas (per game with games=True) that belong to the same point in time"""
+        row = None
+        for _ in range(5):
+            with self.lock: v1, busy = self.version, self.committing
+            row = read_fn(uid)
+            with self.lock:
+                if not busy and not self.committing and self.version == v1:
+                    return row, (self._pending_games(uid) if games else tuple(self.deltas.get(uid, (0, 0, 0))))
+            time.sleep(0.002)
+        if games:
+            with self.lock: return row, self._pending_games(uid)
+        return row, self.pending(uid)
+
+    def flush_loop(self):
+        while self.running:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            try: self.flush()
+            except: traceback.print_exc()
+
+    def flush(self):
+        """Commits everything queued so far. False if a batch failed (it stays for the next try)"""
+        with self.flush_lock: return self._flush()
+
+    def _flush(self):
+        """flush() body; caller holds flush_lock"""
+        with self.lock:
+            if self.queue:
+                batch, self.queue, self.entries = self.queue, {}, 0
+                batch_id = uuid.uuid4().hex
+                batch_path = f"{self.path}.{batch_id}"
+                self.file.close()
+                os.replace(self.path, batch_path)
+                self.file = open(self.path, "a", encoding="utf-8")
+                self.retry.append((batch_id, batch, batch_path))
+            jobs = list(self.retry)
+        for job in jobs:
+            batch_id, batch, batch_path = job
+            with self.lock: self.committing = True; self.version += 1
             try:
-                cur = conn.cursor()
-                cur.execute(f"UPDATE users SET chips = chips - {ph} WHERE user_id = {ph}", (amt, uid))
-                return True
+                # Commit + delta handover under the writer, so readers never count a batch twice
+                with write_scope():
+                    _apply_batch(batch_id, batch)
+                    with self.lock:
+                        self.retry.remove(job)
+                        for uid, _ in batch: cache.invalidate(uid)
+                        for (uid, _), (_, chips, points, wins) in batch.items():
+                            d = self.deltas[uid]
+                            d[0] -= chips; d[1] -= points; d[2] -= wins
+                            if d == [0, 0, 0]: del self.deltas[uid]
+                self.stats["flushes"] += 1; self.stats["rows"] += len(batch)
+                os.remove(batch_path)
             except:
                 traceback.print_exc()
-                return False
-            finally: conn.close()
-    return False
-
-def add_game_result(user_id, username, game_name, chips_won, is_win=False, points_reward=0):
-    update_balance(user_id, username, chips_won, points_reward)
-    ph, uid, g_name = get_ph(), str(user_id), str(game_name).lower()
-    win_val, c_won = 1 if is_win else 0, int(chips_won)
-    
-    with db_lock:
-        conn = get_connection()
-        try:
-            cur = conn.cursor()
-            cur.execute(f"UPDATE users SET wins = wins + {ph} WHERE user_id = {ph}", (win_val, uid))
-            upsert_q = f"INSERT INTO game_stats (user_id, game_name, wins, earnings) VALUES ({ph}, {ph}, {ph}, {ph}) ON CONFLICT(user_id, game_name) DO UPDATE SET wins = game_stats.wins + EXCLUDED.wins, earnings = game_stats.earnings + EXCLUDED.earnings"
-            cur.execute(upsert_q, (uid, g_name, win_val, c_won))
-        except: traceback.print_exc()
-        finally: conn.close()
+                return False # Batch stays in retry: same batch_id next time = still exactly-once
+            finally:
+                with self.lock: self.committing = False; self.version += 1
+        return True
+
+    def replay(self):
+        """Crash recovery: apply journal files left by a previous run"""
+        folder = os.path.dirname(os.path.abspath(self.path))
+        base = os.path.basename(self.path)
+        files = [(name[len(base)+1:], os.path.join(folder, name)) for name in os.listdir(folder) if name.startswith(base + ".")]
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            batch_id = uuid.uuid4().hex
+            os.replace(self.path, f"{self.path}.{batch_id}")
+            files.append((batch_id, f"{self.path}.{batch_id}"))
+        for batch_id, batch_path in files:
+            batch = {}
+            with open(batch_path, encoding="utf-8") as f:
+                for line in f:
+                    try: e = json.loads(line)
+                    except ValueError: continue # Torn last line
+                    self._merge(batch, e["u"], e["n"], e["g"], e["c"], e["p"], e["w"])
+            if batch: _apply_batch(batch_id, batch)
+            cache.clear()
+            os.remove(batch_path)
+            print(f"[DB] Journal replayed: {len(batch)} rows from batch {batch_id[:8]}")
+
+def _apply_batch(batch_id, batch):
+    """One transaction per batch; skipped if this batch_id was already committed"""
+    ph = get_ph()
+    users = {}
+    for (uid, _), (uname, chips, points, wins) in batch.items():
+        u = users.setdefault(uid, [uname, 0, 0, 0])
+        u[1] += chips; u[2] += points; u[3] += wins
+    with transaction() as cur:
+        cur.execute(f"INSERT INTO write_behind_batches (batch_id) VALUES ({ph}) ON CONFLICT(batch_id) DO NOTHING RETURNING batch_id", (batch_id,))
+        if cur.fetchone() is None: return
+        if LEDGER:
+            now = int(time.time())
+            cur.executemany(ENSURE_USER_Q, [(uid, u[0]) for uid, u in users.items()])
+            cur.executemany(LEDGER_INSERT_Q, [(uid, n, game, c, p, w, "game", f"{batch_id}:{uid}:{game}", now)
+                                              for (uid, game), (n, c, p, w) in batch.items()])
+            return
+        cur.executemany(STATS_UPSERT_Q, [(uid, game, wins, chips) for (uid, game), (_, chips, _, wins) in batch.items()])
+        cur.executemany(RESULT_UPSERT_Q, [(uid, n, p, STARTING_CHIPS + c, w, c) for uid, (n, c, p, w) in users.items()])
+
+journal = WriteBehindJournal()
+
+# ==========================================
+# 📒 LEDGER COMPACTION
+# ==========================================
+class LedgerCompactor:
+    """
+    Ledger ka uncompacted tail periodically users/game_stats me fold hota hai,
+    in ONE transaction that also flips those rows to compacted=1. Readers
+    always see snapshot + tail (see _live), so totals are identical before
+    and after a compaction. Compacted rows stay for LEDGER_KEEP_DAYS (audit).
+    """
+    def __init__(self, interval=COMPACT_INTERVAL_S, keep_days=LEDGER_KEEP_DAYS):
+        self.interval = interval
+        self.keep_days = keep_days
+        self.lock = threading.Lock()
+        self.running = False
+        self.last_prune = 0
+        self.stats = {"runs": 0, "rows": 0, "pruned": 0}
+
+    def start(self):
+        if self.running: return
+        self.running = True
+        self.compact() # Fold whatever a previous run left behind
+        threading.Thread(target=self.loop, daemon=True).start()
+        atexit.register(self.compact)
+        print(f"[DB] Ledger ON (compaction every {self.interval}s)")
+
+    def loop(self):
+        while self.running:
+            time.sleep(self.interval)
+            try: self.compact()
+            except: traceback.print_exc()
+
+    def compact(self):
+        ph = get_ph()
+        with self.lock, write_scope():
+            with transaction() as cur:
+                # Claims exactly the rows it flips; rows committed meanwhile (Postgres) wait for the next run
+                cur.execute("UPDATE ledger SET compacted = 1 WHERE compacted = 0 RETURNING user_id, username, game, chips, points, wins")
+                rows = cur.fetchall()
+                users, games = {}, {}
+                for uid, uname, game, chips, points, wins in rows:
+                    u = users.setdefault(uid, [uname, 0, 0, 0])
+                    u[1] += chips; u[2] += points; u[3] += wins
+                    if game:
+                        g = games.setdefault((uid, game), [0, 0])
+                        g[0] += wins; g[1] += chips
+                if users: cur.executemany(RESULT_UPSERT_Q, [(uid, n, p, STARTING_CHIPS + c, w, c) for uid, (n, c, p, w) in users.items()])
+                if games: cur.executemany(STATS_UPSERT_Q, [(uid, game, w, e) for (uid, game), (w, e) in games.items()])
+                pruned = 0
+                if self.keep_days and time.time() - self.last_prune > 3600:
+                    cur.execute(f"DELETE FROM ledger WHERE compacted = 1 AND created_at < {ph}", (int(time.time()) - self.keep_days * 86400,))
+                    pruned, self.last_prune = max(cur.rowcount, 0), time.time()
+        self.stats["runs"] += 1; self.stats["rows"] += len(rows); self.stats["pruned"] += pruned
+        return len(rows)
+
+compactor = LedgerCompactor()
 
 # ADMIN
 def add_admin(user_id):
     ph, uid = get_ph(), str(user_id)
-    with db_lock:
-        conn = get_connection()
-        try:
-            cur = conn.cursor()
+    try:
+        with write_cursor() as cur:
             cur.execute(f"INSERT INTO bot_admins (user_id) VALUES ({ph}) ON CONFLICT(user_id) DO NOTHING", (uid,))
-            return True
-        except:
-            traceback.print_exc()
-            return False
-        finally: conn.close()
+        return True
+    except:
+        traceback.print_exc()
+        return False
 
 def get_all_admins():
-    with db_lock:
-        conn = get_connection()
-        try:
-            cur = conn.cursor()
+    try:
+        with read_cursor() as cur:
             cur.execute("SELECT user_id FROM bot_admins")
             return [str(item[0]) for item in cur.fetchall()]
-        except:
-            traceback.print_exc()
-            return []
+    except:
+        traceback.print_exc()
+        return []
+
+def stream_rows(query, params=(), chunk=1000):
+    """
+    Bulk reads (exports): yields the column names first, then lists of <= chunk rows.
+    Own connection + server-side cursor, so memory stays flat and no writer lock is held.
+    """
+    if IS_POSTGRES:
+        conn = psycopg2.connect(DATABASE_URL, sslmode='require') # Named cursors need a transaction
+        try:
+            with conn.cursor(name=f"stream_{uuid.uuid4().hex[:12]}") as cur:
+                cur.itersize = chunk
+                cur.execute(query, params)
+                first = cur.fetchmany(chunk)
+                yield [d[0] for d in cur.description]
+                rows = first
+                while rows:
+                    yield rows
+                    rows = cur.fetchmany(chunk)
+            conn.rollback()
         finally: conn.close()
+        return
+    conn = _open_sqlite() # WAL reader: writers keep going while we stream
+    try:
+        cur = conn.execute(query, params)
+        yield [d[0] for d in cur.description]
+        while True:
+            rows = cur.fetchmany(chunk)
+            if not rows: break
+            yield rows
+    finally: conn.close()
+
+# ==========================================
+# 📚 GAME GUIDES (help plugin)
+# ==========================================
+def save_guide(game_name, description):
+    ph = get_ph()
+    try:
+        with write_cursor() as cur:
+            cur.execute(f"INSERT INTO guides (game_name, description) VALUES ({ph}, {ph}) ON CONFLICT(game_name) DO UPDATE SET description = EXCLUDED.description", (str(game_name).lower(), description))
+        return True
+    except:
+        traceback.print_exc()
+        return False
+
+def get_guide(game_name):
+    try:
+        with read_cursor() as cur:
+            cur.execute(f"SELECT description FROM guides WHERE game_name = {get_ph()}", (str(game_name).lower(),))
+            row = cur.fetchone()
+            return row[0] if row else None
+    except:
+        traceback.print_exc()
+        return None
+
+def get_all_guide_names():
+    try:
+        with read_cursor() as cur:
+            cur.execute("SELECT game_name FROM guides ORDER BY game_name")
+            return [r[0] for r in cur.fetchall()]
+    except:
+        traceback.print_exc()
+        return []
@@ -0,0 +1,107 @@
+import io
+import csv
+import sys
+import json
+import zlib
+import argparse
+from datetime import datetime
+import db
+
+# ==========================================
+# 📤 STREAMING EXPORT (users / game_stats / ledger)
+# ==========================================
+# Rows server-side cursor se chunks me aate hain and leave as NDJSON/CSV
+# bytes immediately, optionally gzip'd on the fly. Memory is one chunk,
+# whatever the table size. Used by /api/export/<table> and the CLI below.
+
+CHUNK_ROWS = 1000
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+# table -> (columns, order by, {filter: sql})
+# Balances are db.LIVE_ROW / db.LIVE_CHIPS: in ledger mode the uncompacted tail counts, like every reader
+TABLES = {
+    "users": (f"user_id, username, {db.LIVE_ROW}, updated_at", "user_id", {
+        "game": "user_id IN (SELECT user_id FROM game_stats WHERE game_name = {ph})",
+        "min_chips": f"{db.LIVE_CHIPS} >= {{ph}}",
+        "since": "updated_at >= {ph}",
+    }),
+    "game_stats": ("user_id, game_name, wins, earnings, updated_at", "user_id, game_name", {
+        "game": "game_name = {ph}",
+        "min_chips": f"user_id IN (SELECT user_id FROM users WHERE {db.LIVE_CHIPS} >= {{ph}})",
+        "since": "updated_at >= {ph}",
+    }),
+    "ledger": ("id, user_id, username, game, chips, points, wins, reason, idem_key, compacted, created_at", "id", {
+        "game": "game = {ph}",
+        "min_chips": f"user_id IN (SELECT user_id FROM users WHERE {db.LIVE_CHIPS} >= {{ph}})",
+        "since": "created_at >= {ph}",
+    }),
+}
+
+def parse_since(value):
+    """Unix seconds or an ISO date/datetime -> unix seconds"""
+    if value in (None, ""): return None
+    try: return int(value)
+    except ValueError: return int(datetime.fromisoformat(str(value)).timestamp())
+
+def build_query(table, game=None, min_chips=None, since=None):
+    if table not in TABLES: raise ValueError(f"Unknown table '{table}'. Use one of: {', '.join(TABLES)}")
+    cols, order, filters = TABLES[table]
+    ph = db.get_ph()
+    where, params = [], []
+    for key, val in (("game", str(game).lower() if game else None),
+                     ("min_chips", int(min_chips) if min_chips not in (None, "") else None),
+                     ("since", parse_since(since))):
+        if val is None: continue
+        where.append(filters[key].format(ph=ph)); params.append(val)
+    sql = f"SELECT {cols} FROM {table}" + (f" WHERE {' AND '.join(where)}" if where else "") + f" ORDER BY {order}"
+    return sql, tuple(params)
+
+def iter_export(table, fmt="ndjson", chunk=CHUNK_ROWS, **filters):
+    """Yields encoded byte chunks. Raises ValueError on bad table/format/filter (before any I/O)"""
+    if fmt not in FORMATS: raise ValueError(f"Unknown format '{fmt}'. Use one of: {', '.join(FORMATS)}")
+    sql, params = build_query(table, **filters)
+
+    def gen():
+        stream = db.stream_rows(sql, params, chunk)
+        cols = next(stream)
+        if fmt == "csv":
+            buf = io.StringIO(); w = csv.writer(buf)
+            w.writerow(cols)
+            for rows in stream:
+                w.writerows(rows)
+                yield buf.getvalue().encode(); buf.seek(0); buf.truncate()
+            if buf.tell(): yield buf.getvalue().encode()
+        else:
+            for rows in stream:
+                yield "".join(json.dumps(dict(zip(cols, r)), default=str) + "\n" for r in rows).encode()
+    return gen()
+
+def gzip_stream(chunks, level=6):
+    """On-the-fly gzip (wbits=31 = gzip container) over a byte-chunk iterator"""
+    z = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for c in chunks:
+        out = z.compress(c)
+        if out: yield out
+    yield z.flush()
+
+def main():
+    ap = argparse.ArgumentParser(description="Stream a table out as NDJSON/CSV")
+    ap.add_argument("table", choices=list(TABLES))
+    ap.add_argument("--format", default="ndjson", choices=list(FORMATS))
+    ap.add_argument("--game")
+    ap.add_argument("--min-chips", type=int)
+    ap.add_argument("--since", help="unix seconds or ISO date")
+    ap.add_argument("--gzip", action="store_true")
+    ap.add_argument("-o", "--out", help="file (default stdout)")
+    opts = ap.parse_args()
+
+    chunks = iter_export(opts.table, opts.format, game=opts.game, min_chips=opts.min_chips, since=opts.since)
+    if opts.gzip: chunks = gzip_stream(chunks)
+    out = open(opts.out, "wb") if opts.out else sys.stdout.buffer
+    try:
+        for c in chunks: out.write(c)
+    finally:
+        if opts.out: out.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import re
+import threading
+import traceback
+import psycopg2
+import psycopg2.pool
+import db
+
+# ==========================================
+# 🔌 SHARED DB GATEWAY (plugins)
+# ==========================================
+# Plugins with their own store (nilu_ai, room_manager) yahan se jaate hain:
+# one small pool per DSN instead of a connect() per query, batches on one
+# checked-out connection, and server-side PREPAREd hot queries.
+# No DSN -> falls back to the main db.py store (SQLite offline, or its Postgres).
+# Queries are written Postgres-style (%s, SERIAL); the fallback translates.
+
+POOL_SIZE = 4
+
+_SQLITE_REWRITES = [("%s", "?"), ("SERIAL PRIMARY KEY", "INTEGER PRIMARY KEY AUTOINCREMENT")]
+
+class Gateway:
+    def __init__(self, dsn=None, pool_size=POOL_SIZE, name="gateway", **connect_kwargs):
+        self.dsn = dsn
+        self.name = name
+        self.pool_size = pool_size
+        self.connect_kwargs = connect_kwargs
+        self.pool = None
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(pool_size) # psycopg2 pools raise instead of waiting
+        self.statements = {}   # {name: (pg_prepare_sql, original_sql)}
+        self.prepared = {}     # {id(conn): set(names)} PREPAREd per connection
+        self.stats = {"queries": 0, "batches": 0, "connects": 0, "errors": 0}
+
+    @property
+    def is_postgres(self):
+        return bool(self.dsn)
+
+    # --- Connections ---
+    def _get_pool(self):
+        if self.pool is None:
+            with self.lock:
+                if self.pool is None:
+                    # minconn == maxconn: psycopg2 closes idle conns above minconn (and their PREPAREs)
+                    self.pool = psycopg2.pool.ThreadedConnectionPool(self.pool_size, self.pool_size, self.dsn, **self.connect_kwargs)
+        return self.pool
+
+    def _checkout(self):
+        pool = self._get_pool()
+        self.slots.acquire()
+        try: conn = pool.getconn()
+        except:
+            self.slots.release()
+            raise
+        if id(conn) not in self.prepared:
+            self.prepared[id(conn)] = set()
+            self.stats["connects"] += 1
+        return conn
+
+    def _release(self, conn, broken=False):
+        if broken: self.prepared.pop(id(conn), None)
+        try: self.pool.putconn(conn, close=broken)
+        except: pass
+        finally: self.slots.release()
+
+    # --- Prepared statements ---
+    def prepare(self, name, query):
+        """Registers a hot query; PREPAREd lazily on every pooled connection (Postgres)"""
+        n = iter(range(1, 1000))
+        self.statements[name] = (f"PREPARE {name} AS " + re.sub(r"%s", lambda _: f"${next(n)}", query), query)
+        return name
+
+    def _pg_execute(self, conn, cur, query, params):
+        if query in self.statements:
+            done = self.prepared[id(conn)]
+            if query not in done:
+                cur.execute(self.statements[query][0])
+                done.add(query)
+            args = ", ".join(["%s"] * len(params))
+            cur.execute(f"EXECUTE {query} ({args})" if params else f"EXECUTE {query}", params)
+        else:
+            cur.execute(query, params)
+
+    def _sqlite_sql(self, query):
+        query = self.statements.get(query, (None, query))[1]
+        for a, b in _SQLITE_REWRITES: query = query.replace(a, b)
+        return query
+
+    # --- Public API ---
+    def exec(self, query, params=(), fetch=False):
+        """One statement (or a prepared name). Returns rows if fetch, None on failure"""
+        res = self.batch([(query, params, fetch)])
+        return res[0] if res else None
+
+    def batch(self, steps):
+        """
+        [(query_or_prepared_name, params, fetch)] in ONE transaction on ONE connection.
+        Returns [rows or None per step], or None if the batch failed (rolled back).
+        """
+        self.stats["batches"] += 1; self.stats["queries"] += len(steps)
+        steps = [(q, tuple(p or ()), f) for q, p, f in steps]
+        try:
+            if self.is_postgres: return self._pg_batch(steps)
+            return self._sqlite_batch(steps)
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"[Gateway:{self.name}] {e}")
+            return None
+
+    def _pg_batch(self, steps, retry=True):
+        conn = self._checkout()
+        try:
+            with conn.cursor() as cur:
+                if not any(f for _, _, f in steps) and not any(q in self.statements for q, _, _ in steps):
+                    # Pure writes: one multi-statement string = one round trip
+                    cur.execute("; ".join(q for q, _, _ in steps), tuple(p for _, params, _ in steps for p in params))
+                    out = [None] * len(steps)
+                else:
+                    out = []
+                    for q, params, fetch in steps:
+                        self._pg_execute(conn, cur, q, params)
+                        out.append(cur.fetchall() if fetch else None)
+            conn.commit()
+            self._release(conn)
+            return out
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self._release(conn, broken=True)
+            if retry: return self._pg_batch(steps, retry=False) # Stale pooled conn: one fresh try
+            raise
+        except:
+            try: conn.rollback()
+            except: pass
+            self._release(conn)
+            raise
+
+    def _sqlite_batch(self, steps):
+        sqls = [(self._sqlite_sql(q), params, fetch) for q, params, fetch in steps]
+        if all(s.lstrip().upper().startswith("SELECT") for s, _, _ in sqls):
+            with db.read_cursor() as cur:
+                out = []
+                for s, params, fetch in sqls:
+                    cur.execute(s, params)
+                    out.append(cur.fetchall() if fetch else None)
+                return out
+        with db.transaction() as cur:
+            out = []
+            for s, params, fetch in sqls:
+                cur.execute(s, params)
+                out.append(cur.fetchall() if fetch else None)
+            return out
+
+_gateways = {}
+_registry_lock = threading.Lock()
+
+def get(dsn=None, name="gateway"):
+    """Shared Gateway per DSN. No DSN -> main db.py store (pooled too if that is Postgres)"""
+    key = dsn or "__main__"
+    with _registry_lock:
+        if key not in _gateways:
+            try:
+                if dsn: _gateways[key] = Gateway(dsn, name=name)
+                elif db.IS_POSTGRES: _gateways[key] = Gateway(db.DATABASE_URL, name="main", sslmode="require")
+                else: _gateways[key] = Gateway(None, name="main")
+            except:
+                traceback.print_exc()
+                _gateways[key] = Gateway(None, name="main")
+        return _gateways[key]
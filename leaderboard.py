@@ -0,0 +1,276 @@
+import bisect
+import threading
+import traceback
+import db
+
+# ==========================================
+# 🏆 IN-PROCESS LEADERBOARDS
+# ==========================================
+# DB se ek baar seed hota hai, phir db.on_balance_change ke deltas se
+# update hota hai. Top-N / page-N are list slices, no SQL.
+
+class SortedBoard:
+    """
+    Scores as (-score, uid) keys in a blocked sorted list (sortedcontainers
+    style: sorted blocks of ~LOAD keys + a Fenwick tree over block sizes)
+    and a {uid: score} index. Update, rank and seek are O(log n) plus a
+    bounded in-block memmove, instead of one flat list's O(n) shift.
+    """
+    LOAD = 512
+
+    def __init__(self, default=0):
+        self.default = default
+        self.scores = {}
+        self.load(())
+
+    def load(self, items):
+        self.scores = dict(items)
+        keys = sorted((-score, uid) for uid, score in self.scores.items())
+        self.blocks = [keys[i:i + self.LOAD] for i in range(0, len(keys), self.LOAD)]
+        self.maxes = [b[-1] for b in self.blocks]
+        self._rebuild()
+
+    def _rebuild(self):
+        n = len(self.blocks)
+        tree = [0] + [len(b) for b in self.blocks]
+        for i in range(1, n + 1):
+            parent = i + (i & -i)
+            if parent <= n: tree[parent] += tree[i]
+        self.tree = tree
+
+    def _grow(self, b, delta):
+        i = b + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def _before(self, b):
+        """Keys in blocks[:b]"""
+        total, i = 0, b
+        while i:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def _find(self, index):
+        """index -> (block, offset) by descending the Fenwick tree"""
+        b, step = 0, 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            nxt = b + step
+            if nxt < len(self.tree) and self.tree[nxt] <= index:
+                b = nxt
+                index -= self.tree[nxt]
+            step >>= 1
+        return b, index
+
+    def _insert(self, key):
+        if not self.blocks:
+            self.blocks, self.maxes = [[key]], [key]
+            self._rebuild()
+            return
+        b = min(bisect.bisect_left(self.maxes, key), len(self.blocks) - 1)
+        block = self.blocks[b]
+        bisect.insort(block, key)
+        self.maxes[b] = block[-1]
+        if len(block) > 2 * self.LOAD: # Split: block count changes, rebuild the small tree
+            self.blocks[b:b + 1] = [block[:self.LOAD], block[self.LOAD:]]
+            self.maxes[b:b + 1] = [block[self.LOAD - 1], block[-1]]
+            self._rebuild()
+        else:
+            self._grow(b, 1)
+
+    def _delete(self, key):
+        b = bisect.bisect_left(self.maxes, key)
+        block = self.blocks[b]
+        del block[bisect.bisect_left(block, key)]
+        if block:
+            self.maxes[b] = block[-1]
+            self._grow(b, -1)
+        else:
+            del self.blocks[b], self.maxes[b]
+            self._rebuild()
+
+    def _index(self, key, right=False):
+        """Position key would take (bisect_left / bisect_right over all keys)"""
+        b = bisect.bisect_right(self.maxes, key) if right else bisect.bisect_left(self.maxes, key)
+        if b == len(self.blocks): return len(self)
+        return self._before(b) + (bisect.bisect_right if right else bisect.bisect_left)(self.blocks[b], key)
+
+    def _slice(self, start, limit):
+        out = []
+        if start >= len(self) or limit <= 0: return out
+        b, i = self._find(start)
+        while b < len(self.blocks) and len(out) < limit:
+            out.extend(self.blocks[b][i:i + limit - len(out)])
+            b, i = b + 1, 0
+        return out
+
+    def set(self, uid, score):
+        old = self.scores.get(uid)
+        if old is not None: self._delete((-old, uid))
+        self.scores[uid] = score
+        self._insert((-score, uid))
+
+    def add(self, uid, delta):
+        self.set(uid, self.scores.get(uid, self.default) + delta)
+
+    def remove(self, uid):
+        old = self.scores.pop(uid, None)
+        if old is not None: self._delete((-old, uid))
+
+    def page(self, offset=0, limit=10):
+        return [(uid, -neg) for neg, uid in self._slice(offset, limit)]
+
+    def after(self, value, uid, limit=10):
+        """Keyset page: rows ranked strictly below (value, uid), O(log n) seek"""
+        return [(u, -neg) for neg, u in self._slice(self._index((-value, uid), right=True), limit)]
+
+    def rank(self, uid):
+        """1-based rank (ties share it): keys ahead of the first key with this score, O(log n)"""
+        score = self.scores.get(uid)
+        if score is None: return None
+        return self._index((-score,)) + 1
+
+    def __len__(self): return len(self.scores)
+
+
+class Leaderboards:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.reload_lock = threading.Lock()
+        self.ready = False
+        self.buffer = None  # Deltas that arrive while a reseed is building boards
+        self.boards = {"points": SortedBoard(0), "chips": SortedBoard(db.STARTING_CHIPS)}
+        self.games = {}   # {game_name: SortedBoard} (earnings)
+        self.names = {}   # {uid: username}
+        self.wins = {}    # {uid: wins}
+
+    def ensure_loaded(self):
+        if not self.ready: self.reload()
+
+    def reload(self):
+        """Full seed from the DB (startup, or after out-of-band SQL like !wipedb)"""
+        with self.reload_lock:
+            try:
+                # No write is between its commit and its notify while we read (db.snapshot_scope),
+                # so every delta is in the snapshot or notified after it -> buffered, never both
+                with db.snapshot_scope(), db.journal.lock:
+                    with db.read_cursor() as cur:
+                        # LIVE_ROW / UNION ALL: ledger rows not compacted yet count too
+                        cur.execute(f"SELECT user_id, username, {db.LIVE_ROW} FROM users")
+                        users = cur.fetchall()
+                        cur.execute("SELECT user_id, game_name, earnings FROM game_stats" +
+                                    (" UNION ALL SELECT user_id, game, chips FROM ledger WHERE compacted = 0 AND game IS NOT NULL" if db.LEDGER else ""))
+                        stats = cur.fetchall()
+                    pending = db.journal.uncommitted()
+                    with self.lock: self.buffer = []
+            except:
+                traceback.print_exc()
+                return
+            try:
+                points, chips, names, wins = {}, {}, {}, {}
+                for uid, uname, pts, chp, w in users:
+                    points[uid], chips[uid] = pts, chp
+                    names[uid], wins[uid] = uname, w
+                per_game = {}
+                for uid, game, earnings in stats:
+                    g = per_game.setdefault(game, {})
+                    g[uid] = g.get(uid, 0) + earnings
+                # Write-behind rows that are still in the journal
+                for (uid, game), (uname, c_p, p_p, w_p) in pending.items():
+                    names.setdefault(uid, uname)
+                    chips[uid] = chips.get(uid, db.STARTING_CHIPS) + c_p
+                    points[uid] = points.get(uid, 0) + p_p
+                    wins[uid] = wins.get(uid, 0) + w_p
+                    g = per_game.setdefault(game, {})
+                    g[uid] = g.get(uid, 0) + c_p
+                boards = {"points": SortedBoard(0), "chips": SortedBoard(db.STARTING_CHIPS)}
+                boards["points"].load(points.items())
+                boards["chips"].load(chips.items())
+                games = {}
+                for game, items in per_game.items():
+                    games[game] = SortedBoard(0)
+                    games[game].load(items.items())
+                with self.lock:
+                    self.boards, self.games, self.names, self.wins = boards, games, names, wins
+                    for fn, args in self.buffer: fn(*args)
+                    self.ready = True
+                print(f"[Leaderboard] Seeded {len(users)} users, {len(games)} games.")
+            except:
+                traceback.print_exc()
+                with self.lock: self.ready = False # Buffered deltas are gone, reseed on next read
+            finally:
+                with self.lock: self.buffer = None
+
+    def on_change(self, uid, username, chips=0, points=0, wins=0, game=None):
+        with self.lock:
+            if self.buffer is not None:
+                self.buffer.append((self._apply, (uid, username, chips, points, wins, game)))
+            elif self.ready:
+                self._apply(uid, username, chips, points, wins, game)
+            # Not ready and no reseed running: the next seed reads it from the DB
+
+    def _apply(self, uid, username, chips, points, wins, game):
+        self.names.setdefault(uid, username)
+        self.wins[uid] = self.wins.get(uid, 0) + wins
+        self.boards["chips"].add(uid, chips)
+        self.boards["points"].add(uid, points)
+        if game:
+            self.games.setdefault(game, SortedBoard(0)).add(uid, chips)
+
+    def on_reset(self, uid):
+        """!resets: points, wins and game earnings of one user back to zero, chips untouched"""
+        with self.lock:
+            if self.buffer is not None: self.buffer.append((self._reset, (uid,)))
+            elif self.ready: self._reset(uid)
+
+    def _reset(self, uid):
+        if uid in self.boards["points"].scores: self.boards["points"].set(uid, 0)
+        if uid in self.wins: self.wins[uid] = 0
+        for board in self.games.values(): board.remove(uid)
+
+    def invalidate(self):
+        """Next read reseeds from the DB"""
+        with self.lock: self.ready = False
+
+    def _board(self, name):
+        return self.boards.get(name) or self.games.get(str(name).lower())
+
+    def top(self, name, limit=10, offset=0):
+        """[(uid, username, value)] ranked best first"""
+        self.ensure_loaded()
+        with self.lock:
+            board = self._board(name)
+            if not board: return []
+            return [(uid, self.names.get(uid, "Unknown"), v) for uid, v in board.page(offset, limit)]
+
+    def after(self, name, after=None, limit=10):
+        """Next page after the (value, uid) cursor; SQL seek on the rank index if the seed failed"""
+        self.ensure_loaded()
+        with self.lock:
+            board = self._board(name)
+            if self.ready and board is not None:
+                rows = board.page(0, limit) if after is None else board.after(after[0], after[1], limit)
+                return [(uid, self.names.get(uid, "Unknown"), v) for uid, v in rows]
+        return db.get_rank_page(name, after, limit)
+
+    def rank(self, name, uid):
+        """(rank, total, top_percent) for a user, None if not ranked"""
+        self.ensure_loaded()
+        with self.lock:
+            board = self._board(name)
+            if not board: return None
+            r = board.rank(str(uid))
+            if r is None: return None
+            return r, len(board), round(100.0 * r / len(board), 1)
+
+    def get_wins(self, uid):
+        with self.lock: return self.wins.get(str(uid), 0)
+
+    def game_names(self):
+        self.ensure_loaded()
+        with self.lock: return sorted(self.games)
+
+boards = Leaderboards()
+db.on_balance_change(boards.on_change)
+db.on_stats_reset(boards.on_reset)
@@ -0,0 +1,84 @@
+import time
+import traceback
+import db
+
+# ==========================================
+# 🧱 SCHEMA MIGRATIONS
+# ==========================================
+# Har version ek baar chalta hai, apni transaction me, aur schema_version
+# me record hota hai. Steps are plain SQL (or fn(cur)) valid on both SQLite
+# and Postgres, and idempotent (IF NOT EXISTS), so DBs created before this
+# runner existed upgrade cleanly. Naya change = naya version at the end,
+# never edit an applied one.
+
+MIGRATIONS = [
+    (1, "base tables", [
+        f"CREATE TABLE IF NOT EXISTS users (user_id TEXT PRIMARY KEY, username TEXT, points BIGINT DEFAULT 0, chips BIGINT DEFAULT {db.STARTING_CHIPS}, wins INTEGER DEFAULT 0)",
+        "CREATE TABLE IF NOT EXISTS game_stats (user_id TEXT, game_name TEXT, wins INTEGER DEFAULT 0, earnings BIGINT DEFAULT 0, PRIMARY KEY (user_id, game_name))",
+        "CREATE TABLE IF NOT EXISTS bot_admins (user_id TEXT PRIMARY KEY)",
+        "CREATE TABLE IF NOT EXISTS write_behind_batches (batch_id TEXT PRIMARY KEY)",
+    ]),
+    (2, "hot query indexes", [
+        # get_target_info: WHERE LOWER(username) = ?
+        "CREATE INDEX IF NOT EXISTS idx_users_username_lower ON users (LOWER(username))",
+        # Leaderboard seek: (value DESC, user_id) matches the page order exactly
+        "CREATE INDEX IF NOT EXISTS idx_users_points_rank ON users (points DESC, user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_users_chips_rank ON users (chips DESC, user_id)",
+    ]),
+    (3, "game guides", [
+        "CREATE TABLE IF NOT EXISTS guides (game_name TEXT PRIMARY KEY, description TEXT)",
+    ]),
+    (4, "economy ledger", [
+        lambda cur: cur.execute(
+            f"CREATE TABLE IF NOT EXISTS ledger (id {'BIGSERIAL PRIMARY KEY' if db.IS_POSTGRES else 'INTEGER PRIMARY KEY AUTOINCREMENT'}, "
+            "user_id TEXT NOT NULL, username TEXT, game TEXT, chips BIGINT DEFAULT 0, points BIGINT DEFAULT 0, wins INTEGER DEFAULT 0, "
+            "reason TEXT, idem_key TEXT UNIQUE, compacted INTEGER DEFAULT 0, created_at BIGINT)"),
+        # Readers sum the tail per user; partial index keeps it tiny
+        "CREATE INDEX IF NOT EXISTS idx_ledger_tail ON ledger (user_id) WHERE compacted = 0",
+        "CREATE INDEX IF NOT EXISTS idx_ledger_created ON ledger (created_at)",
+    ]),
+    (5, "updated_at stamps", [
+        lambda cur: add_column(cur, "users", "updated_at", "BIGINT DEFAULT 0"),
+        lambda cur: add_column(cur, "game_stats", "updated_at", "BIGINT DEFAULT 0"),
+        # Export filter: ?since=
+        "CREATE INDEX IF NOT EXISTS idx_users_updated ON users (updated_at)",
+        "CREATE INDEX IF NOT EXISTS idx_game_stats_updated ON game_stats (updated_at)",
+    ]),
+]
+
+def add_column(cur, table, column, decl):
+    """ALTER TABLE ADD COLUMN, idempotent on both (SQLite has no IF NOT EXISTS for it)"""
+    if db.IS_POSTGRES:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {decl}")
+        return
+    cur.execute(f"PRAGMA table_info({table})")
+    if column not in [r[1] for r in cur.fetchall()]:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def current_version():
+    try:
+        with db.read_cursor() as cur:
+            cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+            return cur.fetchone()[0]
+    except:
+        return 0
+
+def migrate():
+    """Applies every pending version in order; returns the schema version"""
+    ph = db.get_ph()
+    with db.write_cursor() as cur:
+        cur.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, name TEXT, applied_at BIGINT)")
+    for version, name, steps in MIGRATIONS:
+        with db.transaction() as cur:
+            cur.execute(f"SELECT 1 FROM schema_version WHERE version = {ph}", (version,))
+            if cur.fetchone(): continue
+            for step in steps:
+                if callable(step): step(cur)
+                else: cur.execute(step)
+            cur.execute(f"INSERT INTO schema_version (version, name, applied_at) VALUES ({ph}, {ph}, {ph})", (version, name, int(time.time())))
+        print(f"[DB] Migration {version:03d} applied: {name}")
+    return current_version()
+
+if __name__ == "__main__":
+    try: print(f"[DB] Schema at version {migrate()}")
+    except: traceback.print_exc()
@@ -1,9 +1,8 @@
 import time
 import random
+import uuid
 import threading
-import requests
-import io
-from PIL import Image, ImageDraw, ImageFont
+from PIL import ImageDraw
 
 # --- IMPORTS ---
 try: 
@@ -12,7 +11,7 @@ except ImportError:
     print("[CookieBlast] Warning: utils.py not found.")
 
 try: 
-    from db import add_game_result
+    from db import add_game_result, settlement_key
 except: 
     pass
 
@@ -47,135 +46,129 @@ def setup(bot):
 # 🎨 ASSET & FONT HELPERS
 # ==========================================
 
+FONT_PATHS = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "arialbd.ttf", "arial.ttf"
+]
+
 def get_font(size):
-    font_paths = [
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
-        "arialbd.ttf", "arial.ttf"
-    ]
-    for path in font_paths:
-        try: return ImageFont.truetype(path, size)
-        except: continue
-    return ImageFont.load_default()
-
-def get_avatar(username):
-    try:
-        seed = f"{username}-{random.randint(1,999)}"
-        url = f"https://api.dicebear.com/9.x/fun-emoji/png?seed={seed}&backgroundColor=transparent&size=512"
-        r = requests.get(url, timeout=3)
-        if r.status_code == 200:
-            return Image.open(io.BytesIO(r.content)).convert("RGBA")
-    except: pass
-    return None
+    return utils.get_font(size, FONT_PATHS) # Resolved once, cached per size
+
+def get_avatar(username, mood=None, size=350):
+    """Local procedural emoji face (offline, cached per variant)"""
+    try: return utils.procedural_avatar(username, "emoji", random.randrange(utils.AVATAR_VARIANTS), mood, size)
+    except: return None
 
 def centered_text(draw, x, y, text, size, color, shadow=True):
-    font = get_font(size)
-    try: w = font.getlength(text)
+    try: w = utils.fonts.length(text, size, FONT_PATHS)
     except: w = len(text) * (size*0.6)
     
     nx = x - (w / 2)
     ny = y - (size / 2)
     
+    # Cell numbers / names repeat: cached raster, paste only
     if shadow:
-        draw.text((nx+3, ny+3), text, font=font, fill=(0,0,0,100))
-    draw.text((nx, ny), text, font=font, fill=color)
+        utils.fonts.draw(draw, (nx+3, ny+3), text, size, (0,0,0,100), paths=FONT_PATHS)
+    utils.fonts.draw(draw, (nx, ny), text, size, color, paths=FONT_PATHS)
 
 # ==========================================
 # 🖼️ BOARD RENDERER (Enhanced Header)
 # ==========================================
 
-def render_board(game):
-    W, H = CANVAS_W, CANVAS_H
-    img = utils.create_canvas(W, H, BG_COLOR)
-    d = ImageDraw.Draw(img)
-    
-    # 1. HEADER (Scoreboard & Usernames)
-    # Background Panel
+# Header panel + the closed 36-box grid are one static layer (utils.render_layers);
+# per move sirf player cards and the opened boxes paint hote hain.
+GRID_Y = 240
+GRID_X = (CANVAS_W - ((BOX_SIZE * 6) + (GAP * 5))) // 2
+
+def _box_origin(i):
+    row, col = i // 6, i % 6
+    return GRID_X + (col * (BOX_SIZE + GAP)), GRID_Y + (row * (BOX_SIZE + GAP))
+
+def _paint_closed_board(img, d):
+    # 1. HEADER Background Panel
     d.rounded_rectangle([20, 20, 1004, 200], radius=20, fill="#2f3640", outline="#57606f", width=2)
-    
-    # Sort players by score
-    players = sorted(game.players.values(), key=lambda x: x['score'], reverse=True)
-    
-    # Dynamic Width based on player count (Max 4)
-    # Total width 960. 4 players = 240px each.
-    col_w = 960 // 4
-    
-    for i, p in enumerate(players):
-        px = 40 + (i * col_w)
-        py = 40
-        
-        # Highlight active turn
-        is_turn = (p['uid'] == game.turn_order[game.turn_index])
-        
-        # Box Colors
-        bg_col = "#333"
-        border_col = "#555"
-        
-        if is_turn: 
-            bg_col = "#144225" # Dark Green
-            border_col = "#2ecc71" # Bright Green
-        
-        if p['eliminated']:
-            bg_col = "#4a1010" # Dark Red
-            border_col = "#e74c3c" # Red
-            
-        # Draw Player Card
-        d.rounded_rectangle([px, py, px+col_w-20, py+140], radius=15, fill=bg_col, outline=border_col, width=3)
-        
-        # Name (Big & Clear)
-        name = p['name'][:8]
-        centered_text(d, px + (col_w-20)//2, py + 35, name, 35, "white")
-        
-        # Score & Status
-        if p['eliminated']:
-            status_txt = "💀 OUT"
-            status_col = "#e74c3c"
-        else:
-            status_txt = f"🍪 {p['score']}"
-            status_col = "#f1c40f"
-            
-        centered_text(d, px + (col_w-20)//2, py + 100, status_txt, 45, status_col)
 
-    # 2. THE GRID (3D Buttons)
-    grid_start_y = 240
-    grid_w = (BOX_SIZE * 6) + (GAP * 5)
-    margin_x = (W - grid_w) // 2
-    
+    # 2. THE GRID (3D Buttons, CLOSED STATE)
     for i in range(36):
-        row = i // 6
-        col = i % 6
-        
-        x = margin_x + (col * (BOX_SIZE + GAP))
-        y = grid_start_y + (row * (BOX_SIZE + GAP))
-        
-        # Draw Box Base
-        is_open = game.opened[i]
-        
-        if not is_open:
-            # CLOSED STATE (3D Blue Button)
-            d.rounded_rectangle([x, y+10, x+BOX_SIZE, y+BOX_SIZE+10], radius=15, fill=BOX_SHADOW)
-            d.rounded_rectangle([x, y, x+BOX_SIZE, y+BOX_SIZE], radius=15, fill=BOX_CLOSED)
-            d.rounded_rectangle([x+5, y+5, x+BOX_SIZE-5, y+BOX_SIZE//2], radius=15, fill=(255,255,255,40))
-            centered_text(d, x + BOX_SIZE//2, y + BOX_SIZE//2, str(i+1), 50, "white")
-            
-        else:
-            # OPENED STATE (Flat)
+        x, y = _box_origin(i)
+        d.rounded_rectangle([x, y+10, x+BOX_SIZE, y+BOX_SIZE+10], radius=15, fill=BOX_SHADOW)
+        d.rounded_rectangle([x, y, x+BOX_SIZE, y+BOX_SIZE], radius=15, fill=BOX_CLOSED)
+        d.rounded_rectangle([x+5, y+5, x+BOX_SIZE-5, y+BOX_SIZE//2], radius=15, fill=(255,255,255,40))
+        centered_text(d, x + BOX_SIZE//2, y + BOX_SIZE//2, str(i+1), 50, "white")
+
+def render_board(game):
+    def scoreboard(img, d):
+        # Sort players by score
+        players = sorted(game.players.values(), key=lambda x: x['score'], reverse=True)
+
+        # Dynamic Width based on player count (Max 4)
+        # Total width 960. 4 players = 240px each.
+        col_w = 960 // 4
+
+        for i, p in enumerate(players):
+            px = 40 + (i * col_w)
+            py = 40
+
+            # Highlight active turn
+            is_turn = (p['uid'] == game.turn_order[game.turn_index])
+
+            # Box Colors
+            bg_col = "#333"
+            border_col = "#555"
+
+            if is_turn:
+                bg_col = "#144225" # Dark Green
+                border_col = "#2ecc71" # Bright Green
+
+            if p['eliminated']:
+                bg_col = "#4a1010" # Dark Red
+                border_col = "#e74c3c" # Red
+
+            # Draw Player Card
+            d.rounded_rectangle([px, py, px+col_w-20, py+140], radius=15, fill=bg_col, outline=border_col, width=3)
+
+            # Name (Big & Clear)
+            name = p['name'][:8]
+            centered_text(d, px + (col_w-20)//2, py + 35, name, 35, "white")
+
+            # Score & Status
+            if p['eliminated']:
+                status_txt = "💀 OUT"
+                status_col = "#e74c3c"
+            else:
+                status_txt = f"🍪 {p['score']}"
+                status_col = "#f1c40f"
+
+            centered_text(d, px + (col_w-20)//2, py + 100, status_txt, 45, status_col)
+
+    def opened_boxes(img, d):
+        for i in range(36):
+            if not game.opened[i]: continue
+            x, y = _box_origin(i)
+            # OPENED STATE (Flat): closed button hatao, phir pressed box
+            d.rectangle([x, y, x+BOX_SIZE, y+BOX_SIZE+10], fill=BG_COLOR)
+
             content = game.board[i] # 0=Cookie, 1=Bomb
             opener_name = game.opened_by[i]
-            
+
             fill = BOX_COOKIE if content == 0 else BOX_BOMB
             icon = "🍪" if content == 0 else "💥"
-            
+
             # Pressed Box
             d.rounded_rectangle([x, y+10, x+BOX_SIZE, y+BOX_SIZE+10], radius=15, fill=fill)
-            
+
             # Icon
             centered_text(d, x + BOX_SIZE//2, y + BOX_SIZE//2 - 15, icon, 60, "black", False)
-            
+
             # Username Tag (Bottom of box)
             d.rounded_rectangle([x+5, y+BOX_SIZE-35, x+BOX_SIZE-5, y+BOX_SIZE+5], radius=8, fill=(0,0,0,140))
             centered_text(d, x + BOX_SIZE//2, y + BOX_SIZE-15, opener_name[:7], 20, "white", False)
 
-    return img
+    return utils.render_layers("cookies_board", (CANVAS_W, CANVAS_H), [
+        utils.static_layer("closed", _paint_closed_board),
+        utils.dynamic_layer(scoreboard),
+        utils.dynamic_layer(opened_boxes),
+    ], background=BG_COLOR)
 
 # ==========================================
 # 💣 BLAST CARD RENDERER
@@ -194,9 +187,8 @@ def render_blast(username):
         d.ellipse([x, y, x+s, y+s], fill=col + "40") # Hex + Alpha workaround if supported, else distinct colors
     
     # Avatar
-    av = get_avatar(username)
+    av = get_avatar(username, "dizzy", 350)
     if av:
-        av = av.resize((350, 350))
         img.paste(av, (100, 125), av)
         
     # Text
@@ -224,9 +216,8 @@ def render_winner(username, score):
         y = cy + r * math.sin(math.radians(i))
         d.line([cx, cy, x, y], fill="#f1c40f", width=5)
         
-    av = get_avatar(username)
+    av = get_avatar(username, "cool", 250)
     if av:
-        av = av.resize((250, 250))
         img.paste(av, (W//2 - 125, 50), av)
         
     centered_text(d, W//2, 350, "CHAMPION!", 90, "#f1c40f")
@@ -242,6 +233,7 @@ def render_winner(username, score):
 class CookieGame:
     def __init__(self, room_id, host_id, host_name):
         self.id = room_id; self.host_id = host_id
+        self.match_id = uuid.uuid4().hex[:12] # Settlement idem_key part
         self.players = {}; self.state = 'lobby'; self.board = []
         self.opened = [False] * 36; self.opened_by = [""] * 36
         self.turn_order = []; self.turn_index = 0
@@ -307,7 +299,7 @@ class CookieGame:
 def task_update(bot, rid, g, text="Update"):
     try:
         img = render_board(g)
-        link = utils.upload(bot, img)
+        link = utils.upload(bot, img, profile="png_palette") # Flat board
         if link: bot.send_json({"handler": "chatroommessage", "roomid": rid, "type": "image", "url": link, "text": text})
     except: pass
 
@@ -350,7 +342,7 @@ def game_monitor_loop():
                             if act:
                                 w = max(act, key=lambda x:x['score'])
                                 task_win(BOT_INSTANCE, rid, w['name'], w['score'])
-                                add_game_result(w['uid'], w['name'], "cookie_blast", 500, True)
+                                add_game_result(w['uid'], w['name'], "cookie_blast", 500, True, idem_key=settlement_key("cookie_blast", rid, g.match_id, w['uid']))
                             to_del.append(rid)
                         else:
                             g.next_turn()
@@ -388,7 +380,7 @@ def handle_command(bot, command, room_id, user, args, data):
             g = games.get(room_id)
             if not g or str(uid) != str(g.host_id): return False
             if g.start_game():
-                utils.run_in_bg(task_update, bot, room_id, g, "Started")
+                utils.run_in_bg(task_update, bot, room_id, g, "Started", priority="interactive")
                 p1 = g.players[g.turn_order[0]]['name']
                 bot.send_message(room_id, f"🔥 **Start!** Turn: @{p1}")
             else: bot.send_message(room_id, "Need 2+ Players")
@@ -421,13 +413,13 @@ def handle_command(bot, command, room_id, user, args, data):
             else:
                 p['score'] += 1
                 bot.send_message(room_id, f"🍪 **Yum!** @{user}")
-                utils.run_in_bg(task_update, bot, room_id, g, "Move")
+                utils.run_in_bg(task_update, bot, room_id, g, "Move", priority="interactive")
             
             if g.check_end_condition():
                 act = [x for x in g.players.values() if not x['eliminated']]
                 if act:
                     w = max(act, key=lambda x:x['score'])
-                    add_game_result(w['uid'], w['name'], "cookie_blast", 500, True)
+                    add_game_result(w['uid'], w['name'], "cookie_blast", 500, True, idem_key=settlement_key("cookie_blast", room_id, g.match_id, w['uid']))
                     utils.run_in_bg(task_win, bot, room_id, w['name'], w['score'])
                     bot.send_message(room_id, f"🏆 **Winner:** @{w['name']}")
                 del games[room_id]; return True
@@ -22,28 +22,27 @@ def setup(bot):
 
 class AssetLib:
     @staticmethod
-    def get_premium_avatar(username, vibe):
+    def get_premium_avatar(username, vibe, size=280):
         """
-        Chooses the best avatar style based on Vibe.
-        No more boring/bald avatars.
+        Chooses the avatar style based on Vibe (local procedural avatar, offline).
+        Random variant index = variety, yet every variant stays cached.
         """
-        # Random seed modifier to ensure uniqueness every time
-        seed = f"{username}_{random.randint(1, 9999)}"
-        
+        variant = random.randrange(utils.AVATAR_VARIANTS)
+
         if vibe == "love" or vibe == "cute":
-            # Cute 3D or Anime style
-            style = random.choice(["fun-emoji", "lorelei"])
-        elif vibe == "angry" or vibe == "sad":
+            # Heart-eyes face
+            style, mood = "emoji", "love"
+        elif vibe == "angry" or vibe == "sad" or vibe == "cool":
             # Expressive faces
-            style = "notionists" # Sketch style captures emotion well
-        elif vibe == "cool" or vibe == "fun":
-            # Stylish humans
-            style = random.choice(["avataaars", "micah", "open-peeps"])
+            style, mood = "emoji", vibe
+        elif vibe == "fun":
+            # Playful pattern
+            style, mood = "geometric", None
         else:
             # Default stylish
-            style = "notionists"
+            style, mood = "initials", None
 
-        return f"https://api.dicebear.com/9.x/{style}/png?seed={seed}&size=1024&backgroundColor=transparent"
+        return utils.procedural_avatar(username, style, variant, mood, size)
 
     @staticmethod
     def get_vibe_icon(vibe):
@@ -126,11 +125,9 @@ def create_square_design(username, text):
     d.rounded_rectangle([m, m, W-m, H-m], radius=40, outline=(255, 255, 255, 150), width=4)
 
     # 3. Avatar (Premium)
-    avatar_url = AssetLib.get_premium_avatar(username, vibe)
-    avatar = utils.get_image(avatar_url)
+    avatar = AssetLib.get_premium_avatar(username, vibe, 280)
     
     if avatar:
-        avatar = avatar.resize((280, 280))
         # Shadow
         shadow = Image.new("RGBA", (280, 280), (0,0,0,0))
         ImageDraw.Draw(shadow).ellipse([20, 240, 260, 270], fill=(0,0,0,50))
@@ -180,12 +177,10 @@ def create_sticker_design(username, text):
     d = ImageDraw.Draw(content)
     
     # 1. Avatar (Big Head)
-    # Using 'fun-emoji' because it looks best as a sticker
-    avatar_url = f"https://api.dicebear.com/9.x/fun-emoji/png?seed={username}_{random.randint(1,999)}&size=512"
-    avatar = utils.get_image(avatar_url)
+    # Emoji face because it looks best as a sticker
+    avatar = utils.procedural_avatar(username, "emoji", random.randrange(utils.AVATAR_VARIANTS), "happy", 300)
     
     if avatar:
-        avatar = avatar.resize((300, 300))
         content.paste(avatar, (W//2 - 150, 50), avatar)
         
     # 2. Text Bubble
@@ -245,7 +240,7 @@ def handle_command(bot, command, room_id, user, args, data):
         bot.send_message(room_id, "🎨 **Designing Premium Card...**")
         
         img = create_square_design(user, text)
-        link = utils.upload(bot, img)
+        link = utils.upload(bot, img, profile="webp")
         
         if link:
             user_drafts[user_id] = link
@@ -283,7 +278,7 @@ def handle_command(bot, command, room_id, user, args, data):
         bot.send_message(room_id, f"🎨 Creating Sticker for @{target}...")
         
         img = create_sticker_design(user, text)
-        link = utils.upload(bot, img)
+        link = utils.upload(bot, img, profile="webp")
         
         if link:
             bot.send_dm_image(target, link, "You got a Sticker! ⭐")
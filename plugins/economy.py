@@ -3,6 +3,8 @@ import threading
 import traceback
 import db
 import utils
+import leaderboard
+import backup
 
 # CONFIG
 PAGE_SIZE = 10
@@ -43,23 +45,13 @@ def get_target_info(bot, room_id, name):
             real = next((u for u in users if u.lower()==clean), name)
             return uid, real
     # DB search for offline
-    conn = db.get_connection()
-    try:
-        cur = conn.cursor()
+    with db.read_cursor() as cur:
         cur.execute(f"SELECT user_id, username FROM users WHERE LOWER(username) = {db.get_ph()} LIMIT 1", (clean,))
         res = cur.fetchone()
         return (str(res[0]), res[1]) if res else (None, None)
-    finally:
-        conn.close()
 
 def get_detailed_stats(user_id):
-    conn = db.get_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute(f"SELECT game_name, wins, earnings FROM game_stats WHERE user_id = {db.get_ph()}", (str(user_id),))
-        return cur.fetchall()
-    finally:
-        conn.close()
+    return db.get_game_stats(user_id)
 
 # COMMAND HANDLER
 def handle_command(bot, cmd, room_id, user, args, data):
@@ -80,9 +72,7 @@ def handle_command(bot, cmd, room_id, user, args, data):
                     try:
                         val = int(args[1])
                         is_score = cmd == "sets"
-                        curr = db.get_user_data(tid, tname)['points' if is_score else 'chips']
-                        change = val - curr
-                        db.update_balance(tid, tname, points_change=change if is_score else 0, chips_change=0 if is_score else change)
+                        db.set_balance(tid, tname, "points" if is_score else "chips", val)
                         bot.send_message(room_id, f"[OK] Admin set {tname}'s {'score' if is_score else 'chips'} to {format_k(val)}")
                     except ValueError: pass
                 else: bot.send_message(room_id, f"[!] User '{args[0]}' not found.")
@@ -92,19 +82,28 @@ def handle_command(bot, cmd, room_id, user, args, data):
                 tid, tname = get_target_info(bot, room_id, args[0])
                 if tid:
                     if cmd == "resetc":
-                        db.update_balance(tid, tname, chips_change=-db.get_user_data(tid, tname)['chips'])
+                        db.set_balance(tid, tname, "chips", 0)
                         bot.send_message(room_id, f"[OK] {tname}'s chips reset.")
                     else: # resets
-                        conn = db.get_connection(); cur = conn.cursor()
-                        cur.execute(f"UPDATE users SET points=0, wins=0 WHERE user_id={db.get_ph()}", (tid,))
-                        cur.execute(f"DELETE FROM game_stats WHERE user_id={db.get_ph()}", (tid,)); conn.close()
+                        db.reset_stats(tid) # Boards follow via db.on_stats_reset, no full reseed
                         bot.send_message(room_id, f"[OK] {tname}'s stats wiped.")
                 return True
 
+            if cmd == "backup":
+                bot.send_message(room_id, "[..] Backup started (game play continues).")
+                def _run():
+                    path = backup.task.run(); st = backup.task.status
+                    bot.send_message(room_id, f"[OK] Backup saved: {path} ({format_k(st['last_size'])} bytes, {st['last_seconds']}s)" if path
+                                     else f"[!] Backup failed: {st['error'] or 'already running'}")
+                utils.run_in_bg(_run, priority="background")
+                return True
+
             if cmd == "wipedb" and args and args[0]=="confirm":
-                conn = db.get_connection(); cur = conn.cursor()
-                cur.execute("UPDATE users SET points=0, chips=10000, wins=0"); cur.execute("DELETE FROM game_stats")
-                conn.close(); bot.send_message(room_id, "[ALERT] DB WIPE COMPLETE.")
+                db.wipe_economy()
+                # Full reseed off the command thread; background queue full -> the next read reseeds
+                fut = utils.run_in_bg(leaderboard.boards.reload, priority="background")
+                fut.add_done_callback(lambda f: f.exception() and leaderboard.boards.invalidate())
+                bot.send_message(room_id, "[ALERT] DB WIPE COMPLETE.")
                 return True
 
         # USER
@@ -115,8 +114,7 @@ def handle_command(bot, cmd, room_id, user, args, data):
                 tid, tname = get_target_info(bot, room_id, args[0])
                 if not tid or tid == uid: bot.send_message(room_id,"[!] Invalid target."); return True
                 if db.get_user_data(uid, user)['chips'] < MIN_TRANSFER_BALANCE: bot.send_message(room_id, f"[!] Min balance {format_k(MIN_TRANSFER_BALANCE)} needed."); return True
-                if db.check_and_deduct_chips(uid, user, amt):
-                    db.update_balance(tid, tname, chips_change=amt)
+                if db.transfer_chips(uid, user, tid, tname, amt, min_balance=MIN_TRANSFER_BALANCE):
                     bot.send_message(room_id, f"[OK] @{user} sent {format_k(amt)} to {tname}.")
                 else: bot.send_message(room_id, "[!] Not enough chips.")
                 return True
@@ -133,6 +131,8 @@ def handle_command(bot, cmd, room_id, user, args, data):
             if not tid: bot.send_message(room_id, "[!] User not found."); return True
             ud = db.get_user_data(tid, r_name); g_rows = get_detailed_stats(tid)
             msg = f"--- PROFILE: {r_name.upper()} ---\n[*] Score: {format_k(ud['points'])}\n($) Chips: {format_k(ud['chips'])}\n"
+            rs, rc = leaderboard.boards.rank("points", tid), leaderboard.boards.rank("chips", tid)
+            if rs and rc: msg += f"[#] Rank: {rs[0]:,} score | {rc[0]:,} chips\n"
             if g_rows:
                 msg += "--- Game Records ---\n"
                 for gn, w, e in g_rows: msg += f"- {gn.capitalize()}: {w}W | {format_k(e)}\n"
@@ -141,15 +141,32 @@ def handle_command(bot, cmd, room_id, user, args, data):
         if cmd in ["gls", "chips"]:
             purge_expired_sessions()
             b_type, col, title = ("gls", "points", "SCORE RANK") if cmd == "gls" else ("chips", "chips", "CHIPS RANK")
-            conn = db.get_connection(); cur = conn.cursor()
-            rows = []
-            try:
-                cur.execute(f"SELECT username, {col} FROM users ORDER BY {col} DESC LIMIT {PAGE_SIZE}"); rows = cur.fetchall()
-            finally: conn.close()
+            rows = leaderboard.boards.after(col, None, PAGE_SIZE)
             msg = f"--- {title} ---\n"
-            for i, (un, v) in enumerate(rows, 1): msg += f"{get_symbol(i, b_type)} {i}. {un[:12]} : {format_k(v)}\n"
+            for i, (_, un, v) in enumerate(rows, 1): msg += f"{get_symbol(i, b_type)} {i}. {un[:12]} : {format_k(v)}\n"
             msg += f"--------------\nPage 1 | !nx (30s)"
-            with SESSIONS_LOCK: SESSIONS[f"{room_id}_{uid}"] = {'type': b_type, 'page': 0, 'expires': now + SESSION_TIMEOUT}
+            # Cursor = last (value, user_id) shown; !nx seeks past it instead of OFFSET
+            last = (rows[-1][2], rows[-1][0]) if rows else None
+            with SESSIONS_LOCK: SESSIONS[f"{room_id}_{uid}"] = {'type': b_type, 'page': 0, 'shown': len(rows), 'last': last, 'expires': now + SESSION_TIMEOUT}
+            bot.send_message(room_id, msg); return True
+
+        if cmd == "rank":
+            t_name = args[0] if args else user
+            tid, r_name = get_target_info(bot, room_id, t_name)
+            if not tid: bot.send_message(room_id, "[!] User not found."); return True
+            msg = f"--- RANK: {r_name.upper()} ---\n"
+            for label, col in (("[*] Score", "points"), ("($) Chips", "chips")):
+                r = leaderboard.boards.rank(col, tid)
+                msg += f"{label}: #{r[0]:,} of {r[1]:,} (Top {r[2]}%)\n" if r else f"{label}: Unranked\n"
+            bot.send_message(room_id, msg); return True
+
+        if cmd == "gtop":
+            games = leaderboard.boards.game_names()
+            if not args or args[0].lower() not in games:
+                bot.send_message(room_id, f"Usage: !gtop <game>\nGames: {', '.join(games) or '-'}"); return True
+            rows = leaderboard.boards.top(args[0].lower(), PAGE_SIZE)
+            msg = f"--- {args[0].upper()} EARNINGS ---\n"
+            for i, (_, un, v) in enumerate(rows, 1): msg += f"{get_symbol(i, 'chips')} {i}. {un[:12]} : {format_k(v)}\n"
             bot.send_message(room_id, msg); return True
 
         if cmd == "nx":
@@ -157,18 +174,16 @@ def handle_command(bot, cmd, room_id, user, args, data):
             with SESSIONS_LOCK:
                 sess = SESSIONS.get(key)
                 if not sess or now > sess['expires']: return False
-                sess['page']+=1; sess['expires']=now + SESSION_TIMEOUT
-                page, b_type = sess['page'], sess['type']
+                sess['expires'] = now + SESSION_TIMEOUT
+                b_type, last, shown = sess['type'], sess['last'], sess['shown']
             col = "points" if b_type == "gls" else "chips"
-            offset = page * PAGE_SIZE
-            conn = db.get_connection(); cur = conn.cursor()
-            rows = []
-            try:
-                cur.execute(f"SELECT username, {col} FROM users ORDER BY {col} DESC LIMIT {PAGE_SIZE} OFFSET {offset}", (offset,)); rows = cur.fetchall()
-            finally: conn.close()
+            rows = leaderboard.boards.after(col, last, PAGE_SIZE) if last else []
             if not rows: bot.send_message(room_id, "End of list."); return True
+            with SESSIONS_LOCK:
+                sess['page'] += 1; sess['shown'] += len(rows); sess['last'] = (rows[-1][2], rows[-1][0])
+                page = sess['page']
             msg = f"--- PAGE {page+1} ---\n"
-            for i, (un, v) in enumerate(rows, 1): msg += f"- {offset+i}. {un[:12]} : {format_k(v)}\n"
+            for i, (_, un, v) in enumerate(rows, 1): msg += f"- {shown+i}. {un[:12]} : {format_k(v)}\n"
             bot.send_message(room_id, msg); return True
 
     except:
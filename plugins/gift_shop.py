@@ -1,11 +1,10 @@
-import os
 import io
 import time
 import requests
 import json
 import threading
 import traceback
-from PIL import Image, ImageDraw, ImageSequence, ImageFont, ImageFilter
+from PIL import Image, ImageDraw, ImageSequence, ImageFilter
 import utils
 import db
 
@@ -14,6 +13,7 @@ TENOR_KEY = "LIVDSRZULELA"  # Public Demo Key
 GIFT_PRICE = 2000
 CLEANUP_TIME = 120  # 2 Minutes
 MAX_FRAMES = 40     # Optimization
+GIFT_FONTS = ["bot_font.ttf"] + utils.FONT_PATHS
 
 # --- STATE & LOCKS ---
 pending_gifts = {}
@@ -54,19 +54,8 @@ def create_personalized_gif(gif_url, target_name):
         frames = []
         size = (300, 300) 
         
-        # --- FONT LOADING FIX ---
-        # Utils ne font download kiya hoga, hum wahi use karenge
+        # --- FONT (bot_font.ttf agar download hua hai, warna utils fonts) ---
         font_size = 24
-        try:
-            # Check for the downloaded font from utils
-            if os.path.exists("bot_font.ttf"):
-                font = ImageFont.truetype("bot_font.ttf", font_size)
-            else:
-                # Fallback to internal Utils font loader
-                font = utils.utils_instance.get_font(font_size)
-        except:
-            # Absolute fallback
-            font = ImageFont.load_default()
 
         # 2. Frame Processing Loop
         i = 0
@@ -76,10 +65,8 @@ def create_personalized_gif(gif_url, target_name):
             
             frame = frame.convert("RGBA").resize(size, Image.Resampling.LANCZOS)
             
-            # Mask
-            mask = Image.new('L', size, 0)
-            draw_mask = ImageDraw.Draw(mask)
-            draw_mask.ellipse((0, 0) + size, fill=255)
+            # Mask (same for every frame, cached)
+            mask = utils.get_mask("circle", size)
             
             output = Image.new("RGBA", size, (0,0,0,0))
             output.paste(frame, (0, 0), mask)
@@ -93,15 +80,9 @@ def create_personalized_gif(gif_url, target_name):
             # Text Badge
             text = f"For {target_name.title()}"
             
-            # Text Size Calculation (Works with TTF)
-            try:
-                # Modern Pillow
-                left, top, right, bottom = d.textbbox((0, 0), text, font=font)
-                text_w = right - left
-                text_h = bottom - top
-            except:
-                # Old Pillow fallback
-                text_w, text_h = d.textsize(text, font=font)
+            # Text Size Calculation (memoized, same for every frame)
+            left, top, right, bottom = utils.fonts.bbox(text, font_size, paths=GIFT_FONTS)
+            text_w = right - left
 
             # Draw Pill Background
             badge_w = text_w + 40
@@ -116,10 +97,9 @@ def create_personalized_gif(gif_url, target_name):
             text_x = 150
             text_y = 259 # Center of the pill vertically
             
-            # Shadow
-            d.text((text_x+1, text_y+1), text, font=font, fill="black", anchor="mm")
-            # Main Text
-            d.text((text_x, text_y), text, font=font, fill="#FFD700", anchor="mm")
+            # Shadow + Main Text (one raster for all frames)
+            utils.fonts.draw(d, (text_x+1, text_y+1), text, font_size, "black", "mm", GIFT_FONTS)
+            utils.fonts.draw(d, (text_x, text_y), text, font_size, "#FFD700", "mm", GIFT_FONTS)
 
             frames.append(output)
 
@@ -231,21 +211,10 @@ def handle_command(bot, command, room_id, user, args, data):
             
         final_target = args[0].replace("@", "") if args else gift_data['target_name']
         
-        # Economy Check
-        conn = db.get_connection()
-        cur = conn.cursor()
-        ph = "%s" if db.DATABASE_URL.startswith("postgres") else "?"
-        cur.execute(f"SELECT global_score FROM users WHERE user_id = {ph}", (uid,))
-        row = cur.fetchone()
-        balance = row[0] if row else 0
-        conn.close()
-        
-        if balance < GIFT_PRICE:
+        # ECONOMY: Atomic check and deduct (two gifts at once can't both pass the check)
+        if not db.check_and_deduct_chips(uid, user, GIFT_PRICE):
             bot.send_message(room_id, f"❌ Insufficient Funds! Need **{GIFT_PRICE:,} Chips**.")
             return True
-            
-        # Transaction
-        db.add_game_result(uid, user, "gift_sent", -GIFT_PRICE, False)
         
         # Delivery (DM)
         bot.send_dm_image(final_target, gift_data['url'], f"🎁 **SURPRISE!**\n@{user} sent you a Premium Gift!")
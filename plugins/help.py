@@ -79,7 +79,7 @@ def handle_command(bot, command, room_id, user, args, data):
                 bot.send_message(room_id, "❌ Koi guides available nahi hain.\nAdmin `!guide` use karke add karein.")
                 return True
             
-            link = utils.upload(bot, draw_list_card(games))
+            link = utils.upload(bot, draw_list_card(games), profile="png_palette")
             bot.send_json({"handler": "chatroommessage", "roomid": room_id, "type": "image", "url": link, "text": "Help List"})
             return True
         else:
@@ -88,7 +88,7 @@ def handle_command(bot, command, room_id, user, args, data):
             desc = get_guide(game_name)
             
             if desc:
-                link = utils.upload(bot, draw_help_card(game_name, desc))
+                link = utils.upload(bot, draw_help_card(game_name, desc), profile="png_palette")
                 bot.send_json({"handler": "chatroommessage", "roomid": room_id, "type": "image", "url": link, "text": "Guide"})
             else:
                 bot.send_message(room_id, f"❌ '{game_name}' ki guide nahi mili.\nCheck `!help` list.")
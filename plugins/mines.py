@@ -1,10 +1,9 @@
 import time
 import random
+import uuid
 import threading
 import sys
 import os
-import requests
-import io
 from PIL import Image, ImageDraw, ImageOps, ImageFilter
 
 # --- UTILS & DB ---
@@ -20,7 +19,6 @@ except Exception as e: print(f"DB Error: {e}")
 games = {} 
 setup_pending = {} # {user_id: room_id}
 game_lock = threading.Lock()
-AVATAR_CACHE = {}
 
 def to_small_caps(text):
     normal = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
@@ -36,33 +34,10 @@ def setup(bot_ref):
 # 🖼️ STICK AVATAR LOGIC (Source of Truth)
 # ==========================================
 
-def get_robust_avatar(avatar_url, username):
-    if avatar_url and avatar_url in AVATAR_CACHE:
-        return AVATAR_CACHE[avatar_url].copy()
-    if avatar_url:
-        try:
-            r = requests.get(avatar_url, timeout=4)
-            if r.status_code == 200:
-                img = Image.open(io.BytesIO(r.content)).convert("RGBA")
-                AVATAR_CACHE[avatar_url] = img
-                return img.copy()
-        except: pass
-    try:
-        fb_url = f"https://api.dicebear.com/9.x/adventurer/png?seed={username}&backgroundColor=transparent"
-        r = requests.get(fb_url, timeout=4)
-        if r.status_code == 200:
-            return Image.open(io.BytesIO(r.content)).convert("RGBA")
-    except: pass
-    return Image.new("RGBA", (100, 100), (120, 120, 120, 255))
-
-def circle_crop(img, size):
-    img = img.resize((size, size), Image.Resampling.LANCZOS)
-    mask = Image.new('L', (size, size), 0)
-    draw = ImageDraw.Draw(mask)
-    draw.ellipse((0, 0, size, size), fill=255)
-    output = Image.new('RGBA', (size, size), (0, 0, 0, 0))
-    output.paste(img, (0, 0), mask)
-    return output
+def get_robust_avatar(avatar_url, username, size=None):
+    """Shared utils.avatar (hedged URL / dicebear, negative cache). size = cached circle crop"""
+    return utils.avatar(None, username, avatar_url, size=size, circle=bool(size),
+                        placeholder=lambda: Image.new("RGBA", (100, 100), (120, 120, 120, 255)))
 
 # ==========================================
 # 🖌️ RENDERING ENGINE
@@ -85,8 +60,8 @@ def draw_grid_board(game):
     curr_lives = game.lives_p1 if is_p1 else game.lives_p2
     
     d.rounded_rectangle([15, 10, 485, 110], radius=20, fill=(45, 55, 85), outline="#00FFFF", width=3)
-    p_img = circle_crop(get_robust_avatar(curr_av, curr_name), 80)
-    img.paste(p_img, (30, 20), p_img)
+    p_img = get_robust_avatar(curr_av, curr_name, 80)
+    utils.paste_avatar(img, p_img, (30, 20))
     
     utils.write_text(d, (130, 35), f"PLAYER: {curr_name.upper()}", size=24, align="left", col="white")
     utils.write_text(d, (130, 70), f"LIVES: {'❤️' * curr_lives}", size=22, align="left")
@@ -105,7 +80,7 @@ def draw_grid_board(game):
             box_col = (180, 50, 50) if is_bomb else (50, 180, 80)
             d.rounded_rectangle([x, y, x+bx_sz, y+bx_sz], radius=15, fill=box_col, outline="white", width=2)
             icon = utils.get_emoji("💣" if is_bomb else "🍪", size=50)
-            img.paste(icon, (x+17, y+10), icon)
+            if icon: img.paste(icon, (x+17, y+10), icon)
     return img
 
 def draw_blast_card(name, avatar_url):
@@ -113,10 +88,11 @@ def draw_blast_card(name, avatar_url):
     img = utils.create_canvas(W, H, (35, 0, 0))
     d = ImageDraw.Draw(img)
     boom = utils.get_emoji("💥", size=300)
-    img.paste(boom, (100, 50), boom)
-    p_img = circle_crop(get_robust_avatar(avatar_url, name), 200)
-    p_img = ImageOps.grayscale(p_img).convert("RGBA")
-    img.paste(p_img, (150, 150), p_img)
+    if boom: img.paste(boom, (100, 50), boom)
+    av = get_robust_avatar(avatar_url, name, 200)
+    p_img = ImageOps.grayscale(av).convert("RGBA")
+    p_img.putalpha(av.getchannel("A")) # Grayscale drops the circle alpha
+    utils.paste_avatar(img, p_img, (150, 150))
     utils.write_text(d, (250, 420), to_small_caps(f"{name} HIT A BOMB!"), size=35, align="center", col="red")
     return img
 
@@ -125,8 +101,8 @@ def draw_winner_card(name, reward, pts, avatar_url):
     img = utils.create_canvas(W, H, (10, 30, 10))
     d = ImageDraw.Draw(img)
     d.rounded_rectangle([10, 10, 490, 490], radius=50, outline="#FFD700", width=8)
-    p_img = circle_crop(get_robust_avatar(avatar_url, name), 180)
-    img.paste(p_img, (160, 50), p_img)
+    p_img = get_robust_avatar(avatar_url, name, 180)
+    utils.paste_avatar(img, p_img, (160, 50))
     utils.write_text(d, (250, 280), "🏆 CHAMPION 🏆", size=30, align="center", col="#FFD700")
     utils.write_text(d, (250, 340), name.upper(), size=45, align="center", col="white")
     utils.write_text(d, (250, 420), f"+{reward} Chips | +{pts} Points", size=30, align="center", col="#00FF7F")
@@ -152,6 +128,7 @@ def draw_setup_instructions():
 class MinesGame:
     def __init__(self, room_id, p1_id, p1_name, p1_av):
         self.room_id = room_id
+        self.match_id = uuid.uuid4().hex[:12] # Settlement idem_key part
         self.p1_id = p1_id; self.p1_name = p1_name; self.p1_av = p1_av
         self.p2_id = self.p2_name = self.p2_av = None
         self.state = 'lobby'; self.mode = None; self.bet = 0
@@ -187,7 +164,7 @@ def handle_command(bot, command, room_id, user, args, data):
                 if sum(g.board_p1) == 4 and sum(g.board_p2) == 4:
                     g.state = 'playing'
                     bot.send_message(parent_room, "🔥 **Match Start!**")
-                    url = utils.upload(bot, draw_grid_board(g))
+                    url = utils.upload(bot, draw_grid_board(g), profile="png_palette")
                     bot.send_json({"handler": "chatroommessage", "roomid": parent_room, "type": "image", "url": url, "text": "GO!"})
             return True
         return False
@@ -209,7 +186,7 @@ def handle_command(bot, command, room_id, user, args, data):
         # Bot hides 4 bombs
         bombs = random.sample(range(12), 4)
         for b in bombs: g.board_p1[b] = 1
-        url = utils.upload(bot, draw_grid_board(g))
+        url = utils.upload(bot, draw_grid_board(g), profile="png_palette")
         bot.send_json({"handler": "chatroommessage", "roomid": room_id, "type": "image", "url": url, "text": "Bot Game Start"})
         return True
 
@@ -233,7 +210,7 @@ def handle_command(bot, command, room_id, user, args, data):
             g.p2_id, g.p2_name, g.p2_av = uid, user, av_url
             g.state = 'setup'; setup_pending[g.p1_id] = room_id; setup_pending[g.p2_id] = room_id
             bot.send_message(room_id, "✅ Match! Check DMs to hide 4 bombs.")
-            setup_img = utils.upload(bot, draw_setup_instructions())
+            setup_img = utils.upload(bot, draw_setup_instructions, key="mines:setup", profile="png_palette") # Static card: render once
             bot.send_dm_image(g.p1_name, setup_img, f"Hide bombs for @{g.p2_name}. Reply 4 numbers (1-12).")
             bot.send_dm_image(g.p2_name, setup_img, f"Hide bombs for @{g.p1_name}. Reply 4 numbers (1-12).")
         else: bot.send_message(room_id, f"❌ Need {g.bet} Chips!")
@@ -258,7 +235,7 @@ def handle_command(bot, command, room_id, user, args, data):
                 found = sum(1 for i in range(12) if g.revealed_p1[i] and g.board_p1[i] == 0)
                 if found == 8:
                     reward, pts = 2000, 100
-                    db.add_game_result(uid, user, "mines", reward, True, pts)
+                    db.add_game_result(uid, user, "mines", reward, True, pts, idem_key=db.settlement_key("mines", room_id, g.match_id, uid))
                     url = utils.upload(bot, draw_winner_card(user, reward, pts, av_url))
                     bot.send_json({"handler": "chatroommessage", "roomid": room_id, "type": "image", "url": url, "text": "Winner!"})
                     with game_lock: del games[room_id]; return True
@@ -280,7 +257,7 @@ def handle_command(bot, command, room_id, user, args, data):
                     winner_name = g.p2_name if is_p1 else g.p1_name
                     winner_av = g.p2_av if is_p1 else g.p1_av
                     reward, pts = g.bet * 2, 50
-                    db.add_game_result(winner_id, winner_name, "mines", reward, True, pts)
+                    db.add_game_result(winner_id, winner_name, "mines", reward, True, pts, idem_key=db.settlement_key("mines", room_id, g.match_id, winner_id))
                     url = utils.upload(bot, draw_winner_card(winner_name, reward, pts, winner_av))
                     bot.send_json({"handler": "chatroommessage", "roomid": room_id, "type": "image", "url": url, "text": "Winner!"})
                     threading.Thread(target=lambda: (time.sleep(3), bot.send_json({"handler": "kickuser", "roomid": int(room_id), "to": int(uid)}))).start()
@@ -288,14 +265,14 @@ def handle_command(bot, command, room_id, user, args, data):
             else: bot.send_message(room_id, f"🍪 found a cookie!")
             g.turn = 'P2' if is_p1 else 'P1'
 
-        url = utils.upload(bot, draw_grid_board(g))
+        url = utils.upload(bot, draw_grid_board(g), profile="png_palette")
         bot.send_json({"handler": "chatroommessage", "roomid": room_id, "type": "image", "url": url, "text": "Next"})
         return True
 
     if cmd == "stop" and g and (uid == g.p1_id or user.lower() == "yasin"):
         if g.mode == 2:
-            db.update_balance(g.p1_id, g.p1_name, g.bet, 0)
-            if g.p2_id: db.update_balance(g.p2_id, g.p2_name, g.bet, 0)
+            db.update_balance(g.p1_id, g.p1_name, g.bet, 0, reason="refund")
+            if g.p2_id: db.update_balance(g.p2_id, g.p2_name, g.bet, 0, reason="refund")
         bot.send_message(room_id, "🛑 Game stopped and bet refunded.")
         with game_lock: del games[room_id]
         return True
@@ -308,7 +285,7 @@ def cleanup_loop():
             for rid, g in list(games.items()):
                 if now - g.last_interaction > 120:
                     if g.mode == 2:
-                        db.update_balance(g.p1_id, g.p1_name, g.bet, 0)
-                        if g.p2_id: db.update_balance(g.p2_id, g.p2_name, g.bet, 0)
+                        db.update_balance(g.p1_id, g.p1_name, g.bet, 0, reason="refund")
+                        if g.p2_id: db.update_balance(g.p2_id, g.p2_name, g.bet, 0, reason="refund")
                     to_del.append(rid)
             for rid in to_del: del games[rid]
@@ -2,8 +2,8 @@ import os
 import requests
 import threading
 import time
-import psycopg2
 import re
+import gateway
 from datetime import datetime, timedelta
 
 # --- CONFIGURATION ---
@@ -33,59 +33,63 @@ def is_on_cooldown(user_id):
     user_cooldowns[user_id] = now
     return False
 
-# --- 3. DATABASE: ISOLATED & HARDCODED ---
+# --- 3. DATABASE: SHARED POOLED GATEWAY ---
+# NILU_DATABASE_URL set -> pooled Postgres; warna main bot DB (SQLite offline bhi chalega)
+gw = gateway.get(DB_URL, name="nilu")
+
 def db_exec(query, params=(), fetch=False):
-    if not DB_URL: return None
-    conn = None
-    try:
-        conn = psycopg2.connect(DB_URL)
-        cur = conn.cursor()
-        cur.execute(query, params)
-        res = cur.fetchall() if fetch else None
-        conn.commit()
-        return res
-    except: return None # Graceful failure if DB is down
-    finally:
-        if conn: conn.close()
+    return gw.exec(query, params, fetch) # None on failure, same as before
+
+# Hot queries: PREPAREd once per pooled connection
+Q_TOGGLES = gw.prepare("nilu_q_toggles", "SELECT memory, custom, relation FROM nilu_toggles WHERE user_id = %s")
+Q_CUSTOM = gw.prepare("nilu_q_custom", "SELECT prompt FROM nilu_custom WHERE username = %s")
+Q_RELATION = gw.prepare("nilu_q_relation", "SELECT rel_type FROM nilu_relations WHERE username = %s")
+Q_MEMORY = gw.prepare("nilu_q_memory", """
+    SELECT content FROM nilu_memories 
+    WHERE user_id = %s 
+    ORDER BY (importance * confidence) DESC, last_used DESC LIMIT 3
+""") # Weight = Importance * Confidence
+Q_ROOM_CFG = gw.prepare("nilu_q_room_cfg", "SELECT enabled FROM nilu_room_cfg WHERE room_id = %s")
+Q_STATS_BUMP = gw.prepare("nilu_q_stats_bump", "INSERT INTO nilu_stats (user_id, count) VALUES (%s, 1) ON CONFLICT (user_id) DO UPDATE SET count = nilu_stats.count + 1 RETURNING count")
 
 def init_db():
-    db_exec("""
-        CREATE TABLE IF NOT EXISTS nilu_memories (
+    gw.batch([(q, (), False) for q in [
+        """CREATE TABLE IF NOT EXISTS nilu_memories (
             id SERIAL PRIMARY KEY, user_id TEXT, content TEXT, 
             importance INT DEFAULT 5, confidence FLOAT DEFAULT 0.8, 
             last_used TIMESTAMP, created_at TIMESTAMP
-        );
-        CREATE TABLE IF NOT EXISTS nilu_custom (username TEXT PRIMARY KEY, prompt TEXT);
-        CREATE TABLE IF NOT EXISTS nilu_relations (username TEXT PRIMARY KEY, rel_type TEXT);
-        CREATE TABLE IF NOT EXISTS nilu_stats (user_id TEXT PRIMARY KEY, count INT DEFAULT 0);
-        CREATE TABLE IF NOT EXISTS nilu_room_cfg (room_id TEXT PRIMARY KEY, enabled BOOLEAN DEFAULT TRUE);
-        CREATE TABLE IF NOT EXISTS nilu_toggles (
+        )""",
+        "CREATE TABLE IF NOT EXISTS nilu_custom (username TEXT PRIMARY KEY, prompt TEXT)",
+        "CREATE TABLE IF NOT EXISTS nilu_relations (username TEXT PRIMARY KEY, rel_type TEXT)",
+        "CREATE TABLE IF NOT EXISTS nilu_stats (user_id TEXT PRIMARY KEY, count INT DEFAULT 0)",
+        "CREATE TABLE IF NOT EXISTS nilu_room_cfg (room_id TEXT PRIMARY KEY, enabled BOOLEAN DEFAULT TRUE)",
+        """CREATE TABLE IF NOT EXISTS nilu_toggles (
             user_id TEXT PRIMARY KEY, memory BOOLEAN DEFAULT TRUE, 
             custom BOOLEAN DEFAULT TRUE, relation BOOLEAN DEFAULT TRUE
-        );
-    """)
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_nilu_memories_user ON nilu_memories (user_id)",
+    ]])
     # CLEANUP: Auto-expire low importance memory older than 20 days
     db_exec("DELETE FROM nilu_memories WHERE importance < 4 AND created_at < %s", (datetime.now() - timedelta(days=20),))
 
 # --- 4. MEMORY WEIGHTING & FETCHING ---
 def get_weighted_memory(user_id):
-    # Weight = Importance * Confidence
-    rows = db_exec("""
-        SELECT content FROM nilu_memories 
-        WHERE user_id = %s 
-        ORDER BY (importance * confidence) DESC, last_used DESC LIMIT 3
-    """, (str(user_id),), True)
+    rows = db_exec(Q_MEMORY, (str(user_id),), True)
     return "\n".join([r[0] for r in rows]) if rows else ""
 
-# --- 5. AI ENGINE: MOOD, PERSONALITY & SOFT LEARNING ---
-def get_nilu_response(user_id, username, message, room_id):
-    # Check Toggles
-    t = db_exec("SELECT memory, custom, relation FROM nilu_toggles WHERE user_id = %s", (str(user_id),), True)
+def load_context(user_id, username):
+    """Toggles + memory + custom prompt + relation: ONE batch on one pooled connection"""
+    uname = username.lower()
+    res = gw.batch([(Q_TOGGLES, (str(user_id),), True), (Q_MEMORY, (str(user_id),), True),
+                    (Q_CUSTOM, (uname,), True), (Q_RELATION, (uname,), True)])
+    t, mem, custom_p, relation = res or ([], [], [], [])
     mem_on, cust_on, rel_on = t[0] if t else (True, True, True)
+    memory = "\n".join([r[0] for r in mem]) if (mem and mem_on) else ""
+    return memory, (custom_p if cust_on else None), (relation if rel_on else None)
 
-    memory = get_weighted_memory(user_id) if mem_on else ""
-    custom_p = db_exec("SELECT prompt FROM nilu_custom WHERE username = %s", (username.lower(),), True) if cust_on else None
-    relation = db_exec("SELECT rel_type FROM nilu_relations WHERE username = %s", (username.lower(),), True) if rel_on else None
+# --- 5. AI ENGINE: MOOD, PERSONALITY & SOFT LEARNING ---
+def get_nilu_response(user_id, username, message, room_id):
+    memory, custom_p, relation = load_context(user_id, username)
     
     # Relationship influence context
     rel_context = f"User {username} is your {relation[0][0]}." if relation else f"User {username} is a regular member."
@@ -129,8 +133,7 @@ def get_nilu_response(user_id, username, message, room_id):
 
 def memory_worker(user_id, username, user_msg, ai_res):
     # Rule: Store only after 3-4 meaningful exchanges
-    db_exec("INSERT INTO nilu_stats (user_id, count) VALUES (%s, 1) ON CONFLICT (user_id) DO UPDATE SET count = nilu_stats.count + 1", (str(user_id),))
-    stats = db_exec("SELECT count FROM nilu_stats WHERE user_id = %s", (str(user_id),), True)
+    stats = db_exec(Q_STATS_BUMP, (str(user_id),), True) # Bump + read in one statement
     if not stats or stats[0][0] < 4: return
 
     try:
@@ -216,7 +219,7 @@ def handle_command(bot, command, room_id, user, args, data):
     msg_text = data.get("text", "")
     if re.search(r'\bnilu\b', msg_text.lower()):
         # Room Level Check
-        room_cfg = db_exec("SELECT enabled FROM nilu_room_cfg WHERE room_id = %s", (str(room_id),), True)
+        room_cfg = db_exec(Q_ROOM_CFG, (str(room_id),), True)
         if room_cfg and not room_cfg[0][0]: return False
 
         if is_on_cooldown(uid): return True
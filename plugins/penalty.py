@@ -1,8 +1,7 @@
 import threading
 import time
 import random
-import io
-import requests
+import uuid
 from PIL import Image, ImageDraw, ImageOps, ImageFilter
 import db
 import utils
@@ -25,99 +24,90 @@ def setup(bot):
 # 🖼️ AVATAR & GRAPHICS HELPERS
 # ==========================================
 
-def get_avatar(user_id, username, avatar_url=None):
-    """Robust Avatar Fetch: Direct -> ID -> Dicebear"""
-    if avatar_url and str(avatar_url) != "None":
-        try:
-            r = requests.get(avatar_url, timeout=3, headers={'User-Agent': 'Mozilla/5.0'})
-            if r.status_code == 200:
-                return Image.open(io.BytesIO(r.content)).convert("RGBA")
-        except: pass
-
-    try:
-        url = f"https://api.howdies.app/api/avatar/{user_id}"
-        r = requests.get(url, timeout=3)
-        if r.status_code == 200:
-            return Image.open(io.BytesIO(r.content)).convert("RGBA")
-    except: pass
-
-    try:
-        url = f"https://api.dicebear.com/9.x/adventurer/png?seed={username}"
-        r = requests.get(url, timeout=3)
-        return Image.open(io.BytesIO(r.content)).convert("RGBA")
-    except:
-        return Image.new('RGBA', (260, 260), (30, 30, 60))
+def get_avatar(user_id, username, avatar_url=None, size=None):
+    """Shared utils.avatar: Direct / ID / Dicebear hedged in parallel, circle crops cached"""
+    return utils.avatar(user_id, username, avatar_url, size=size, circle=bool(size),
+                        placeholder=lambda: Image.new('RGBA', (260, 260), (30, 30, 60)),
+                        headers={'User-Agent': 'Mozilla/5.0'})
 
 def apply_round_corners(img, radius):
-    mask = Image.new("L", img.size, 0)
-    draw = ImageDraw.Draw(mask)
-    draw.rounded_rectangle((0, 0) + img.size, radius, fill=255)
-    out = Image.new("RGBA", img.size)
-    out.paste(img, (0, 0), mask)
-    return out
+    return utils.round_corners(img, radius) # Cached AA mask
 
 # ==========================================
 # 🎨 PREMIUM GRAPHICS ENGINE
 # ==========================================
 
-def draw_penalty_card(username, user_id, user_av, result="VS", user_pos=None, bot_pos=None, win_amt=0):
-    W, H = 700, 700
-    # Turf Green Gradient
-    base = utils.get_gradient(W, H, (10, 40, 10), (20, 80, 20))
-    img = Image.new('RGBA', (W, H))
-    img.paste(base, (0,0))
-    d = ImageDraw.Draw(img)
-
-    # Rounded Card Border
-    border_col = "#FFFFFF"
-    if result == "GOAL": border_col = "#00FF00"
-    if result == "SAVED": border_col = "#FF0000"
-    d.rounded_rectangle([10, 10, W-10, H-10], radius=50, outline=border_col, width=6)
-
-    # 1. Header
-    utils.write_text(d, (W//2, 60), "PENALTY STRIKE", size=50, align="center", col="white", shadow=True)
-
-    # 2. Goal Post
-    gx1, gy1, gx2, gy2 = 120, 160, 580, 460
-    d.rectangle([gx1, gy1, gx2, gy2], outline="white", width=8)
-    for i in range(gx1, gx2, 30): d.line([i, gy1, i, gy2], fill=(255,255,255,40), width=1)
-    for i in range(gy1, gy2, 30): d.line([gx1, i, gx2, i], fill=(255,255,255,40), width=1)
-
-    # 3. Goalkeeper (Bot)
-    # 1: Left, 2: Center, 3: Right
-    b_x_map = {1: gx1 + 50, 2: W//2 - 80, 3: gx2 - 210}
-    bx = b_x_map.get(bot_pos, W//2 - 80)
-    
+# Pitch, border, header and goal net = one memoized static layer per border
+# colour (utils.render_layers); goalie badge is a cached sprite.
+CARD_W, CARD_H = 700, 700
+GOAL = (120, 160, 580, 460)
+
+def _paint_pitch(border_col):
+    def paint(img, d):
+        W, H = CARD_W, CARD_H
+        # Turf Green Gradient
+        img.paste(utils.get_gradient(W, H, (10, 40, 10), (20, 80, 20), mutable=False), (0, 0))
+
+        # Rounded Card Border
+        d.rounded_rectangle([10, 10, W-10, H-10], radius=50, outline=border_col, width=6)
+
+        # 1. Header
+        utils.write_text(d, (W//2, 60), "PENALTY STRIKE", size=50, align="center", col="white", shadow=True)
+
+        # 2. Goal Post
+        gx1, gy1, gx2, gy2 = GOAL
+        d.rectangle([gx1, gy1, gx2, gy2], outline="white", width=8)
+        for i in range(gx1, gx2, 30): d.line([i, gy1, i, gy2], fill=(255,255,255,40), width=1)
+        for i in range(gy1, gy2, 30): d.line([gx1, i, gx2, i], fill=(255,255,255,40), width=1)
+    return paint
+
+def _goalie():
     goalie_img = Image.new('RGBA', (160, 160), (0,0,0,0))
     gd = ImageDraw.Draw(goalie_img)
     gd.ellipse([0, 0, 160, 160], fill="#333", outline="#FFD700", width=4)
     utils.write_text(gd, (80, 80), "GK", size=60, col="#FFD700", align="center")
-    img.paste(goalie_img, (bx, 220), goalie_img)
-
-    # 4. Ball Position
-    if user_pos:
-        ball_x_map = {1: gx1 + 60, 2: W//2 - 40, 3: gx2 - 140}
-        ball_y = gy1 + 100 if result == "GOAL" else gy1 + 200
-        # Simple Ball Drawing
-        d.ellipse([ball_x_map[user_pos], ball_y, ball_x_map[user_pos]+80, ball_y+80], fill="white", outline="black", width=2)
-
-    # 5. Striker Info (Bottom)
-    av = get_avatar(user_id, username, user_av).resize((130, 130))
-    av_mask = Image.new('L', (130, 130), 0)
-    ImageDraw.Draw(av_mask).ellipse((0, 0, 130, 130), fill=255)
-    img.paste(av, (40, 520), av_mask)
-    d.ellipse([40, 520, 170, 650], outline="white", width=4)
-    utils.write_text(d, (105, 665), username.upper(), size=25, align="center", col="white")
-
-    # 6. Result Big Text
-    if result != "VS":
-        res_col = "#00FF00" if result == "GOAL" else "#FF0000"
-        utils.write_text(d, (W//2, H//2), result, size=130, align="center", col=res_col, shadow=True)
-        if result == "GOAL":
-            # WON CHIPS in RED as requested
-            utils.write_text(d, (W//2, H//2 + 110), f"WON {win_amt} CHIPS", size=35, align="center", col="#FF0000")
-
-    return apply_round_corners(img, 50)
+    return goalie_img
+
+def draw_penalty_card(username, user_id, user_av, result="VS", user_pos=None, bot_pos=None, win_amt=0):
+    W, H = CARD_W, CARD_H
+    border_col = "#FFFFFF"
+    if result == "GOAL": border_col = "#00FF00"
+    if result == "SAVED": border_col = "#FF0000"
+
+    def play(img, d):
+        gx1, gy1, gx2, gy2 = GOAL
+        # 3. Goalkeeper (Bot)
+        # 1: Left, 2: Center, 3: Right
+        b_x_map = {1: gx1 + 50, 2: W//2 - 80, 3: gx2 - 210}
+        bx = b_x_map.get(bot_pos, W//2 - 80)
+        goalie_img = utils.static_image(("penalty_gk",), _goalie)
+        img.paste(goalie_img, (bx, 220), goalie_img)
+
+        # 4. Ball Position
+        if user_pos:
+            ball_x_map = {1: gx1 + 60, 2: W//2 - 40, 3: gx2 - 140}
+            ball_y = gy1 + 100 if result == "GOAL" else gy1 + 200
+            # Simple Ball Drawing
+            d.ellipse([ball_x_map[user_pos], ball_y, ball_x_map[user_pos]+80, ball_y+80], fill="white", outline="black", width=2)
+
+        # 5. Striker Info (Bottom)
+        av = get_avatar(user_id, username, user_av, size=130)
+        utils.paste_avatar(img, av, (40, 520))
+        d.ellipse([40, 520, 170, 650], outline="white", width=4)
+        utils.write_text(d, (105, 665), username.upper(), size=25, align="center", col="white")
+
+        # 6. Result Big Text
+        if result != "VS":
+            res_col = "#00FF00" if result == "GOAL" else "#FF0000"
+            utils.write_text(d, (W//2, H//2), result, size=130, align="center", col=res_col, shadow=True)
+            if result == "GOAL":
+                # WON CHIPS in RED as requested
+                utils.write_text(d, (W//2, H//2 + 110), f"WON {win_amt} CHIPS", size=35, align="center", col="#FF0000")
+
+    return utils.render_layers("penalty", (W, H), [
+        utils.static_layer(("pitch", border_col), _paint_pitch(border_col)),
+        utils.dynamic_layer(play),
+    ], radius=50)
 
 # ==========================================
 # 📦 GAME LOGIC BOX
@@ -129,6 +119,7 @@ class PenaltyBox:
         self.name = name
         self.av = av
         self.bet = bet
+        self.match_id = uuid.uuid4().hex[:12] # Settlement idem_key part
         self.last_act = time.time()
 
 def cleanup(rid):
@@ -167,7 +158,7 @@ def handle_command(bot, cmd, room_id, user, args, data):
                 PENALTY_GAMES[room_id] = PenaltyBox(uid, user, av_url, bet)
             
             img = draw_penalty_card(user, uid, av_url)
-            url = bot.upload_to_server(img)
+            url = bot.upload_to_server(img, profile="webp_lossless")
             bot.send_json({"handler":"chatroommessage","roomid":room_id,"type":"image","url":url,"text":f"Match Started! Bet: {bet}"})
             bot.send_message(room_id, f"⚽ @{user}, Shot direction?\nType: 1 (Left) | 2 (Center) | 3 (Right)")
             return True
@@ -193,16 +184,17 @@ def handle_command(bot, cmd, room_id, user, args, data):
         result = "GOAL" if is_goal else "SAVED"
         win_amt = game.bet * 2 if is_goal else 0
         
-        # DATABASE SYNC
+        # DATABASE SYNC (keyed: a double-sent shot settles once)
+        key = db.settlement_key("penalty", room_id, game.match_id, uid)
         if is_goal:
             # add_game_result handles score + chips profit
-            db.add_game_result(uid, game.name, "penalty", win_amt - game.bet, True, WIN_SCORE_REWARD)
+            db.add_game_result(uid, game.name, "penalty", win_amt - game.bet, True, WIN_SCORE_REWARD, idem_key=key)
         else:
-            db.add_game_result(uid, game.name, "penalty", -game.bet, False, 0)
+            db.add_game_result(uid, game.name, "penalty", -game.bet, False, 0, idem_key=key)
 
         # Render Final Card
         img = draw_penalty_card(game.name, uid, game.av, result, user_choice, bot_choice, win_amt)
-        url = bot.upload_to_server(img)
+        url = bot.upload_to_server(img, profile="webp_lossless")
         
         bot.send_json({"handler":"chatroommessage","roomid":room_id,"type":"image","url":url,"text":result})
         
@@ -1,35 +1,27 @@
 import os
 import time
 import threading
-import psycopg2
 import uuid
+import gateway
 
 # --- CONFIG ---
 DB_URL = os.environ.get("NILU_DATABASE_URL")
 MASTER_USER = "yasin"
 
 # --- DATABASE HANDLERS ---
+# Same pooled gateway as nilu_ai (same DSN = same pool); main bot DB if unset
+gw = gateway.get(DB_URL, name="nilu")
+
 def db_exec(query, params=(), fetch=False):
-    if not DB_URL: return None
-    conn = None
-    try:
-        conn = psycopg2.connect(DB_URL)
-        cur = conn.cursor()
-        cur.execute(query, params)
-        res = cur.fetchall() if fetch else None
-        conn.commit()
-        return res
-    except Exception as e:
-        print(f"[RoomManager DB Error] {e}")
-        return None
-    finally:
-        if conn: conn.close()
+    return gw.exec(query, params, fetch)
 
 def init_room_db():
-    # 1. Saved Rooms with Requester (Owner)
-    db_exec("CREATE TABLE IF NOT EXISTS saved_rooms (room_name TEXT PRIMARY KEY, requester TEXT)")
-    # 2. Bot Settings (For Default Room)
-    db_exec("CREATE TABLE IF NOT EXISTS bot_settings (key TEXT PRIMARY KEY, value TEXT)")
+    gw.batch([
+        # 1. Saved Rooms with Requester (Owner)
+        ("CREATE TABLE IF NOT EXISTS saved_rooms (room_name TEXT PRIMARY KEY, requester TEXT)", (), False),
+        # 2. Bot Settings (For Default Room)
+        ("CREATE TABLE IF NOT EXISTS bot_settings (key TEXT PRIMARY KEY, value TEXT)", (), False),
+    ])
 
 def set_default_room(room_name):
     db_exec("INSERT INTO bot_settings (key, value) VALUES ('default_room', %s) ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value", (room_name,))
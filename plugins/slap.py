@@ -43,15 +43,10 @@ def create_speed_lines(W, H):
         
     return img
 
-def get_avatar(username, vibe="normal"):
-    """Smart Avatar Fetcher"""
-    seed = f"{username}_{random.randint(1,999)}"
-    style = "adventurer"
-    if vibe == "angry": style = "notionists" # Angry sketch look
-    if vibe == "dizzy": style = "fun-emoji" # Funny face
-    
-    url = f"https://api.dicebear.com/9.x/{style}/png?seed={seed}&size=512&backgroundColor=transparent"
-    return utils.get_image(url)
+def get_avatar(username, vibe="normal", size=350):
+    """Local procedural face (offline, cached): vibe = mood, random variant = variety"""
+    mood = vibe if vibe in utils.AVATAR_MOODS else None
+    return utils.procedural_avatar(username, "emoji", random.randrange(utils.AVATAR_VARIANTS), mood, size)
 
 # ==========================================
 # 🖼️ SLAP CARD GENERATOR
@@ -74,9 +69,8 @@ def draw_slap_card(slapper, victim, style="m"):
 
     # 2. THE SLAPPER (Left Side)
     # Avatar fetch
-    av_slapper = get_avatar(slapper, "angry")
+    av_slapper = get_avatar(slapper, "angry", 350)
     if av_slapper:
-        av_slapper = av_slapper.resize((350, 350))
         # Add "Angry" tint
         if style == "x":
             av_slapper = ImageOps.colorize(av_slapper.convert("L"), (0,0,0), (255,0,0)).convert("RGBA")
@@ -85,10 +79,8 @@ def draw_slap_card(slapper, victim, style="m"):
         img.paste(av_slapper, (-20, 50), av_slapper)
 
     # 3. THE VICTIM (Right Side - Getting Hit)
-    av_victim = get_avatar(victim, "dizzy")
+    av_victim = get_avatar(victim, "dizzy", 300)
     if av_victim:
-        av_victim = av_victim.resize((300, 300))
-        
         # EFFECT: Rotate & Blur to show IMPACT
         av_victim = av_victim.rotate(-30, expand=True) # Teda ho gaya
         
@@ -173,7 +165,7 @@ def process_slap(bot, room_id, user, target, style):
     try:
         # Generate Comic Card
         img = draw_slap_card(user, target, style)
-        link = utils.upload(bot, img)
+        link = utils.upload(bot, img, profile="webp_lossless")
         
         if link:
             # Random Funny Text
@@ -1,8 +1,7 @@
 import threading
 import time
 import random
-import io
-import requests
+import uuid
 import traceback
 from PIL import Image, ImageDraw, ImageOps, ImageFilter
 import db
@@ -21,7 +20,6 @@ LOBBY_TIMEOUT = 120   # 2 minutes to start a game
 MOVE_TIMEOUT = 90     # 90 seconds per move
 
 # Extreme Concurrency & Memory Management
-AV_CACHE = {}         # Global Avatar Cache to save bandwidth
 GAMES = {}            # Isolated Room Boxes
 GAMES_LOCK = threading.Lock()
 
@@ -33,78 +31,46 @@ def setup(bot):
 # 🖼️ ADVANCED IMAGE & AVATAR SYSTEM
 # ======================================================
 
-def get_avatar_robust(user_id, username, avatar_url=None):
+def get_avatar_robust(user_id, username, avatar_url=None, size=None):
     """
-    Multi-stage Avatar Fetcher:
-    1. Memory Cache check (Fastest)
-    2. Provided URL fetch (Direct)
-    3. Platform ID API fetch (Official)
-    4. Dicebear Adventurer Generation (Fallback)
-    5. Initials Canvas (Last Resort)
+    Shared avatar service (utils.avatar): Direct URL, Platform ID API and
+    Dicebear Adventurer fired as hedged parallel requests, dead URLs
+    negative-cached, sized circle crops cached. Initials Canvas = last resort.
+    Returns a SHARED image (paste-from only).
     """
-    if user_id in AV_CACHE:
-        return AV_CACHE[user_id].copy()
-
-    img = None
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-
-    # Stage 1: Direct URL
-    if avatar_url and str(avatar_url) != "None" and len(str(avatar_url)) > 10:
-        try:
-            r = requests.get(avatar_url, timeout=4, headers=headers)
-            if r.status_code == 200:
-                img = Image.open(io.BytesIO(r.content)).convert("RGBA")
-        except: pass
-
-    # Stage 2: Official Platform API
-    if not img:
-        try:
-            api_av = f"https://api.howdies.app/api/avatar/{user_id}"
-            r = requests.get(api_av, timeout=3, headers=headers)
-            if r.status_code == 200:
-                img = Image.open(io.BytesIO(r.content)).convert("RGBA")
-        except: pass
-
-    # Stage 3: Dicebear Dynamic Character
-    if not img:
-        try:
-            dice_url = f"https://api.dicebear.com/9.x/adventurer/png?seed={username}&backgroundColor=b6e3f4"
-            r = requests.get(dice_url, timeout=3)
-            if r.status_code == 200:
-                img = Image.open(io.BytesIO(r.content)).convert("RGBA")
-        except: pass
-
-    # Stage 4: High-Quality Initials Placeholder
-    if not img:
+    def initials():
         img = Image.new('RGBA', (260, 260), (30, 30, 50))
         d = ImageDraw.Draw(img)
         char = username[0].upper() if username else "?"
         utils.write_text(d, (130, 130), char, size=150, col="white", align="center")
+        return img
 
-    # Save to Cache and Return
-    AV_CACHE[user_id] = img
-    return img.copy()
+    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+    return utils.avatar(user_id, username, avatar_url, size=size, circle=bool(size),
+                        placeholder=initials, background="b6e3f4", headers=headers)
 
 def apply_round_corners(img, radius):
-    """High-fidelity rounded corner masking"""
-    mask = Image.new("L", img.size, 0)
-    draw = ImageDraw.Draw(mask)
-    draw.rounded_rectangle((0, 0, img.size[0], img.size[1]), radius, fill=255)
-    output = Image.new("RGBA", img.size, (0, 0, 0, 0))
-    output.paste(img, (0, 0), mask)
-    return output
+    """High-fidelity rounded corner masking (cached AA mask)"""
+    return utils.round_corners(img, radius)
 
 # ======================================================
 # 🎨 PREMIUM GRAPHICS: NEON BOARD & CHAMPION CARD
 # ======================================================
 
-def draw_premium_board(board):
-    """Generates the 700x700 Cinematic Neon Board"""
-    W, H = 700, 700
-    base = utils.get_gradient(W, H, (10, 10, 25), (40, 20, 90))
-    img = Image.new('RGBA', (W, H))
-    img.paste(base, (0, 0))
-    d = ImageDraw.Draw(img)
+# Static layers (gradient, glow, title, cell frames) flattened once by
+# utils.render_layers; per request sirf symbols / avatar / text paint hote hain.
+BOARD_W, BOARD_H = 700, 700
+GRID_SIZE = 510
+BOX_SIZE = GRID_SIZE // 3
+GRID_X, GRID_Y = (BOARD_W - GRID_SIZE) // 2, 140
+
+def _cell_origin(i):
+    r, c = i // 3, i % 3
+    return GRID_X + c * BOX_SIZE, GRID_Y + r * BOX_SIZE
+
+def _paint_board_frame(img, d):
+    W, H = BOARD_W, BOARD_H
+    img.paste(utils.get_gradient(W, H, (10, 10, 25), (40, 20, 90), mutable=False), (0, 0))
 
     # Multi-layered Neon Border Glow
     for i in range(6):
@@ -113,76 +79,87 @@ def draw_premium_board(board):
 
     utils.write_text(d, (W // 2, 65), "TIC TAC TOE", size=55, align="center", col="#00F2FE", shadow=True)
 
-    grid_size = 510
-    box_size = grid_size // 3
-    sx, sy = (W - grid_size) // 2, 140
-
+    # Stylized Cells
     for i in range(9):
-        r, c = i // 3, i % 3
-        x, y = sx + c * box_size, sy + r * box_size
-        
-        # Stylized Cell
-        d.rounded_rectangle([x+6, y+6, x+box_size-6, y+box_size-6], radius=22, fill=(20, 20, 45, 200))
-        d.rounded_rectangle([x+8, y+8, x+box_size-8, y+box_size-8], radius=20, outline="#4facfe", width=3)
+        x, y = _cell_origin(i)
+        d.rounded_rectangle([x+6, y+6, x+BOX_SIZE-6, y+BOX_SIZE-6], radius=22, fill=(20, 20, 45, 200))
+        d.rounded_rectangle([x+8, y+8, x+BOX_SIZE-8, y+BOX_SIZE-8], radius=20, outline="#4facfe", width=3)
 
-        symbol = str(board[i])
-        cx, cy = x + box_size // 2, y + box_size // 2
-        
-        if symbol == 'X':
-            # Red Neon X
-            s = 40
-            d.line([(cx-s, cy-s), (cx+s, cy+s)], fill="#FF3131", width=14)
-            d.line([(cx+s, cy-s), (cx-s, cy+s)], fill="#FF3131", width=14)
-        elif symbol == 'O':
-            # Green Neon O
-            s = 45
-            d.ellipse([cx-s, cy-s, cx+s, cy+s], outline="#39FF14", width=14)
-        else:
-            # Ghost number for empty cells
-            utils.write_text(d, (cx, cy), symbol, size=35, col=(255, 255, 255, 40), align="center")
-
-    return apply_round_corners(img, 45)
-
-def draw_victory_card(winner_name, chips_won, score_won, user_id, avatar_url):
-    """Premium 600x600 Victory Card with RED TEXT logic"""
+def draw_premium_board(board):
+    """Generates the 700x700 Cinematic Neon Board"""
+    def symbols(img, d):
+        for i in range(9):
+            x, y = _cell_origin(i)
+            symbol = str(board[i])
+            cx, cy = x + BOX_SIZE // 2, y + BOX_SIZE // 2
+
+            if symbol == 'X':
+                # Red Neon X
+                s = 40
+                d.line([(cx-s, cy-s), (cx+s, cy+s)], fill="#FF3131", width=14)
+                d.line([(cx+s, cy-s), (cx-s, cy+s)], fill="#FF3131", width=14)
+            elif symbol == 'O':
+                # Green Neon O
+                s = 45
+                d.ellipse([cx-s, cy-s, cx+s, cy+s], outline="#39FF14", width=14)
+            else:
+                # Ghost number for empty cells
+                utils.write_text(d, (cx, cy), symbol, size=35, col=(255, 255, 255, 40), align="center")
+
+    return utils.render_layers("ttt_board", (BOARD_W, BOARD_H), [
+        utils.static_layer("frame", _paint_board_frame),
+        utils.dynamic_layer(symbols),
+    ], radius=45)
+
+def upload_board(bot, board):
+    """Board image depends only on the cells: same board = cached URL, no render/upload"""
+    cells = list(board)
+    return bot.upload_to_server(lambda: draw_premium_board(cells), key="ttt:" + "|".join(map(str, cells)), profile="webp_lossless")
+
+def _paint_victory_frame(img, d):
     W, H = 600, 600
-    base = utils.get_gradient(W, H, (30, 10, 60), (10, 80, 120))
-    img = Image.new('RGBA', (W, H))
-    img.paste(base, (0, 0))
-    d = ImageDraw.Draw(img)
+    img.paste(utils.get_gradient(W, H, (30, 10, 60), (10, 80, 120), mutable=False), (0, 0))
 
     # 8-Layer Golden Frame
     for i in range(8):
         alpha = 255 - (i * 30)
         d.rounded_rectangle([i, i, W-i, H-i], radius=50, outline=f"#FFD700{alpha:02x}", width=2)
 
-    # DP with mask and resize
-    av_raw = get_avatar_robust(user_id, winner_name, avatar_url)
-    av = av_raw.resize((260, 260), Image.Resampling.LANCZOS)
-    mask = Image.new('L', (260, 260), 0)
-    ImageDraw.Draw(mask).ellipse((0, 0, 260, 260), fill=255)
-    
-    cx, cy = W // 2, 220
     # DP Glow Rings
+    cx, cy = W // 2, 220
     for r in range(140, 155, 2): d.ellipse([cx-r, cy-r, cx+r, cy+r], outline="#00F2FE", width=2)
     d.ellipse([cx-135, cy-135, cx+135, cy+135], outline="#FFD700", width=10)
-    img.paste(av, (cx-130, cy-130), mask)
 
     utils.write_text(d, (W//2, 390), "CHAMPION", size=35, align="center", col="#FFD700", shadow=True)
-    utils.write_text(d, (W//2, 450), winner_name.upper(), size=55, align="center", col="white", shadow=True)
 
     # Rewards Badge (Original greenish-transparent background)
     bw, bh = 420, 110
     bx, by = W//2 - bw//2, 485
     d.rounded_rectangle([bx, by, bx+bw, by+bh], radius=25, fill=(0, 255, 127, 40), outline="#00FF7F", width=3)
 
-    # --- TEXT COLORS (FIXED AS PER REQUEST) ---
-    # WON CHIPS in RED
-    utils.write_text(d, (W//2, by + 30), f"WON {chips_won} CHIPS", size=32, align="center", col="#FF0000")
-    # SCORE in BLUE
-    utils.write_text(d, (W//2, by + 72), f"+{score_won} SCORE REWARD", size=26, align="center", col="#00F2FE")
+def draw_victory_card(winner_name, chips_won, score_won, user_id, avatar_url):
+    """Premium 600x600 Victory Card with RED TEXT logic"""
+    W, H = 600, 600
+
+    def winner(img, d):
+        # DP: ready-to-paste 260px circle crop
+        av = get_avatar_robust(user_id, winner_name, avatar_url, size=260)
+        cx, cy = W // 2, 220
+        utils.paste_avatar(img, av, (cx-130, cy-130))
+
+        utils.write_text(d, (W//2, 450), winner_name.upper(), size=55, align="center", col="white", shadow=True)
+
+        # --- TEXT COLORS (FIXED AS PER REQUEST) ---
+        by = 485
+        # WON CHIPS in RED
+        utils.write_text(d, (W//2, by + 30), f"WON {chips_won} CHIPS", size=32, align="center", col="#FF0000")
+        # SCORE in BLUE
+        utils.write_text(d, (W//2, by + 72), f"+{score_won} SCORE REWARD", size=26, align="center", col="#00F2FE")
 
-    return apply_round_corners(img, 50)
+    return utils.render_layers("ttt_victory", (W, H), [
+        utils.static_layer("frame", _paint_victory_frame),
+        utils.dynamic_layer(winner),
+    ], radius=50)
 
 # ======================================================
 # 📦 ENGINE CORE: ROOM ISOLATION & LOGIC
@@ -192,6 +169,7 @@ class TicBox:
     """Thread-safe isolated game dabba per room"""
     def __init__(self, room_id, p1_data):
         self.room_id = room_id
+        self.match_id = uuid.uuid4().hex[:12] # Settlement idem_key part
         self.lock = threading.Lock()
         self.status = "SELECT_MODE" # SELECT_MODE, LOBBY, PLAYING
         self.last_act = time.time()
@@ -260,7 +238,7 @@ def process_bot_async(bot, g):
             # Match continues, return turn to player
             g.turn = g.p1['id']
             g.last_act = time.time()
-            img_url = bot.upload_to_server(draw_premium_board(g.board))
+            img_url = upload_board(bot, g.board)
             bot.send_json({"handler": "chatroommessage", "roomid": g.room_id, "type": "image", "url": img_url, "text": "BOT moved! Your baari (X):"})
 
 # ======================================================
@@ -300,7 +278,7 @@ def handle_command(bot, cmd, room_id, user, args, data):
                 if bot.is_boss(user, uid) or uid == g.p1['id']:
                     # Refund logic for open lobby
                     if g.status == "LOBBY" and g.bet > 0:
-                        db.update_balance(g.p1['id'], g.p1['name'], chips_change=g.bet)
+                        db.update_balance(g.p1['id'], g.p1['name'], chips_change=g.bet, reason="refund")
                     bot.send_message(room_id, "✅ Match Session terminated."); cleanup_room(room_id)
             return True
 
@@ -322,7 +300,7 @@ def handle_command(bot, cmd, room_id, user, args, data):
             g.turn = g.p1['id'] # P1 always X
             g.last_act = time.time()
             
-            url = bot.upload_to_server(draw_premium_board(g.board))
+            url = upload_board(bot, g.board)
             bot.send_json({"handler": "chatroommessage", "roomid": room_id, "type": "image", "url": url, "text": f"⚔️ MATCH START!\n@{g.p1['name']} (X) vs @{g.p2['name']} (O)"})
         return True
 
@@ -339,7 +317,7 @@ def handle_command(bot, cmd, room_id, user, args, data):
             limit = 120 if g.status != "PLAYING" else 90
             if time.time() - g.last_act > limit:
                 if g.status == "LOBBY" and g.bet > 0:
-                    db.update_balance(g.p1['id'], g.p1['name'], chips_change=g.bet) # Auto Refund
+                    db.update_balance(g.p1['id'], g.p1['name'], chips_change=g.bet, reason="refund") # Auto Refund
                 bot.send_message(room_id, "⏰ Game Cleaned up due to inactivity.")
                 cleanup_room(room_id); return True
 
@@ -348,7 +326,7 @@ def handle_command(bot, cmd, room_id, user, args, data):
                 if cmd == "1": # BOT MODE
                     g.mode = 1; g.p2 = {'id': 'BOT', 'name': 'Howdies AI', 'av': ''}; g.status = "PLAYING"
                     g.turn = uid; g.last_act = time.time()
-                    url = bot.upload_to_server(draw_premium_board(g.board))
+                    url = upload_board(bot, g.board)
                     bot.send_json({"handler": "chatroommessage", "roomid": room_id, "type": "image", "url": url, "text": "🤖 BOT MATCH START!\nYour Move (X):"})
                     return True
                 
@@ -389,7 +367,7 @@ def handle_command(bot, cmd, room_id, user, args, data):
                     threading.Timer(0.8, process_bot_async, [bot, g]).start()
                 else: # Swap Turn PVP
                     g.turn = g.p2['id'] if uid == g.p1['id'] else g.p1['id']
-                    url = bot.upload_to_server(draw_premium_board(g.board))
+                    url = upload_board(bot, g.board)
                     current_n = g.p1['name'] if g.turn == g.p1['id'] else g.p2['name']
                     bot.send_json({"handler": "chatroommessage", "roomid": room_id, "type": "image", "url": url, "text": f"Baari: @{current_n}"})
                 
@@ -413,10 +391,10 @@ def handle_match_termination(bot, g, result):
     if result == "DRAW":
         # Full Refund for PVP
         if g.bet > 0:
-            db.update_balance(g.p1['id'], g.p1['name'], chips_change=g.bet)
-            if g.mode == 2: db.update_balance(g.p2['id'], g.p2['name'], chips_change=g.bet)
+            db.update_balance(g.p1['id'], g.p1['name'], chips_change=g.bet, reason="refund")
+            if g.mode == 2: db.update_balance(g.p2['id'], g.p2['name'], chips_change=g.bet, reason="refund")
         # Log zero result in stats
-        db.add_game_result(g.p1['id'], g.p1['name'], "tictactoe", 0, is_win=False)
+        db.add_game_result(g.p1['id'], g.p1['name'], "tictactoe", 0, is_win=False, idem_key=db.settlement_key("tictactoe", g.room_id, g.match_id, g.p1['id']))
         bot.send_message(g.room_id, "🤝 **DRAW!** Bets have been refunded.")
     
     else:
@@ -425,7 +403,7 @@ def handle_match_termination(bot, g, result):
         
         if winner['id'] == 'BOT':
             # Bot Victory: Reveal board and notify
-            url = bot.upload_to_server(draw_premium_board(g.board))
+            url = upload_board(bot, g.board)
             bot.send_json({"handler": "chatroommessage", "roomid": g.room_id, "type": "image", "url": url, "text": "🤖 **BOT WON!** Better luck next time."})
         else:
             # Player Victory: Calculate rewards
@@ -433,13 +411,15 @@ def handle_match_termination(bot, g, result):
             score_final = BOT_WIN_REWARD_SCORE if g.mode == 1 else PVP_WIN_REWARD_SCORE
             
             # Atomic DB Sync (Net Profit logic)
-            db.add_game_result(winner['id'], winner['name'], "tictactoe", chips_final - (g.bet if g.mode == 2 else 0), is_win=True, points_reward=score_final)
+            db.add_game_result(winner['id'], winner['name'], "tictactoe", chips_final - (g.bet if g.mode == 2 else 0), is_win=True, points_reward=score_final,
+                               idem_key=db.settlement_key("tictactoe", g.room_id, g.match_id, winner['id']))
             if g.mode == 2:
-                db.add_game_result(loser['id'], loser['name'], "tictactoe", -g.bet, is_win=False)
+                db.add_game_result(loser['id'], loser['name'], "tictactoe", -g.bet, is_win=False,
+                                   idem_key=db.settlement_key("tictactoe", g.room_id, g.match_id, loser['id']))
 
             # High Fidelity Winner Card
             img = draw_victory_card(winner['name'], chips_final, score_final, winner['id'], winner['av'])
-            win_url = bot.upload_to_server(img)
+            win_url = bot.upload_to_server(img, profile="webp_lossless")
             bot.send_json({"handler": "chatroommessage", "roomid": g.room_id, "type": "image", "url": win_url, "text": f"🏆 {winner['name']} Won!"})
             
     cleanup_room(g.room_id)
@@ -1,8 +1,5 @@
-import io
 import random
 import uuid
-import requests
-import time
 import threading
 from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageOps, ImageChops
 
@@ -22,7 +19,6 @@ ROOM_SETTINGS = {}
 
 # DESIGN SETTINGS
 CARD_SIZE = 1024  
-FALLBACK_AVATAR = "https://api.dicebear.com/9.x/adventurer/png?seed={}&backgroundColor=transparent"
 
 # MODERN COLOR PALETTES
 PALETTES = [
@@ -44,34 +40,13 @@ class DesignEngine:
     
     @staticmethod
     def get_gradient(w, h, c1, c2):
-        base = Image.new('RGB', (w, h), c1)
-        top = Image.new('RGB', (w, h), c2)
-        mask = Image.new('L', (w, h))
-        mask_data = []
-        for y in range(h):
-            mask_data.extend([int(255 * (y / h))] * w)
-        mask.putdata(mask_data)
-        base.paste(top, (0, 0), mask)
-        return base
+        return utils.get_gradient(w, h, c1, c2) # Memoized ramp, fresh copy to draw on
 
     @staticmethod
-    def get_user_dp(url, username):
-        """Downloads user DP or gets fallback avatar"""
-        try:
-            if url:
-                r = requests.get(url, timeout=5)
-                if r.status_code == 200:
-                    return Image.open(io.BytesIO(r.content)).convert("RGBA")
-        except:
-            pass
-        
-        # Fallback to DiceBear if DP fetch fails
-        try:
-            fb_url = FALLBACK_AVATAR.format(username + str(time.time()))
-            r = requests.get(fb_url, timeout=5)
-            return Image.open(io.BytesIO(r.content)).convert("RGBA")
-        except:
-            return None
+    def get_user_dp(url, username, size=None):
+        """User DP, else DiceBear (shared utils.avatar: hedged, cached circle crop at `size`)"""
+        try: return utils.avatar(None, username, url, size=size, circle=bool(size))
+        except: return None
 
     @staticmethod
     def draw_glass_panel(draw, x, y, w, h):
@@ -82,62 +57,70 @@ class DesignEngine:
 # 🖼️ CARD GENERATOR
 # ==========================================
 
+# Background + decor + glass panel are static per (palette, decor pattern):
+# flattened once by utils.render_layers. DP shadow blur is a cached sprite.
+DECOR_VARIANTS = 2   # Fixed bubble patterns per palette (1024px bases are 3MB each)
+PANEL_H = 450
+PANEL_Y = CARD_SIZE - PANEL_H - 60
+AV_SIZE = 420
+
+def _paint_backdrop(theme, variant):
+    def paint(img, _):
+        W, H = CARD_SIZE, CARD_SIZE
+        c1, c2, accent, txt_col = theme
+        # 1. Background
+        img.paste(utils.get_gradient(W, H, c1, c2, mutable=False), (0, 0))
+        d = ImageDraw.Draw(img, 'RGBA')
+
+        # 2. Random Decor
+        rng = random.Random(variant)
+        for _ in range(10):
+            size = rng.randint(50, 300)
+            x, y = rng.randint(0, W), rng.randint(0, H)
+            d.ellipse([x, y, x+size, y+size], fill=(255, 255, 255, 20))
+
+        # 3. Glass Panel
+        DesignEngine.draw_glass_panel(d, 60, PANEL_Y, W-120, PANEL_H)
+    return paint
+
+def _dp_shadow():
+    shadow = Image.new('RGBA', (AV_SIZE, AV_SIZE), (0,0,0,0))
+    ImageDraw.Draw(shadow).ellipse((10, 10, AV_SIZE-10, AV_SIZE-10), fill=(0,0,0,80))
+    return shadow.filter(ImageFilter.GaussianBlur(15))
+
 def render_card(username, room_name, avatar_url):
     W, H = CARD_SIZE, CARD_SIZE
-    theme = random.choice(PALETTES)
-    c1, c2, accent, txt_col = theme
-    
-    # 1. Background
-    img = DesignEngine.get_gradient(W, H, c1, c2)
-    d = ImageDraw.Draw(img, 'RGBA')
-    
-    # 2. Random Decor
-    for _ in range(10):
-        size = random.randint(50, 300)
-        x, y = random.randint(0, W), random.randint(0, H)
-        d.ellipse([x, y, x+size, y+size], fill=(255, 255, 255, 20))
-    
-    # 3. Glass Panel
-    panel_h = 450
-    panel_y = H - panel_h - 60
-    DesignEngine.draw_glass_panel(d, 60, panel_y, W-120, panel_h)
-    
-    # 4. DP Processing (Real DP)
-    av_size = 420
-    avatar = DesignEngine.get_user_dp(avatar_url, username)
-    
-    if avatar:
-        avatar = avatar.resize((av_size, av_size), Image.Resampling.LANCZOS)
-        
-        # Circle Mask for DP
-        mask = Image.new('L', (av_size, av_size), 0)
-        ImageDraw.Draw(mask).ellipse((0, 0, av_size, av_size), fill=255)
-        
-        av_x, av_y = (W - av_size) // 2, panel_y - (av_size // 2) + 30
-        
-        # Shadow for DP
-        shadow = Image.new('RGBA', (av_size, av_size), (0,0,0,0))
-        ImageDraw.Draw(shadow).ellipse((10, 10, av_size-10, av_size-10), fill=(0,0,0,80))
-        shadow = shadow.filter(ImageFilter.GaussianBlur(15))
-        img.paste(shadow, (av_x, av_y+10), shadow)
-        
-        # Paste DP
-        img.paste(avatar, (av_x, av_y), mask)
-        d.ellipse([av_x, av_y, av_x+av_size, av_y+av_size], outline=accent, width=10)
+    palette = random.randrange(len(PALETTES))
+    variant = random.randrange(DECOR_VARIANTS)
+    c1, c2, accent, txt_col = PALETTES[palette]
+
+    def guest(img, _):
+        d = ImageDraw.Draw(img, 'RGBA')
+        # 4. DP Processing (Real DP)
+        avatar = DesignEngine.get_user_dp(avatar_url, username, AV_SIZE)
 
-    # 5. Text
-    cx = W // 2
-    utils.write_text(d, (cx, panel_y + 230), "WELCOME", size=50, align="center", col="#CCCCCC")
-    utils.write_text(d, (cx, panel_y + 300), username.upper(), size=90, align="center", col="white", shadow=True)
-    utils.write_text(d, (cx, panel_y + 400), f"to {room_name}", size=45, align="center", col=accent)
+        if avatar:
+            av_x, av_y = (W - AV_SIZE) // 2, PANEL_Y - (AV_SIZE // 2) + 30
+
+            # Shadow for DP
+            shadow = utils.static_image(("welcome_shadow", AV_SIZE), _dp_shadow)
+            img.paste(shadow, (av_x, av_y+10), shadow)
+
+            # Paste DP (pre-cropped circle)
+            utils.paste_avatar(img, avatar, (av_x, av_y))
+            d.ellipse([av_x, av_y, av_x+AV_SIZE, av_y+AV_SIZE], outline=accent, width=10)
+
+        # 5. Text
+        cx = W // 2
+        utils.write_text(d, (cx, PANEL_Y + 230), "WELCOME", size=50, align="center", col="#CCCCCC")
+        utils.write_text(d, (cx, PANEL_Y + 300), username.upper(), size=90, align="center", col="white", shadow=True)
+        utils.write_text(d, (cx, PANEL_Y + 400), f"to {room_name}", size=45, align="center", col=accent)
 
     # 6. Smooth Round Corners
-    final_mask = Image.new('L', (W, H), 0)
-    ImageDraw.Draw(final_mask).rounded_rectangle([0, 0, W, H], radius=60, fill=255)
-    final = Image.new('RGBA', (W, H), (0,0,0,0))
-    final.paste(img, (0,0), final_mask)
-    
-    return final
+    return utils.render_layers("welcome", (W, H), [
+        utils.static_layer(("backdrop", palette, variant), _paint_backdrop(PALETTES[palette], variant)),
+        utils.dynamic_layer(guest),
+    ], mode='RGB', radius=60)
 
 # ==========================================
 # ⚡ EVENT HANDLERS
@@ -146,7 +129,7 @@ def render_card(username, room_name, avatar_url):
 def background_process(bot, room_id, username, room_name, avatar_url):
     try:
         img = render_card(username, room_name, avatar_url)
-        url = utils.upload(bot, img)
+        url = utils.upload(bot, img, profile="webp_lossless")
         if url:
             bot.send_json({
                 "handler": "chatroommessage",
@@ -173,7 +156,7 @@ def handle_system_message(bot, data):
         if username == bot.user_data.get('username'): return
         room_name = bot.room_id_to_name_map.get(room_id, "The Chat")
         
-        utils.run_in_bg(background_process, bot, room_id, username, room_name, avatar_url)
+        utils.run_in_bg(background_process, bot, room_id, username, room_name, avatar_url, priority="decorative")
 
 def handle_command(bot, command, room_id, user, args, data):
     global ROOM_SETTINGS
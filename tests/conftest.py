@@ -0,0 +1,23 @@
+import os
+import sys
+import tempfile
+
+# db reads its config at import: throwaway SQLite DB + journal, ledger on
+# unless the caller picked a mode (DB_LEDGER=0 python -m pytest tests)
+_tmp = tempfile.mkdtemp(prefix="bot_tests_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp, 'test.db')}")
+os.environ.setdefault("DB_LEDGER", "1")
+os.environ.setdefault("DB_COMPACT_S", "3600")
+os.environ.setdefault("DB_JOURNAL_PATH", os.path.join(_tmp, "journal.log"))
+os.environ.setdefault("DB_FLUSH_MS", "3600000")
+os.environ.setdefault("DB_FLUSH_MAX", "1000000")
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import pytest
+import db
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    db.init_db()
+    db.journal.start() # Write-behind on: results queue until an explicit flush
+    yield db
@@ -0,0 +1,54 @@
+import uuid
+import db
+
+def new_user():
+    return f"t-{uuid.uuid4().hex[:8]}"
+
+def test_reset_drops_unflushed_journal_results():
+    uid = new_user()
+    db.add_game_result(uid, uid, "mines", 500, True, 5)
+    assert db.journal.pending(uid) == (500, 5, 1)
+    assert db.reset_stats(uid)
+    db.journal.flush()
+    assert db.journal.pending(uid) == (0, 0, 0)
+    data = db.get_user_data(uid)
+    assert (data["points"], data["wins"]) == (0, 0)
+    assert data["chips"] == db.STARTING_CHIPS + 500 # Chips survive !resets
+    assert db.get_game_stats(uid) == []
+
+def test_wipe_drops_unflushed_journal_results():
+    uid = new_user()
+    db.add_game_result(uid, uid, "mines", 1000, True, 5)
+    assert db.wipe_economy()
+    db.journal.flush()
+    assert db.get_user_data(uid) == {"points": 0, "chips": db.STARTING_CHIPS, "wins": 0}
+
+def test_reads_include_unflushed_journal_results():
+    sender, receiver = new_user(), new_user()
+    db.get_user_data(sender, sender)
+    db.add_game_result(sender, sender, "coinflip", 1000, True, 5)
+    assert db.get_game_stats(sender) == [("coinflip", 1, 1000)]
+    res = db.transfer_chips(sender, sender, receiver, receiver, 600)
+    assert res == (db.STARTING_CHIPS + 400, db.STARTING_CHIPS + 600)
+    assert res[0] == db.get_user_data(sender)["chips"]
+    db.journal.flush()
+    assert db.get_game_stats(sender) == [("coinflip", 1, 1000)]
+
+def ledger_rows(uid):
+    with db.read_cursor() as cur:
+        cur.execute(f"SELECT chips FROM ledger WHERE user_id = {db.get_ph()} AND reason = 'game'", (uid,))
+        return cur.fetchall()
+
+def test_keyed_settlement_pays_once():
+    uid = new_user()
+    db.get_user_data(uid, uid)
+    key = db.settlement_key("penalty", "room1", uuid.uuid4().hex[:12], uid)
+    assert db.add_game_result(uid, uid, "penalty", 300, True, 50, idem_key=key)
+    assert db.add_game_result(uid, uid, "penalty", 300, True, 50, idem_key=key) # Double-fired
+    assert db.get_user_data(uid)["chips"] == db.STARTING_CHIPS + 300
+    if db.LEDGER:
+        assert ledger_rows(uid) == [(300,)]
+        db._settled.clear() # Restart: only the ledger's UNIQUE idem_key is left
+        assert db.add_game_result(uid, uid, "penalty", 300, True, 50, idem_key=key)
+        assert ledger_rows(uid) == [(300,)]
+        assert db.get_user_data(uid)["chips"] == db.STARTING_CHIPS + 300
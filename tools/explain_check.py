@@ -0,0 +1,63 @@
+"""
+EXPLAIN check for the hot queries.
+
+Runs EXPLAIN (QUERY PLAN) on every query the bot fires per message/command
+and flags full-table scans or on-the-fly sorts. On Postgres, seqscan is
+disabled for the session first, so a small table can't hide a missing
+index. Exits 1 if anything is flagged, so it can gate a deploy.
+
+Usage: DATABASE_URL=... python tools/explain_check.py
+"""
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import db
+import migrations
+
+PH = db.get_ph()
+HOT_QUERIES = [
+    ("user row", f"SELECT points, chips, wins FROM users WHERE user_id = {PH}", ("1",)),
+    ("target by name", f"SELECT user_id, username FROM users WHERE LOWER(username) = {PH} LIMIT 1", ("bob",)),
+    ("game stats", f"SELECT game_name, wins, earnings FROM game_stats WHERE user_id = {PH}", ("1",)),
+    ("guide", f"SELECT description FROM guides WHERE game_name = {PH}", ("mines",)),
+]
+for col in db.RANK_COLUMNS:
+    HOT_QUERIES += [
+        (f"{col} page 1", f"SELECT user_id, username, {col} FROM users ORDER BY {col} DESC, user_id LIMIT {PH}", (10,)),
+        (f"{col} seek", f"SELECT user_id, username, {col} FROM users WHERE {col} <= {PH} AND ({col} < {PH} OR user_id > {PH}) "
+                        f"ORDER BY {col} DESC, user_id LIMIT {PH}", (100, 100, "1", 10)),
+    ]
+
+def bad_steps(name, plan):
+    """Plan lines that mean 'no usable index' (a seek must also SEARCH, not walk the index)"""
+    flagged = []
+    for line in plan:
+        if db.IS_POSTGRES:
+            if "Seq Scan" in line or line.strip().startswith("Sort "): flagged.append(line.strip())
+        elif (line.startswith("SCAN ") and (" USING " not in line or name.endswith("seek"))) or "TEMP B-TREE" in line:
+            flagged.append(line)
+    return flagged
+
+def explain(cur, sql, params):
+    if db.IS_POSTGRES:
+        cur.execute("EXPLAIN " + sql, params)
+        return [r[0] for r in cur.fetchall()]
+    cur.execute("EXPLAIN QUERY PLAN " + sql, params)
+    return [r[-1] for r in cur.fetchall()]
+
+def main():
+    migrations.migrate()
+    failed = 0
+    with db.read_cursor() as cur:
+        if db.IS_POSTGRES: cur.execute("SET enable_seqscan = off")
+        for name, sql, params in HOT_QUERIES:
+            plan = explain(cur, sql, params)
+            flagged = bad_steps(name, plan)
+            print(f"[{'SCAN' if flagged else ' OK '}] {name}: {' | '.join(flagged or plan)}")
+            failed += bool(flagged)
+    print(f"{failed} of {len(HOT_QUERIES)} hot queries flagged.")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
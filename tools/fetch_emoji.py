@@ -0,0 +1,44 @@
+"""
+Offline emoji set for the sprite atlas.
+
+Downloads the twemoji PNGs the plugins use (utils.ATLAS_EMOJI + the
+STICKER_PACK codes, plus any extra emoji given) into EMOJI_DIR, so the
+atlas builds at startup without touching the network.
+
+Usage: python tools/fetch_emoji.py [--dir assets/emoji] [extra emoji ...]
+"""
+import os
+import sys
+import argparse
+import requests
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import utils
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dir", default=utils.EMOJI_DIR)
+    ap.add_argument("extra", nargs="*")
+    opts = ap.parse_args()
+
+    codes = set(utils.emoji_codes(utils.ATLAS_EMOJI))
+    codes |= {os.path.basename(url)[:-4] for url in utils.STICKER_PACK.values()}
+    codes |= {utils.emoji_code(e) for e in opts.extra}
+    os.makedirs(opts.dir, exist_ok=True)
+    failed = 0
+    for code in sorted(codes):
+        path = os.path.join(opts.dir, f"{code}.png")
+        if os.path.exists(path): continue
+        try:
+            r = requests.get(utils.EMOJI_URL.format(code), timeout=10)
+            r.raise_for_status()
+            with open(path, "wb") as f: f.write(r.content)
+            print(f"[OK] {code}")
+        except Exception as e:
+            failed += 1
+            print(f"[FAIL] {code}: {e}")
+    print(f"{len(codes) - failed} of {len(codes)} emoji in {opts.dir}/")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
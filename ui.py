@@ -1,8 +1,13 @@
-from flask import Blueprint, render_template_string, request, jsonify
+from flask import Blueprint, render_template_string, request, jsonify, Response, stream_with_context
 import os
+import hmac
 import time
 import psutil 
 import db 
+import leaderboard
+import export
+import backup
+import utils
 
 ui_bp = Blueprint('ui', __name__)
 
@@ -234,16 +239,44 @@ def register_routes(app, bot_instance):
     def health_check():
         uptime_seconds = time.time() - getattr(bot_instance, 'start_time', time.time())
         uptime_str = time.strftime('%Hh %Mm %Ss', time.gmtime(uptime_seconds))
-        return jsonify({"uptime": uptime_str, "ram": psutil.virtual_memory().percent, "cpu": psutil.cpu_percent()})
+        return jsonify({"uptime": uptime_str, "ram": psutil.virtual_memory().percent, "cpu": psutil.cpu_percent(), "db_cache": db.cache.stats(), "db_ledger": db.compactor.stats if db.LEDGER else None, "db_backup": backup.task.status, "img_cache": utils.image_cache_stats(), "asset_cache": utils.disk_cache_stats(), "mask_cache": utils.mask_cache_stats(), "font_cache": utils.font_cache_stats(), "upload_cache": utils.upload_cache_stats(), "emoji_atlas": utils.emoji_atlas_stats(), "executor": utils.executor_stats(), "layer_cache": utils.layer_cache_stats(), "avatars": utils.avatar_stats()})
 
     @app.route('/api/leaderboard')
     def get_leaderboard():
-        conn = db.get_connection(); cur = conn.cursor()
-        cur.execute("SELECT username, global_score, wins FROM users ORDER BY global_score DESC LIMIT 10")
-        rows = cur.fetchall(); conn.close()
-        data = [{"username": r[0], "score": r[1], "wins": r[2]} for r in rows]
+        rows = leaderboard.boards.top("points", 10)
+        data = [{"username": un, "score": v, "wins": leaderboard.boards.get_wins(uid)} for uid, un, v in rows]
         return jsonify({"success": True, "data": data})
     
+    def bot_authorized():
+        """Caller knows the bot's login: X-Bot-Password header, or Authorization: Bearer <bot session token>"""
+        password = (getattr(bot_instance, 'user_data', None) or {}).get('password')
+        token = getattr(bot_instance, 'token', None)
+        given = request.headers.get('X-Bot-Password', '')
+        auth = request.headers.get('Authorization', '')
+        if password and given and hmac.compare_digest(given.encode(), str(password).encode()): return True
+        if token and auth.startswith('Bearer ') and hmac.compare_digest(auth[7:].encode(), str(token).encode()): return True
+        return False
+
+    @app.route('/api/export/<table>')
+    def export_table(table):
+        # ?format=ndjson|csv &game= &min_chips= &since=(unix|ISO) &gzip=1 -- streamed, never buffered
+        # Whole users/ledger tables: bot login required (nobody can export before the bot is logged in)
+        if not bot_authorized():
+            return jsonify({"success": False, "msg": "Unauthorized"}), 401
+        fmt = request.args.get('format', 'ndjson')
+        try:
+            chunks = export.iter_export(table, fmt, game=request.args.get('game'),
+                                        min_chips=request.args.get('min_chips'), since=request.args.get('since'))
+        except ValueError as e:
+            return jsonify({"success": False, "msg": str(e)}), 400
+        name = f"{table}.{fmt}"
+        if request.args.get('gzip') == '1':
+            chunks, mime, name = export.gzip_stream(chunks), "application/gzip", name + ".gz"
+        else:
+            mime = export.FORMATS[fmt]
+        return Response(stream_with_context(chunks), mimetype=mime,
+                        headers={"Content-Disposition": f"attachment; filename={name}", "X-Accel-Buffering": "no"})
+
     @app.route('/api/room/details')
     def get_room_details():
         room_name = request.args.get('name')
@@ -1,19 +1,79 @@
 import os
 import io
+import json
+import atexit
+import mmap
 import time
+import random
+import colorsys
+import hashlib
 import requests
 import threading
 import traceback
-from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
+from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageChops, ImageColor
 
 # ==========================================
 # --- ⚙️ CONFIGURATION (Settings) ---
 # ==========================================
 MAX_WORKERS = 10      # Ek sath kitne heavy tasks (Upload/Art) chalenge
-CACHE_SIZE = 200      # RAM me kitni images save rahengi (Speed ke liye)
+# Background task classes, highest priority first: name -> (queue limit, when full, max running)
+TASK_CLASSES = {
+    "interactive": (64, "reject", MAX_WORKERS),        # Game moves / boards: never behind decoration
+    "result":      (128, "reject", MAX_WORKERS),       # Result / winner / reply cards
+    "decorative":  (32, "drop_oldest", 3),             # Welcome cards etc: raid me purane drop
+    "background":  (16, "reject", 2),                  # Prefetch, backups
+}
+DEFAULT_TASK_CLASS = "result"
+RESERVED_WORKERS = 2  # Itne workers sirf "interactive" ke liye (baaki classes kabhi sab nahi le sakti)
+TASK_SAMPLES = 512    # Per-class wait/run timings kept for the metrics
+CACHE_BYTES = 64 * 1024 * 1024  # Image cache budget (decoded w*h*4 bytes, not count)
+CACHE_TTL = 6 * 3600            # Default per-image expiry (seconds)
+ASSET_DIR = os.environ.get("ASSET_CACHE_DIR", "asset_cache")   # Disk cache (survives restarts)
+ASSET_CACHE_BYTES = int(os.environ.get("ASSET_CACHE_MB", "256")) * 1024 * 1024
+ASSET_MAX_AGE = 7 * 86400       # Emoji/stickers/coins/icons: itne time tak bina network ke serve
+ASSET_INDEX_SAVE_S = 60         # Hits/304s only touch timestamps: index.json at most this often
+AVATAR_MAX_AGE = 3600           # Avatars change, revalidate (ETag) every hour
+AVATAR_CACHE_BYTES = 32 * 1024 * 1024  # Decoded avatars + their resized / circle variants
+AVATAR_TIMEOUT = 4              # Whole hedged lookup, not per source
+AVATAR_HEDGE_S = 0.4            # Agla fallback itni der baad fire (or at once if the previous fails)
+AVATAR_PREFER_S = 0.5           # Fallback mil gaya? Better source ka itna aur wait
+AVATAR_NEGATIVE_TTL = 300       # Dead avatar URL: itni der tak dobara try nahi
+AVATAR_FETCHERS = 8
+PLATFORM_AVATAR = "https://api.howdies.app/api/avatar/{}"
+DICEBEAR_AVATAR = "https://api.dicebear.com/9.x/adventurer/png?seed={}&backgroundColor={}"
+AVATAR_STYLES = ("emoji", "geometric", "initials")   # Local procedural avatars (no network)
+AVATAR_MOODS = ("happy", "sad", "angry", "dizzy", "love", "cool")
+AVATAR_VARIANTS = 4            # Variety per (user, style): chhota index = har variant cacheable
+GRADIENT_CACHE = 32             # Kitne (size, colours, mode) gradients RAM me rahenge
+MASK_CACHE_BYTES = 16 * 1024 * 1024  # Circle / rounded-corner masks (1 byte per pixel)
+MASK_AA = 4                     # Masks drawn at 4x, downsampled once, then reused
+LAYOUT_CACHE = 4096             # Memoized getlength / getbbox results
+SPRITE_CACHE_BYTES = 8 * 1024 * 1024  # Rasterized text masks (1 byte per pixel)
+LAYER_CACHE_BYTES = 64 * 1024 * 1024  # Flattened static card layers + static sprites
+UPLOAD_CACHE = 5000             # content hash / key -> uploaded URL (persisted in ASSET_DIR)
+UPLOAD_TTL = 7 * 86400          # Itne purane URL dobara upload honge
+UPLOAD_SAVE_S = 10              # Upload cache disk write debounce
+ENCODE_PROFILE = os.environ.get("IMG_PROFILE", "png")       # Default upload encoding
+WEBP_UPLOADS = os.environ.get("IMG_WEBP", "0") == "1"       # Upload server WebP leta hai? Tab tak fallback
+
+# Encoder profiles: name -> (format, save options, palette colours, fallback if WebP is off)
+# Opaque RGBA cards are always flattened to RGB first (25% less raw data).
+ENCODER_PROFILES = {
+    "png":           ("PNG", {}, 0, None),                        # Pillow default, lossless
+    "png_fast":      ("PNG", {"compress_level": 1}, 0, None),     # ~25% less CPU, ~30% bigger
+    "png_palette":   ("PNG", {"optimize": True}, 256, None),      # Flat cards: boards, help, lists (4-7x smaller)
+    "webp_lossless": ("WEBP", {"lossless": True, "quality": 50, "method": 2}, 0, "png"),  # Gradient/neon cards
+    "webp":          ("WEBP", {"quality": 85, "method": 4}, 0, "png"),   # Photo/grain cards
+}
+UPLOAD_MIME = {"png": "image/png", "gif": "image/gif", "webp": "image/webp"}
+EMOJI_DIR = os.environ.get("EMOJI_DIR", "assets/emoji")   # Offline twemoji PNGs (<code>.png), tools/fetch_emoji.py
+EMOJI_URL = "https://raw.githubusercontent.com/twitter/twemoji/master/assets/72x72/{}.png"
+ATLAS_EMOJI = "💣🍪💥🔥🏆😂😎😍😭🤖🎉💰🪙⭐❤️💀👑🎯"  # Plugins ke emoji: startup pe atlas me
+ATLAS_SIZES = (24, 50, 64)      # Pre-scaled atlas pages (other sizes built on first use)
 RETRY_LIMIT = 3       # Internet fail hone par kitni baar try karega
 FONT_PATHS = [        # Fonts dhundne ki locations
     "arial.ttf",
@@ -48,46 +108,66 @@ class HighPerformanceUtils:
         self.session.mount('https://', adapter)
 
         # 3. Background Workers (Non-Blocking)
-        self.executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="ArtWorker")
+        self.executor = PriorityExecutor()
 
         # 4. Smart Asset Cache
-        self._img_cache = {}
-        self._font_cache = {}
+        self._img_cache = ImageCache()
+        self._disk = DiskCache()
+        self._uploads = UploadCache()
+        self.emoji = EmojiAtlas(self)
+        self.fonts = FontManager()
+        self._grad_cache = OrderedDict()
+        self._masks = ImageCache(MASK_CACHE_BYTES, ttl=float("inf"))
+        self._layers = ImageCache(LAYER_CACHE_BYTES, ttl=float("inf"))
+        self.avatars = AvatarService(self)
 
     # ---------------------------------------------------------
     # 🌐 NETWORK LAYER (Download & Upload)
     # ---------------------------------------------------------
 
-    def run_async(self, func, *args, **kwargs):
-        """Background me task chalane ke liye"""
-        return self.executor.submit(func, *args, **kwargs)
+    def run_async(self, func, *args, priority=DEFAULT_TASK_CLASS, **kwargs):
+        """Background me task chalane ke liye. priority = a TASK_CLASSES name"""
+        return self.executor.submit(priority, func, *args, **kwargs)
 
-    def download_image(self, url):
-        """Fast Download with Memory Cache"""
+    def download_image(self, url, mutable=False, ttl=None):
+        """
+        Fast Download with Memory Cache.
+        Returns the SHARED cached image (read-only: resize/crop/paste-from are fine,
+        drawing on it is not). Pass mutable=True to get a private copy to draw on.
+        """
         if not url: return None
-        
-        # Check Cache (Thread Safe)
-        with self.lock:
-            if url in self._img_cache:
-                return self._img_cache[url].copy()
+        img = self._img_cache.get(url, lambda: self._fetch_image(url), ttl)
+        return img.copy() if (img is not None and mutable) else img
+
+    def _fetch_image(self, url):
+        return self.fetch_image(url)
 
+    def fetch_bytes(self, url, max_age=ASSET_MAX_AGE, timeout=5, headers=None):
+        """Raw bytes via the disk cache (fresh copy = zero network calls)"""
+        path, data = self._disk.resolve(self.session, url, max_age, timeout, headers)
+        if data is not None or not path: return data
+        with open(path, "rb") as f: return f.read()
+
+    def fetch_image(self, url, max_age=ASSET_MAX_AGE, timeout=5, headers=None):
+        """New RGBA image via the disk cache (not the shared RAM cache). None on failure"""
+        if not url: return None
         try:
-            resp = self.session.get(url, timeout=5)
-            if resp.status_code == 200:
-                img = Image.open(io.BytesIO(resp.content)).convert("RGBA")
-                
-                # Update Cache
-                with self.lock:
-                    if len(self._img_cache) > CACHE_SIZE:
-                        self._img_cache.pop(next(iter(self._img_cache))) # Oldest hatao
-                    self._img_cache[url] = img
-                return img
+            path, data = self._disk.resolve(self.session, url, max_age, timeout, headers)
+            if data is not None: return Image.open(io.BytesIO(data)).convert("RGBA")
+            if not path: return None
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return Image.open(mm).convert("RGBA") # Decode straight from the page cache
         except Exception as e:
             print(f"[Utils] Download Error: {e}")
         return None
 
-    def upload_image_fast(self, image_data, token, user_id, file_type='png'):
-        """High-Performance Upload using Session Pool - CRASH PROOF VERSION"""
+    def upload_image_fast(self, image_data, token, user_id, file_type='png', key=None, profile=None):
+        """
+        High-Performance Upload using Session Pool - CRASH PROOF VERSION.
+        Deduped: same encoded bytes (or same semantic `key`) = cached URL, no POST.
+        With a key, image_data may be a callable - it only runs on a cache miss.
+        PIL images going out as 'png' are encoded with `profile` (ENCODER_PROFILES).
+        """
         import io
         
         # 🔥 CRITICAL SAFETY CHECK
@@ -95,14 +175,21 @@ class HighPerformanceUtils:
             print("[Utils] Error: Upload cancelled (Image data is None).")
             return None
 
+        if key:
+            return self._uploads.get(f"key:{file_type}:{profile or ENCODE_PROFILE}:{key}", lambda: self.upload_image_fast(
+                image_data() if callable(image_data) else image_data, token, user_id, file_type, None, profile))
+
         try:
             final_bytes = None
 
             # 1. Agar ye PIL Image hai (Standard plugins ke liye)
             if isinstance(image_data, Image.Image):
-                img_byte_arr = io.BytesIO()
-                image_data.save(img_byte_arr, format=file_type.upper())
-                final_bytes = img_byte_arr.getvalue()
+                if file_type.lower() == 'png':
+                    final_bytes, file_type = self.encode_image(image_data, profile)
+                else:
+                    img_byte_arr = io.BytesIO()
+                    image_data.save(img_byte_arr, format=file_type.upper())
+                    final_bytes = img_byte_arr.getvalue()
             
             # 2. Agar ye pehle se BytesIO hai (Gift Shop fix)
             elif isinstance(image_data, io.BytesIO):
@@ -116,13 +203,20 @@ class HighPerformanceUtils:
                 print(f"[Utils] Error: Unsupported image type {type(image_data)}")
                 return None
 
+            digest = hashlib.blake2b(final_bytes, digest_size=16).hexdigest()
+            return self._uploads.get(f"{file_type}:{digest}", lambda: self._post_upload(final_bytes, token, user_id, file_type))
+        except Exception as e:
+            print(f"[Utils] Upload Error: {e}")
+            traceback.print_exc()
+        return None
+
+    def _post_upload(self, final_bytes, token, user_id, file_type):
+        try:
             url = "https://api.howdies.app/api/upload"
-            mime = 'image/gif' if file_type.lower() == 'gif' else 'image/png'
-            
-            # Requests needs a file-like object for upload
-            upload_stream = io.BytesIO(final_bytes)
+            mime = UPLOAD_MIME.get(file_type.lower(), 'image/png')
             
-            files = {'file': (f'fast_up.{file_type}', upload_stream, mime)}
+            # Bytes go straight into the multipart body (no extra BytesIO copy)
+            files = {'file': (f'fast_up.{file_type}', final_bytes, mime)}
             data = {'token': token, 'uploadType': 'image', 'UserID': user_id}
             
             # Session ka use karke Fast Upload
@@ -138,30 +232,35 @@ class HighPerformanceUtils:
             traceback.print_exc()
         return None
 
+    def encode_image(self, img, profile=None, webp=None):
+        """PIL image -> (bytes, ext) with a named ENCODER_PROFILES entry"""
+        fmt, opts, colours, fallback = ENCODER_PROFILES[profile or ENCODE_PROFILE]
+        if fmt == "WEBP" and not (WEBP_UPLOADS if webp is None else webp):
+            return self.encode_image(img, fallback, webp)
+        if img.mode == "RGBA" and img.getextrema()[3][0] == 255: img = img.convert("RGB") # No transparency
+        elif img.mode not in ("RGB", "RGBA", "L", "P"): img = img.convert("RGBA")
+        if colours and img.mode in ("RGB", "RGBA"): img = img.quantize(colours, method=Image.Quantize.FASTOCTREE)
+        buf = io.BytesIO()
+        img.save(buf, format=fmt, **opts)
+        return buf.getvalue(), fmt.lower()
+
     # ---------------------------------------------------------
     # 🎨 ASSET MANAGER (Emoji & Stickers)
     # ---------------------------------------------------------
 
     def get_emoji(self, char, size=64):
-        """🔥 Emoji ko PNG Image banata hai (Internet se)"""
-        try:
-            # Unicode to Hex code (e.g. 🔥 -> 1f525)
-            code = "-".join(f"{ord(c):x}" for c in char)
-            url = f"https://raw.githubusercontent.com/twitter/twemoji/master/assets/72x72/{code}.png"
-            img = self.download_image(url)
-            if img:
-                return img.resize((size, size), Image.Resampling.LANCZOS)
+        """🔥 Emoji sprite from the atlas (SHARED, paste-from only). None if unknown/offline"""
+        try: return self.emoji.sprite(emoji_code(char), size)
         except:
-            pass
+            traceback.print_exc()
         return None
 
     def get_sticker(self, name, size=100):
-        """Naam se Sticker uthata hai (e.g. 'laugh', 'fire')"""
+        """Naam se Sticker uthata hai (e.g. 'laugh', 'fire') - twemoji, so atlas se"""
         url = STICKER_PACK.get(name.lower())
         if url:
-            img = self.download_image(url)
-            if img:
-                return img.resize((size, size), Image.Resampling.LANCZOS)
+            try: return self.emoji.sprite(os.path.basename(url)[:-4], size)
+            except: traceback.print_exc()
         return None
 
     # ---------------------------------------------------------
@@ -169,92 +268,992 @@ class HighPerformanceUtils:
     # ---------------------------------------------------------
 
     def get_font(self, size):
-        key = f"font_{size}"
-        if key in self._font_cache: return self._font_cache[key]
-        
-        font = ImageFont.load_default()
-        for path in FONT_PATHS:
-            try:
-                font = ImageFont.truetype(path, size)
-                break
-            except: continue
-        
-        self._font_cache[key] = font
-        return font
+        return self.fonts.font(size)
+
+    # ---------------------------------------------------------
+    # ⭕ SHAPE / MASK CACHE
+    # ---------------------------------------------------------
+
+    def get_mask(self, shape, size, radius=0, aa=MASK_AA):
+        """
+        Anti-aliased 'L' mask: shape = 'circle' | 'rounded', size = int or (w, h).
+        Cached per (shape, size, radius, aa) and SHARED - paste/putalpha with it, never draw on it.
+        """
+        w, h = (size, size) if isinstance(size, int) else tuple(size)
+        key = (shape, w, h, radius, aa)
+        return self._masks.get(key, lambda: self._draw_mask(shape, w, h, radius, aa))
+
+    def _draw_mask(self, shape, w, h, radius, aa):
+        big = Image.new('L', (w * aa, h * aa), 0)
+        draw = ImageDraw.Draw(big)
+        box = (0, 0, w * aa - 1, h * aa - 1)
+        if shape == "circle": draw.ellipse(box, fill=255)
+        elif shape == "rounded": draw.rounded_rectangle(box, radius=radius * aa, fill=255)
+        else: raise ValueError(f"Unknown mask shape '{shape}'")
+        return big if aa == 1 else big.resize((w, h), Image.Resampling.LANCZOS)
 
     def circle_crop(self, img, size=None):
         """Avatar Gol (Round) karta hai"""
         if size: img = img.resize((size, size), Image.Resampling.LANCZOS)
         else: size = min(img.size)
         
-        mask = Image.new('L', (size, size), 0)
-        draw = ImageDraw.Draw(mask)
-        draw.ellipse((0, 0, size, size), fill=255)
-        
         output = Image.new('RGBA', (size, size), (0,0,0,0))
-        output.paste(img, (0,0), mask)
+        output.paste(img, (0,0), self.get_mask("circle", size))
+        return output
+
+    def round_corners(self, img, radius):
+        """Card ke corners round (cached mask)"""
+        output = Image.new('RGBA', img.size, (0,0,0,0))
+        output.paste(img, (0,0), self.get_mask("rounded", img.size, radius))
         return output
 
     def rounded_rect(self, width, height, radius, color, outline=None, outline_width=0):
-        """Smooth Rounded Card Banata hai"""
-        factor = 4 # High Quality Anti-Aliasing
-        w, h = width * factor, height * factor
-        r = radius * factor
-        ow = outline_width * factor
-        
-        img = Image.new('RGBA', (w, h), (0,0,0,0))
-        draw = ImageDraw.Draw(img)
-        draw.rounded_rectangle([0, 0, w, h], radius=r, fill=color, outline=outline, width=ow)
-        
-        return img.resize((width, height), Image.Resampling.LANCZOS)
+        """Smooth Rounded Card Banata hai (cached AA masks, no 4x redraw)"""
+        mask = self.get_mask("rounded", (width, height), radius)
+        img = self._solid(width, height, color, mask)
+        if outline and outline_width:
+            ow = outline_width
+            ring = mask.copy()
+            ring.paste(0, (ow, ow), self.get_mask("rounded", (width - 2 * ow, height - 2 * ow), max(0, radius - ow)))
+            img = Image.alpha_composite(img, self._solid(width, height, outline, ring))
+        return img
+
+    def _solid(self, w, h, color, mask):
+        """Flat colour layer whose alpha = mask x colour alpha (straight alpha, no dark fringe)"""
+        if color is None: return Image.new('RGBA', (w, h), (0,0,0,0))
+        rgba = ImageColor.getrgb(color) if isinstance(color, str) else tuple(color)
+        alpha = rgba[3] if len(rgba) == 4 else 255
+        layer = Image.new('RGBA', (w, h), rgba[:3] + (255,))
+        layer.putalpha(mask if alpha == 255 else mask.point(lambda v: v * alpha // 255))
+        return layer
 
     def draw_text(self, draw_obj, xy, text, size=20, color="white", align="left", shadow=False):
-        """Shadow ke sath Text likhta hai"""
-        font = self.get_font(size)
+        """Shadow ke sath Text likhta hai (text + shadow = one cached raster)"""
         x, y = xy
         anchor = "la"
         if align == "center": anchor = "mm"
         elif align == "right": anchor = "ra"
         
         if shadow:
-            draw_obj.text((x+2, y+2), text, font=font, fill=(0,0,0,180), anchor=anchor)
+            self.fonts.draw(draw_obj, (x+2, y+2), text, size, (0,0,0,180), anchor)
         
-        draw_obj.text((x, y), text, font=font, fill=color, anchor=anchor)
-
-    def make_gradient(self, width, height, c1, c2):
-        """Vertical Gradient Background"""
-        base = Image.new('RGB', (width, height), c1)
-        top = Image.new('RGB', (width, height), c2)
-        mask = Image.new('L', (width, height))
-        mask_data = []
-        for y in range(height):
-            mask_data.extend([int(255 * (y / height))] * width)
-        mask.putdata(mask_data)
-        base.paste(top, (0, 0), mask)
-        return base
+        self.fonts.draw(draw_obj, (x, y), text, size, color, anchor)
+
+    def make_gradient(self, width, height, c1, c2, mode="vertical"):
+        """
+        c1 -> c2 Gradient Background (vertical / horizontal / diagonal / radial).
+        Memoized per (size, colours, mode): returns the SHARED image, draw on a copy.
+        """
+        key = (width, height, _hashable(c1), _hashable(c2), mode)
+        with self.lock:
+            img = self._grad_cache.get(key)
+            if img is not None:
+                self._grad_cache.move_to_end(key)
+                return img
+
+        mask = self.gradient_mask(width, height, mode)
+        img = Image.composite(Image.new('RGB', (width, height), key[3]), Image.new('RGB', (width, height), key[2]), mask)
+        with self.lock:
+            self._grad_cache[key] = img
+            while len(self._grad_cache) > GRADIENT_CACHE: self._grad_cache.popitem(last=False)
+        return img
+
+    def gradient_mask(self, w, h, mode="vertical"):
+        """Cached 'L' ramp (0 -> 255) per (size, mode), shared by every colour pair"""
+        return self._masks.get(("gradient", w, h, mode), lambda: self._gradient_mask(w, h, mode))
+
+    def _gradient_mask(self, w, h, mode):
+        """1xH / Wx1 ramp stretched to full size (no per-pixel Python loop)"""
+        if mode == "radial":
+            return Image.radial_gradient('L').resize((w, h), Image.Resampling.BILINEAR)
+        ramp = lambda n: [int(255 * (i / n)) for i in range(n)]
+        col = Image.new('L', (1, h)); col.putdata(ramp(h))
+        col = col.resize((w, h), Image.Resampling.NEAREST)
+        if mode == "vertical": return col
+        row = Image.new('L', (w, 1)); row.putdata(ramp(w))
+        row = row.resize((w, h), Image.Resampling.NEAREST)
+        if mode == "horizontal": return row
+        if mode == "diagonal": return ImageChops.add(row, col, scale=2)
+        raise ValueError(f"Unknown gradient mode '{mode}'")
+
+    # ---------------------------------------------------------
+    # 🧱 LAYERED CARDS (static layers flattened once)
+    # ---------------------------------------------------------
+
+    def render_layers(self, name, size, layers, mode='RGBA', background=(0,0,0,0), radius=0):
+        """
+        Card = stack of Layers, bottom first. Consecutive static layers are
+        flattened once per (name, size, their keys) and memoized; each request
+        copies the flattened base and paints only the dynamic layers.
+        A static run above a dynamic layer is cached as a transparent overlay
+        and alpha-composited, so put static layers first where possible.
+        """
+        runs = []
+        for layer in layers:
+            if runs and runs[-1][0] == layer.static: runs[-1][1].append(layer)
+            else: runs.append((layer.static, [layer]))
+
+        base = runs.pop(0)[1] if runs and runs[0][0] else []
+        key = ("base", name, size, mode, _hashable(background), tuple(l.key for l in base))
+        img = self._layers.get(key, lambda: self._flatten(size, mode, background, base)).copy()
+        draw = ImageDraw.Draw(img)
+        for static, group in runs:
+            if static:
+                key = ("overlay", name, size, tuple(l.key for l in group))
+                overlay = self._layers.get(key, lambda: self._flatten(size, 'RGBA', (0,0,0,0), group))
+                if img.mode == 'RGBA': img.alpha_composite(overlay)
+                else: img.paste(overlay, (0, 0), overlay)
+            else:
+                for layer in group: layer.paint(img, draw)
+        return self.round_corners(img, radius) if radius else img
+
+    def _flatten(self, size, mode, background, layers):
+        img = Image.new(mode, size, background)
+        draw = ImageDraw.Draw(img)
+        for layer in layers: layer.paint(img, draw)
+        return img
+
+    def static_image(self, key, build):
+        """Memoized, SHARED sprite (goalie badge, blurred shadow...): build() runs once per key"""
+        return self._layers.get(("sprite",) + tuple(key), build)
+
+def _hashable(color):
+    return tuple(color) if isinstance(color, list) else color
+
+class Layer:
+    """
+    One card layer: paint(img, draw) draws onto the canvas. A static layer's
+    key must cover everything its pixels depend on (colours, variant...).
+    """
+    __slots__ = ("paint", "key", "static")
+
+    def __init__(self, paint, key=None, static=False):
+        self.paint = paint
+        self.key = key
+        self.static = static
+
+class FontManager:
+    """
+    Font paths resolved once, one font object per (path, size), memoized
+    getlength/getbbox, and rasterized text masks in a byte-bounded LRU.
+    A mask has no colour, so text, its shadow and every colour share one raster.
+    """
+    def __init__(self, paths=FONT_PATHS):
+        self.lock = threading.Lock()
+        self.default_paths = tuple(paths)
+        self.resolved = {}            # paths tuple -> first loadable path (None = PIL default)
+        self.fonts = {}               # (path, size) -> font
+        self.layouts = OrderedDict()  # (op, path, size, text, anchor) -> length / bbox
+        self.sprites = ImageCache(SPRITE_CACHE_BYTES, ttl=float("inf"))
+        self.resolve()
+
+    def resolve(self, paths=None):
+        paths = tuple(paths) if paths else self.default_paths
+        if paths not in self.resolved:
+            found = None
+            for path in paths:
+                try:
+                    ImageFont.truetype(path, 12)
+                    found = path
+                    break
+                except Exception: continue
+            with self.lock: self.resolved[paths] = found
+        return self.resolved[paths]
+
+    def font(self, size, paths=None):
+        key = (self.resolve(paths), size)
+        font = self.fonts.get(key)
+        if font is None:
+            if key[0]: font = ImageFont.truetype(key[0], size)
+            else:
+                try: font = ImageFont.load_default(size)
+                except TypeError: font = ImageFont.load_default() # Pillow < 10.1: no sizes
+            with self.lock: font = self.fonts.setdefault(key, font)
+        return font
+
+    def _layout(self, op, text, size, paths, anchor=None):
+        key = (op, self.resolve(paths), size, text, anchor)
+        with self.lock:
+            if key in self.layouts:
+                self.layouts.move_to_end(key)
+                return self.layouts[key]
+        font = self.font(size, paths)
+        val = font.getlength(text) if op == "length" else font.getbbox(text, anchor=anchor)
+        with self.lock:
+            self.layouts[key] = val
+            while len(self.layouts) > LAYOUT_CACHE: self.layouts.popitem(last=False)
+        return val
+
+    def length(self, text, size, paths=None): return self._layout("length", text, size, paths)
+    def bbox(self, text, size, anchor="la", paths=None): return self._layout("bbox", text, size, paths, anchor)
+
+    def sprite(self, text, size, anchor="la", paths=None):
+        """Cached 'L' text mask; mask.info['offset'] = where it goes relative to xy"""
+        key = (self.resolve(paths), size, text, anchor)
+        return self.sprites.get(key, lambda: self._raster(text, size, anchor, paths))
+
+    def _raster(self, text, size, anchor, paths):
+        l, t, r, b = self.bbox(text, size, anchor, paths)
+        mask = Image.new('L', (max(1, r - l), max(1, b - t)), 0)
+        ImageDraw.Draw(mask).text((-l, -t), text, font=self.font(size, paths), fill=255, anchor=anchor)
+        mask.info["offset"] = (l, t)
+        return mask
+
+    def draw(self, draw_obj, xy, text, size, fill, anchor="la", paths=None):
+        """draw_obj.text() replacement: cached raster stamped with ImageDraw.bitmap (same ink rules)"""
+        text = str(text)
+        try:
+            if "\n" in text: raise ValueError("multiline")
+            mask = self.sprite(text, size, anchor, paths)
+        except Exception:
+            return draw_obj.text(xy, text, font=self.font(size, paths), fill=fill, anchor=anchor)
+        dx, dy = mask.info["offset"]
+        draw_obj.bitmap((round(xy[0] + dx), round(xy[1] + dy)), mask, fill=fill)
+
+    def stats(self):
+        return dict(self.sprites.stats(), fonts=len(self.fonts), layouts=len(self.layouts))
+
+class UploadCache:
+    """
+    Upload key (content hash or semantic key) -> URL. Bounded LRU, persisted to
+    disk so it survives restarts; concurrent uploads of one key share one POST.
+    """
+    def __init__(self, path=os.path.join(ASSET_DIR, "uploads.json"), max_entries=UPLOAD_CACHE, ttl=UPLOAD_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # key -> (url, uploaded_at)
+        self.inflight = {}             # key -> _Flight
+        self.dirty = False
+        self.saved_at = 0
+        self.counters = {"hits": 0, "misses": 0, "coalesced": 0, "failed": 0}
+        self._load()
+        atexit.register(self.save)
+
+    def _load(self):
+        try:
+            with open(self.path) as f: rows = json.load(f)
+        except (OSError, ValueError): rows = []
+        now = time.time()
+        for key, url, at in rows[-self.max_entries:]:
+            if now - at < self.ttl: self.entries[key] = (url, at)
+
+    def save(self):
+        with self.lock:
+            if not self.dirty: return
+            rows = [[k, url, at] for k, (url, at) in self.entries.items()]
+            self.dirty = False
+            self.saved_at = time.time()
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f: json.dump(rows, f)
+            os.replace(tmp, self.path)
+        except OSError: traceback.print_exc()
+
+    def get(self, key, uploader):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and time.time() - entry[1] < self.ttl:
+                self.entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return entry[0]
+            flight = self.inflight.get(key)
+            if flight:
+                self.counters["coalesced"] += 1
+                leader = False
+            else:
+                flight = self.inflight[key] = _Flight()
+                self.counters["misses"] += 1
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            return flight.result
+
+        url, due = None, False
+        try: url = uploader()
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+                if url:
+                    self.entries[key] = (url, time.time())
+                    self.entries.move_to_end(key)
+                    while len(self.entries) > self.max_entries: self.entries.popitem(last=False)
+                    self.dirty = True
+                    due = time.time() - self.saved_at > UPLOAD_SAVE_S
+                else: self.counters["failed"] += 1
+            flight.result = url
+            flight.done.set()
+        if due: self.save()
+        return url
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries))
+
+def emoji_code(char):
+    """🔥 -> '1f525'. Twemoji drops FE0F except inside ZWJ sequences (❤️ -> '2764')"""
+    cps = [ord(c) for c in char]
+    if 0x200d not in cps: cps = [c for c in cps if c != 0xfe0f]
+    return "-".join(f"{c:x}" for c in cps)
+
+def emoji_codes(chars):
+    """'💣❤️🔥' -> ['1f4a3', '2764', '1f525'] (single emoji, 'x + FE0F' kept together)"""
+    codes, i = [], 0
+    while i < len(chars):
+        step = 2 if i + 1 < len(chars) and chars[i + 1] == "\ufe0f" else 1
+        codes.append(emoji_code(chars[i:i + step])); i += step
+    return codes
+
+class EmojiAtlas:
+    """
+    Twemoji packed into one 72px-cell atlas, plus a pre-scaled page per common
+    card size (ATLAS_SIZES, each cell resized once, no bleed). A sprite is a
+    cached crop of its page; other sizes resize just their own 72px cell, once.
+    Either way a board render costs a dict hit + paste: no network, no resample.
+    Unknown emoji extend the atlas lazily (offline dir first, then the disk cache).
+    """
+    CELL = 72
+    COLS = 16
+
+    def __init__(self, utils, sizes=ATLAS_SIZES):
+        self.utils = utils
+        self.sizes = set(sizes) # Only these get a page
+        self.lock = threading.Lock()
+        self.index = {}    # code -> cell number
+        self.atlas = Image.new('RGBA', (self.CELL * self.COLS, self.CELL), (0,0,0,0))
+        self.pages = {}    # size -> scaled atlas
+        self.sprites = {}  # (code, size) -> crop of a page, or the resized cell
+        self.missing = {}  # code -> last failed at (retry later, no fetch per render)
+        self.counters = {"hits": 0, "crops": 0, "resized": 0, "loaded": 0, "missing": 0}
+
+    def prefetch(self, chars=ATLAS_EMOJI, sizes=ATLAS_SIZES):
+        """Background warm-up: plugin emoji in the atlas + common sizes scaled"""
+        codes = emoji_codes(chars)
+        for code in codes: self._ensure(code)
+        for size in sizes:
+            for code in codes: self.sprite(code, size)
+        print(f"[Utils] Emoji atlas: {len(self.index)} emoji, pages {sorted(self.pages)}")
+
+    def _load(self, code):
+        path = os.path.join(EMOJI_DIR, f"{code}.png")
+        if os.path.exists(path):
+            with Image.open(path) as img: return img.convert("RGBA")
+        return self.utils.fetch_image(EMOJI_URL.format(code))
+
+    def _ensure(self, code):
+        """-> cell number, loading + packing the emoji on first use. None if unavailable"""
+        if code in self.index: return self.index[code]
+        if time.time() - self.missing.get(code, 0) < 300: return None
+        img = self._load(code)
+        with self.lock:
+            if code in self.index: return self.index[code]
+            if img is None:
+                self.missing[code] = time.time(); self.counters["missing"] += 1
+                return None
+            cell = len(self.index)
+            if img.size != (self.CELL, self.CELL): img = img.resize((self.CELL, self.CELL), Image.Resampling.LANCZOS)
+            self.atlas = self._place(self.atlas, cell, self.CELL, img)
+            for size, page in self.pages.items():
+                self.pages[size] = self._place(page, cell, size, img.resize((size, size), Image.Resampling.LANCZOS))
+            self.index[code] = cell
+            self.counters["loaded"] += 1
+            return cell
+
+    def _place(self, page, cell, size, img):
+        """Pastes into a page, growing it by a row when full"""
+        row, col = divmod(cell, self.COLS)
+        if (row + 1) * size > page.height:
+            grown = Image.new('RGBA', (page.width, (row + 1) * size), (0,0,0,0))
+            grown.paste(page, (0, 0))
+            page = grown
+        page.paste(img, (col * size, row * size))
+        return page
+
+    def _page(self, size):
+        page = self.pages.get(size)
+        if page is None:
+            with self.lock:
+                page = Image.new('RGBA', (size * self.COLS, size * max(1, -(-len(self.index) // self.COLS))), (0,0,0,0))
+                for code, cell in self.index.items():
+                    row, col = divmod(cell, self.COLS)
+                    src = self.atlas.crop((col * self.CELL, row * self.CELL, (col + 1) * self.CELL, (row + 1) * self.CELL))
+                    page.paste(src.resize((size, size), Image.Resampling.LANCZOS), ((cell % self.COLS) * size, row * size))
+                self.pages[size] = page
+        return page
+
+    def sprite(self, code, size):
+        key = (code, size)
+        sprite = self.sprites.get(key)
+        if sprite is not None:
+            self.counters["hits"] += 1
+            return sprite
+        cell = self._ensure(code)
+        if cell is None: return None
+        if size not in self.sizes:
+            # One-off size (e.g. a 300px blast icon): no page for it
+            row, col = divmod(cell, self.COLS)
+            with self.lock: src = self.atlas.crop((col * self.CELL, row * self.CELL, (col + 1) * self.CELL, (row + 1) * self.CELL))
+            sprite = src.resize((size, size), Image.Resampling.LANCZOS)
+            with self.lock:
+                sprite = self.sprites.setdefault(key, sprite)
+                self.counters["resized"] += 1
+            return sprite
+        page = self._page(size)
+        with self.lock:
+            page = self.pages[size]
+            row, col = divmod(cell, self.COLS)
+            sprite = self.sprites[key] = page.crop((col * size, row * size, (col + 1) * size, (row + 1) * size))
+            self.counters["crops"] += 1
+        return sprite
+
+    def stats(self):
+        return dict(self.counters, emoji=len(self.index), pages=sorted(self.pages), sprites=len(self.sprites))
+
+class AvatarService:
+    """
+    One avatar lookup for every card: direct URL -> /api/avatar/<id> -> dicebear,
+    fired as hedged parallel requests (next source starts after AVATAR_HEDGE_S
+    or as soon as the previous one fails), best source in order wins.
+    Dead URLs are negative-cached; avatars and their ready-to-paste
+    resized / circle variants live in one byte-bounded ImageCache.
+    """
+    def __init__(self, utils):
+        self.utils = utils
+        self.cache = ImageCache(AVATAR_CACHE_BYTES, ttl=AVATAR_MAX_AGE)
+        self.pool = ThreadPoolExecutor(max_workers=AVATAR_FETCHERS, thread_name_prefix="AvatarFetch")
+        self.lock = threading.Lock()
+        self.dead = {}   # url -> failed at
+        self.counters = {"lookups": 0, "hedged": 0, "negative_hits": 0, "fallbacks": 0, "placeholders": 0, "generated": 0}
+
+    def sources(self, user_id=None, username="", url=None, background="transparent"):
+        urls = []
+        if url and str(url) != "None" and str(url).startswith("http"): urls.append(str(url))
+        if user_id: urls.append(PLATFORM_AVATAR.format(user_id))
+        if username: urls.append(DICEBEAR_AVATAR.format(requests.utils.quote(str(username)), background))
+        return urls
+
+    def get(self, user_id=None, username="", url=None, size=None, circle=False, placeholder=None,
+            background="transparent", headers=None):
+        """
+        SHARED avatar image (paste-from only). size -> square LANCZOS resize,
+        circle=True -> straight-alpha circle crop (paste with itself as mask).
+        None from every source -> placeholder() (not cached) or None.
+        """
+        ident = (str(user_id or ""), str(url or ""), str(username or ""), background)
+        raw = self.cache.get(("raw",) + ident, lambda: self._lookup(self.sources(user_id, username, url, background), headers))
+        if raw is None:
+            self.counters["placeholders"] += 1
+            raw = placeholder() if placeholder else None
+            if raw is None or not size: return raw
+            return self._variant(raw, size, circle)
+        if not size: return raw
+        return self.cache.get((("circle" if circle else "square"), size) + ident, lambda: self._variant(raw, size, circle))
+
+    def _variant(self, raw, size, circle):
+        img = raw.convert("RGBA").resize((size, size), Image.Resampling.LANCZOS)
+        if circle:
+            img.putalpha(ImageChops.multiply(img.getchannel("A"), self.utils.get_mask("circle", size)))
+        return img
+
+    def _fetch(self, url, headers):
+        with self.lock:
+            failed = self.dead.get(url)
+            if failed and time.time() - failed < AVATAR_NEGATIVE_TTL:
+                self.counters["negative_hits"] += 1
+                return None
+        img = self.utils.fetch_image(url, AVATAR_MAX_AGE, AVATAR_TIMEOUT, headers)
+        with self.lock:
+            if img is None: self.dead[url] = time.time()
+            else: self.dead.pop(url, None)
+        return img
+
+    def _lookup(self, urls, headers):
+        """Hedged: returns the first source (in order) that worked, None if all failed / timed out"""
+        if not urls: return None
+        self.counters["lookups"] += 1
+        start = time.time()
+        deadline = start + AVATAR_TIMEOUT
+        futs, first_ok = [], None
+        while True:
+            for i, f in enumerate(futs):
+                if not f.done(): break
+                if f.result() is not None:
+                    if i: self.counters["fallbacks"] += 1
+                    return f.result()
+            else:
+                if len(futs) == len(urls): return None # Sab fail
+            now = time.time()
+            ok = [f.result() for f in futs if f.done() and f.result() is not None]
+            if ok:
+                first_ok = first_ok or now
+                if now - first_ok >= AVATAR_PREFER_S or now >= deadline:
+                    self.counters["fallbacks"] += 1
+                    return ok[0]
+            elif now >= deadline: return None
+            pending = [f for f in futs if not f.done()]
+            next_hedge = start + AVATAR_HEDGE_S * len(futs)
+            if len(futs) < len(urls) and (not pending or now >= next_hedge):
+                if futs: self.counters["hedged"] += 1
+                futs.append(self.pool.submit(self._fetch, urls[len(futs)], headers))
+                continue
+            waits = [deadline - now]
+            if len(futs) < len(urls): waits.append(next_hedge - now)
+            if first_ok: waits.append(first_ok + AVATAR_PREFER_S - now)
+            wait(pending, timeout=max(0.01, min(waits)), return_when=FIRST_COMPLETED)
+
+    # --- Procedural (offline) avatars ---
+    def generate(self, username, style="emoji", variant=0, mood=None, size=256):
+        """
+        Deterministic avatar from (username, style, variant[, mood]): same input =
+        same pixels, so it caches like any other avatar. SHARED RGBA, transparent bg.
+        """
+        if style not in AVATAR_STYLES: raise ValueError(f"Unknown avatar style '{style}'. Use one of: {', '.join(AVATAR_STYLES)}")
+        key = ("proc", str(username), style, int(variant) % AVATAR_VARIANTS, mood, size)
+        return self.cache.get(key, lambda: self._generate(*key[1:]), float("inf"))
+
+    def _generate(self, username, style, variant, mood, size):
+        seed = hashlib.blake2b(f"{username}|{style}|{variant}".encode(), digest_size=8).digest()
+        rng = random.Random(int.from_bytes(seed, "big"))
+        S = size * 2  # Drawn at 2x, one 2x2 box reduce = anti-aliased edges
+        hue = rng.random()
+        if style == "emoji":
+            mood = mood if mood in AVATAR_MOODS else rng.choice(AVATAR_MOODS)
+            if mood == "angry": hue = rng.uniform(0.0, 0.04)
+            else: hue = rng.uniform(0.1, 0.16) if rng.random() < 0.7 else hue
+            img = self._emoji_face(S, rng, mood, hue)
+        elif style == "geometric": img = self._geometric(S, rng, hue)
+        else: img = self._initials(S, username, hue)
+        self.counters["generated"] += 1
+        return img.reduce(2)
+
+    def _disc(self, S, hue, shape="circle", mode="radial"):
+        """Gradient-filled disc / tile from the shared gradient + mask caches"""
+        c1, c2 = _hsv(hue, 0.55, 1.0), _hsv((hue + 0.06) % 1, 0.8, 0.85)
+        img = Image.composite(Image.new('RGBA', (S, S), c2), Image.new('RGBA', (S, S), c1), self.utils.gradient_mask(S, S, mode))
+        img.putalpha(self.utils.get_mask(shape, S, S // 5, aa=1))
+        return img
+
+    def _emoji_face(self, S, rng, mood, hue):
+        k = S / 100
+        img = self._disc(S, hue)
+        d = ImageDraw.Draw(img)
+        ink = _hsv(hue, 0.9, 0.25)
+        d.ellipse([k, k, S-k, S-k], outline=_hsv(hue, 0.85, 0.7), width=round(2.5 * k))
+
+        if rng.random() < 0.5 and mood not in ("angry", "cool"): # Blush (blended, not overwritten)
+            blush = Image.new('RGBA', (S, S), (0,0,0,0))
+            bd = ImageDraw.Draw(blush)
+            for cx in (24, 76): bd.ellipse([(cx-9)*k, 56*k, (cx+9)*k, 66*k], fill=(255, 90, 120, 90))
+            img.alpha_composite(blush)
+
+        r = rng.uniform(5, 7) * k
+        eyes = ((35 * k, 42 * k), (65 * k, 42 * k))
+        w = round(4 * k)
+        if mood == "dizzy":
+            for x, y in eyes:
+                d.line([x-r, y-r, x+r, y+r], fill=ink, width=w); d.line([x-r, y+r, x+r, y-r], fill=ink, width=w)
+            d.ellipse([42*k, 62*k, 58*k, 80*k], outline=ink, width=w)
+            return img
+        if mood == "love":
+            for x, y in eyes:
+                hr = r * 0.75
+                d.ellipse([x-2*hr, y-hr*1.4, x, y+hr*0.6], fill=(230, 30, 60))
+                d.ellipse([x, y-hr*1.4, x+2*hr, y+hr*0.6], fill=(230, 30, 60))
+                d.polygon([(x-2*hr+hr*0.15, y), (x+2*hr-hr*0.15, y), (x, y+hr*2.2)], fill=(230, 30, 60))
+        elif mood == "cool":
+            d.rounded_rectangle([22*k, 34*k, 47*k, 51*k], radius=round(5*k), fill=ink)
+            d.rounded_rectangle([53*k, 34*k, 78*k, 51*k], radius=round(5*k), fill=ink)
+            d.line([47*k, 39*k, 53*k, 39*k], fill=ink, width=w)
+            d.arc([38*k, 52*k, 72*k, 76*k], 20, 110, fill=ink, width=w)
+            return img
+        else:
+            for x, y in eyes: d.ellipse([x-r*0.8, y-r, x+r*0.8, y+r], fill=ink)
+        if mood == "angry":
+            d.line([24*k, 28*k, 44*k, 35*k], fill=ink, width=w); d.line([76*k, 28*k, 56*k, 35*k], fill=ink, width=w)
+        if mood == "sad":
+            d.ellipse([63*k, 52*k, 69*k, 62*k], fill=(80, 170, 255))
+        if mood in ("sad", "angry"): d.arc([33*k, 64*k, 67*k, 88*k], 200, 340, fill=ink, width=w)
+        else: d.arc([30*k, 45*k, 70*k, 78*k], 20, 160, fill=ink, width=w)
+        return img
+
+    def _geometric(self, S, rng, hue):
+        """Identicon: mirrored 5x5 blocks on a gradient tile"""
+        img = self._disc(S, hue, rng.choice(("circle", "rounded")), "diagonal")
+        d = ImageDraw.Draw(img)
+        fg = _hsv((hue + 0.5) % 1, 0.35, 1.0)
+        cell, off = S * 0.6 / 5, S * 0.2
+        for row in range(5):
+            for col in range(3):
+                if rng.random() < 0.5: continue
+                for c in {col, 4 - col}:
+                    d.rectangle([off + c * cell, off + row * cell, off + (c + 1) * cell - 1, off + (row + 1) * cell - 1], fill=fg)
+        return img
+
+    def _initials(self, S, username, hue):
+        img = self._disc(S, hue, mode="diagonal")
+        d = ImageDraw.Draw(img)
+        words = [w for w in "".join(c if c.isalnum() else " " for c in str(username)).split() if w]
+        text = ("".join(w[0] for w in words[:2]) or "?").upper()
+        size = int(S * (0.42 if len(text) > 1 else 0.5))
+        self.utils.fonts.draw(d, (S / 2 + S * 0.012, S / 2 + S * 0.012), text, size, _hsv(hue, 0.9, 0.45), "mm")
+        self.utils.fonts.draw(d, (S / 2, S / 2), text, size, (255, 255, 255), "mm")
+        return img
+
+    def stats(self):
+        with self.lock: dead = len(self.dead)
+        return dict(self.counters, dead_urls=dead, cache=self.cache.stats())
+
+def _hsv(h, s, v):
+    return tuple(int(c * 255) for c in colorsys.hsv_to_rgb(h, s, v))
+
+class TaskRejected(RuntimeError):
+    pass
+
+class PriorityExecutor:
+    """
+    Fixed worker pool over one bounded queue per task class. Workers always
+    take the highest-priority runnable class; per-class running caps plus
+    RESERVED_WORKERS keep slots free for interactive work during a raid.
+    A full queue rejects the new task or drops (cancels) its oldest one.
+    Returned futures carry .timings (enqueued / started / finished).
+    """
+    def __init__(self, workers=MAX_WORKERS, classes=TASK_CLASSES, reserved=RESERVED_WORKERS):
+        self.workers = workers
+        self.classes = classes
+        self.top = next(iter(classes))
+        self.reserved = min(reserved, workers - 1)
+        self.cond = threading.Condition()
+        self.queues = {name: deque() for name in classes}
+        self.running = {name: 0 for name in classes}
+        self.counters = {name: {"submitted": 0, "done": 0, "failed": 0, "cancelled": 0, "rejected": 0, "dropped": 0} for name in classes}
+        self.waits = {name: deque(maxlen=TASK_SAMPLES) for name in classes}
+        self.runs = {name: deque(maxlen=TASK_SAMPLES) for name in classes}
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"ArtWorker-{i}", daemon=True).start()
+
+    def submit(self, klass, fn, *args, **kwargs):
+        if klass not in self.classes: raise ValueError(f"Unknown task class '{klass}'. Use one of: {', '.join(self.classes)}")
+        limit, policy, _ = self.classes[klass]
+        fut = Future()
+        fut.timings = {"class": klass, "enqueued": time.time(), "started": None, "finished": None}
+        with self.cond:
+            c = self.counters[klass]
+            c["submitted"] += 1
+            q = self.queues[klass]
+            if len(q) >= limit:
+                if policy != "drop_oldest":
+                    c["rejected"] += 1
+                    fut.set_exception(TaskRejected(f"{klass} queue full ({limit})"))
+                    print(f"[Utils] {klass} queue full, task rejected: {getattr(fn, '__name__', fn)}")
+                    return fut
+                q.popleft()[0].cancel(); c["dropped"] += 1
+            q.append((fut, fn, args, kwargs))
+            self.cond.notify()
+        return fut
+
+    def _next(self):
+        """Highest-priority class allowed to start now (caller holds cond)"""
+        others = sum(self.running.values()) - self.running[self.top]
+        for name, (_, _, max_running) in self.classes.items():
+            if not self.queues[name] or self.running[name] >= max_running: continue
+            if name != self.top and others >= self.workers - self.reserved: continue
+            return name
+        return None
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                name = self._next()
+                while name is None:
+                    self.cond.wait()
+                    name = self._next()
+                fut, fn, args, kwargs = self.queues[name].popleft()
+                self.running[name] += 1
+            t = fut.timings
+            t["started"] = time.time()
+            outcome = "done"
+            try:
+                # Caller ne queue mein hi cancel kar diya: nothing ran (drops are counted at submit)
+                if not fut.set_running_or_notify_cancel(): outcome = "cancelled"
+                else:
+                    try: fut.set_result(fn(*args, **kwargs))
+                    except BaseException as e:
+                        outcome = "failed"
+                        traceback.print_exc()
+                        fut.set_exception(e)
+            finally:
+                t["finished"] = time.time()
+                with self.cond:
+                    self.running[name] -= 1
+                    self.counters[name][outcome] += 1
+                    if outcome != "cancelled": # No wait/run sample for a task that never ran
+                        self.waits[name].append(t["started"] - t["enqueued"])
+                        self.runs[name].append(t["finished"] - t["started"])
+                    self.cond.notify_all() # A capped class may be runnable again
+
+    @staticmethod
+    def _ms(samples):
+        if not samples: return {"p50": 0, "p95": 0, "max": 0}
+        s = sorted(samples)
+        pick = lambda p: round(s[min(len(s) - 1, int(p * len(s)))] * 1000, 1)
+        return {"p50": pick(0.5), "p95": pick(0.95), "max": round(s[-1] * 1000, 1)}
+
+    def stats(self):
+        with self.cond:
+            return {name: dict(self.counters[name], queued=len(self.queues[name]), running=self.running[name],
+                               wait_ms=self._ms(self.waits[name]), run_ms=self._ms(self.runs[name]))
+                    for name in self.classes}
+
+class _Flight:
+    """One in-progress load; late callers wait on it instead of fetching again"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+class ImageCache:
+    """
+    True LRU sized by decoded bytes (w*h*bands), per-entry TTL, and
+    single-flight loads: N callers asking for the same key share one fetch.
+    """
+    def __init__(self, max_bytes=CACHE_BYTES, ttl=CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # key -> (img, nbytes, expires_at); end = most recent
+        self.inflight = {}             # key -> _Flight
+        self.bytes = 0
+        self.counters = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "expired": 0}
+
+    def get(self, key, loader, ttl=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                if entry[2] > time.time():
+                    self.entries.move_to_end(key)
+                    self.counters["hits"] += 1
+                    return entry[0]
+                self._drop(key); self.counters["expired"] += 1
+            flight = self.inflight.get(key)
+            if flight:
+                self.counters["coalesced"] += 1
+                leader = False
+            else:
+                flight = self.inflight[key] = _Flight()
+                self.counters["misses"] += 1
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            return flight.result
+
+        img = None
+        try: img = loader()
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+                if img is not None: self._put(key, img, self.ttl if ttl is None else ttl)
+            flight.result = img
+            flight.done.set()
+        return img
+
+    def _put(self, key, img, ttl):
+        nbytes = img.width * img.height * len(img.getbands())
+        if nbytes > self.max_bytes: return # Too big to keep, caller still gets it
+        if key in self.entries: self._drop(key)
+        self.entries[key] = (img, nbytes, time.time() + ttl)
+        self.bytes += nbytes
+        while self.bytes > self.max_bytes:
+            self._drop(next(iter(self.entries))) # Least recently used
+            self.counters["evictions"] += 1
+
+    def _drop(self, key):
+        self.bytes -= self.entries.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear(); self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries), bytes=self.bytes, max_bytes=self.max_bytes)
+
+class DiskCache:
+    """
+    Content-addressed asset cache on disk: blobs/<sha256> + index.json (URL -> blob).
+    Fresh entries are served with no network; stale ones are revalidated with
+    ETag/Last-Modified (304 = keep blob); a dead host gets the stale copy.
+    Size-bounded, least-recently-used URLs evicted first.
+    """
+    def __init__(self, folder=ASSET_DIR, max_bytes=ASSET_CACHE_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.index = {}   # url -> {sha, size, etag, modified, checked, used}
+        self.bytes = 0
+        self.counters = {"hits": 0, "revalidated": 0, "fetched": 0, "stale_served": 0, "evictions": 0, "errors": 0}
+        self.dirty = False
+        self.saved_at = 0
+        self._load()
+        atexit.register(self.flush)
+
+    def _blob(self, sha): return os.path.join(self.folder, "blobs", sha[:2], sha)
+    def _index_path(self): return os.path.join(self.folder, "index.json")
+
+    def _load(self):
+        try:
+            with open(self._index_path()) as f: index = json.load(f)
+        except (OSError, ValueError): index = {}
+        self.index = {u: e for u, e in index.items() if os.path.exists(self._blob(e["sha"]))}
+        self.bytes = sum({e["sha"]: e["size"] for e in self.index.values()}.values())
+
+    def _save(self):
+        """Caller holds self.lock"""
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            tmp = self._index_path() + ".tmp"
+            with open(tmp, "w") as f: json.dump(self.index, f)
+            os.replace(tmp, self._index_path())
+            self.dirty, self.saved_at = False, time.time()
+        except OSError: traceback.print_exc()
+
+    def _touch(self, entry, now, counter, **fields):
+        """Hit/304 bookkeeping: only timestamps change, so the index is saved on a debounce"""
+        with self.lock:
+            entry.update(used=now, **fields)
+            self.counters[counter] += 1
+            self.dirty = True
+            if now - self.saved_at >= ASSET_INDEX_SAVE_S: self._save()
+
+    def flush(self):
+        with self.lock:
+            if self.dirty: self._save()
+
+    def resolve(self, session, url, max_age=ASSET_MAX_AGE, timeout=5, headers=None):
+        """-> (blob_path, None) for a disk hit, (blob_path|None, bytes) after a download, (None, None) on failure"""
+        now = time.time()
+        with self.lock: entry = self.index.get(url)
+        path = self._blob(entry["sha"]) if entry else None
+        if entry and not os.path.exists(path): entry = path = None
+
+        if entry and now - entry["checked"] < max_age:
+            self._touch(entry, now, "hits")
+            return path, None
+
+        req = dict(headers or {})
+        if entry and entry.get("etag"): req["If-None-Match"] = entry["etag"]
+        if entry and entry.get("modified"): req["If-Modified-Since"] = entry["modified"]
+        try:
+            resp = session.get(url, timeout=timeout, headers=req)
+        except Exception as e:
+            print(f"[Utils] Download Error: {e}")
+            resp = None
+            self.counters["errors"] += 1
+
+        if entry and resp is not None and resp.status_code == 304:
+            self._touch(entry, now, "revalidated", checked=now)
+            return path, None
+        if resp is not None and resp.status_code == 200 and resp.content:
+            self.counters["fetched"] += 1
+            return self._put(url, resp.content, resp.headers, now), resp.content
+        if entry: # Host down / 5xx: purana copy better than nothing
+            self.counters["stale_served"] += 1
+            return path, None
+        return None, None
+
+    def _put(self, url, data, resp_headers, now):
+        sha = hashlib.sha256(data).hexdigest()
+        path = self._blob(sha)
+        with self.lock:
+            try:
+                if not os.path.exists(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    tmp = f"{path}.{threading.get_ident()}.tmp"
+                    with open(tmp, "wb") as f: f.write(data)
+                    os.replace(tmp, path)
+                    self.bytes += len(data)
+                old = self.index.get(url)
+                self.index[url] = {"sha": sha, "size": len(data), "etag": resp_headers.get("ETag"),
+                                   "modified": resp_headers.get("Last-Modified"), "checked": now, "used": now}
+                if old and old["sha"] != sha: self._unref(old)
+                self._evict()
+                self._save()
+            except OSError:
+                traceback.print_exc()
+                return None
+        return path if os.path.exists(path) else None
+
+    def _unref(self, entry):
+        """Deletes a blob once no URL points at it"""
+        if any(e["sha"] == entry["sha"] for e in self.index.values()): return
+        try: os.remove(self._blob(entry["sha"]))
+        except OSError: pass
+        self.bytes -= entry["size"]
+
+    def _evict(self):
+        if self.bytes <= self.max_bytes: return
+        for url in sorted(self.index, key=lambda u: self.index[u]["used"]):
+            if self.bytes <= self.max_bytes: break
+            self._unref(self.index.pop(url))
+            self.counters["evictions"] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, entries=len(self.index), bytes=self.bytes, max_bytes=self.max_bytes)
 
 # --- SINGLETON INSTANCE (Memory Efficient) ---
 utils_instance = HighPerformanceUtils()
+fonts = utils_instance.fonts
+utils_instance.run_async(utils_instance.emoji.prefetch, priority="background") # Atlas warm-up (offline dir / disk cache first)
 
 # =========================================================
 # --- ✅ PUBLIC COMMANDS (PLUGINS KE LIYE) ---
 # =========================================================
 
 # 1. Uploading
-def upload(bot, image_data, ext='png'):
-    """Image Upload karke URL deta hai - CRASH PROOF"""
+def upload(bot, image_data, ext='png', key=None, profile=None):
+    """Image Upload karke URL deta hai - CRASH PROOF (same bytes / same key = cached URL)"""
     return utils_instance.upload_image_fast(
         image_data, 
         bot.token, 
-        bot.user_id, 
-        ext
+        bot.user_id or 0, 
+        ext,
+        key,
+        profile
     )
 
+def encode(img, profile=None, webp=None): return utils_instance.encode_image(img, profile, webp)
+
 # 2. Asset Fetching
-def get_image(url): return utils_instance.download_image(url)
-def get_emoji(char, size=64): return utils_instance.get_emoji(char, size)
+def get_image(url, mutable=False): return utils_instance.download_image(url, mutable)
+def fetch_image(url, timeout=5, headers=None): return utils_instance.fetch_image(url, ASSET_MAX_AGE, timeout, headers)
+def fetch_avatar(url, timeout=5, headers=None): return utils_instance.fetch_image(url, AVATAR_MAX_AGE, timeout, headers)
+def avatar(user_id=None, username="", url=None, size=None, circle=False, placeholder=None, background="transparent", headers=None):
+    """Shared avatar service (hedged fetch, negative cache, cached sizes). SHARED image: paste-from only"""
+    return utils_instance.avatars.get(user_id, username, url, size, circle, placeholder, background, headers)
+def procedural_avatar(username, style="emoji", variant=0, mood=None, size=256):
+    """Offline, deterministic avatar (AVATAR_STYLES / AVATAR_MOODS). SHARED image: paste-from only"""
+    return utils_instance.avatars.generate(username, style, variant, mood, size)
+def paste_avatar(img, av, xy):
+    """Circle avatar (straight alpha) onto a card: composited, so RGBA cards keep opaque edges"""
+    if img.mode == 'RGBA': img.alpha_composite(av, tuple(xy))
+    else: img.paste(av, tuple(xy), av)
+def get_emoji(char, size=64): return utils_instance.get_emoji(char, size)   # Shared sprite: paste-from only
 def get_sticker(name, size=100): return utils_instance.get_sticker(name, size)
 
+def get_mask(shape, size, radius=0): return utils_instance.get_mask(shape, size, radius)
+def circle_mask(size): return utils_instance.get_mask("circle", size)
+def round_corners(img, radius): return utils_instance.round_corners(img, radius)
+
+# 2b. Layered Cards
+def static_layer(key, paint): return Layer(paint, key, static=True)
+def dynamic_layer(paint): return Layer(paint)
+def render_layers(name, size, layers, mode='RGBA', background=(0,0,0,0), radius=0):
+    return utils_instance.render_layers(name, size, layers, mode, background, radius)
+def static_image(key, build): return utils_instance.static_image(key, build)   # Shared: paste-from only
+
 def get_circle_avatar(url, size=100):
     img = utils_instance.download_image(url)
     if img: return utils_instance.circle_crop(img, size)
@@ -262,10 +1261,26 @@ def get_circle_avatar(url, size=100):
 
 # 3. Graphics Tools
 def create_canvas(w, h, color=(20,20,20)): return Image.new('RGBA', (w, h), color)
-def get_gradient(w, h, c1, c2): return utils_instance.make_gradient(w, h, c1, c2)
+def get_gradient(w, h, c1, c2, mode="vertical", mutable=True):
+    """mutable=False = shared cached image (paste-from only, no copy cost)"""
+    img = utils_instance.make_gradient(w, h, c1, c2, mode)
+    return img.copy() if mutable else img
 def draw_rounded_card(w, h, r, col, out=None, wth=0): return utils_instance.rounded_rect(w, h, r, col, out, wth)
 def write_text(draw, xy, text, size=20, col="white", align="left", shadow=True): 
     utils_instance.draw_text(draw, xy, text, size, col, align, shadow)
 
+def get_font(size, paths=None): return utils_instance.fonts.font(size, paths)
+
 # 4. Background Task
-def run_in_bg(task, *args): return utils_instance.run_async(task, *args)
+def run_in_bg(task, *args, priority=DEFAULT_TASK_CLASS): return utils_instance.run_async(task, *args, priority=priority)
+
+# 5. Stats
+def image_cache_stats(): return utils_instance._img_cache.stats()
+def disk_cache_stats(): return utils_instance._disk.stats()
+def mask_cache_stats(): return utils_instance._masks.stats()
+def font_cache_stats(): return utils_instance.fonts.stats()
+def upload_cache_stats(): return utils_instance._uploads.stats()
+def emoji_atlas_stats(): return utils_instance.emoji.stats()
+def executor_stats(): return utils_instance.executor.stats()
+def layer_cache_stats(): return utils_instance._layers.stats()
+def avatar_stats(): return utils_instance.avatars.stats()